@@ -0,0 +1,244 @@
+"""Registro delle attività e statistiche della sezione Progressi
+
+Ogni lettura, semplificazione, ascolto e salvataggio viene aggiunto a un
+registro di eventi (solo inserimenti). Nella stessa transazione vengono
+aggiornati i totali giornalieri e settimanali per studente e per l'intera
+scuola, così grafici, serie di giorni consecutivi e obiettivi si leggono
+da poche righe già aggregate invece di ricalcolarli dagli eventi.
+
+pandas e plotly vengono importati solo quando si costruiscono i grafici.
+"""
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from storage import get_storage
+
+# Tipi di evento
+READ = "lettura"
+SIMPLIFY = "semplificazione"
+LISTEN = "ascolto"
+SAVE = "salvataggio"
+
+# Nome riservato sotto cui stanno i totali di tutta la scuola: è vuoto perché
+# l'interfaccia non accetta nomi vuoti, così nessuno studente può usarlo
+ALL_USERS = ""
+# Minuti di studio giornalieri da raggiungere
+DAILY_GOAL_MINUTES = 45
+# Parole lette al minuto, per stimare il tempo di lettura
+WORDS_PER_MINUTE = 150
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    user TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    words INTEGER NOT NULL DEFAULT 0,
+    minutes REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_user_created ON events(user, created_at);
+
+CREATE TABLE IF NOT EXISTS daily_rollup (
+    user TEXT NOT NULL,
+    day TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    events INTEGER NOT NULL DEFAULT 0,
+    words INTEGER NOT NULL DEFAULT 0,
+    minutes REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (user, day, kind)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS weekly_rollup (
+    user TEXT NOT NULL,
+    week TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    events INTEGER NOT NULL DEFAULT 0,
+    words INTEGER NOT NULL DEFAULT 0,
+    minutes REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (user, week, kind)
+) WITHOUT ROWID;
+"""
+
+_UPSERT = """
+INSERT INTO {table} (user, {period}, kind, events, words, minutes) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (user, {period}, kind) DO UPDATE SET
+    events = events + excluded.events,
+    words = words + excluded.words,
+    minutes = minutes + excluded.minutes
+"""
+_UPSERT_DAILY = _UPSERT.format(table="daily_rollup", period="day")
+_UPSERT_WEEKLY = _UPSERT.format(table="weekly_rollup", period="week")
+
+
+def _week(day):
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+class EventLog:
+    """Registro eventi con aggregati giornalieri e settimanali aggiornati in scrittura"""
+
+    def __init__(self, store=None):
+        self.store = store or get_storage()
+        self.store.transaction(lambda conn: conn.executescript(SCHEMA)).result()
+
+    @property
+    def version(self):
+        """Cresce a ogni evento scritto (anche da altri processi): invalida i grafici in cache"""
+        return self.store._conn().execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def record(self, user, kind, words=0, minutes=0.0, timestamp=None):
+        """Aggiunge un evento in background; restituisce un `Future`"""
+        timestamp = timestamp or time.time()
+        day = datetime.fromtimestamp(timestamp).date()
+
+        def write(conn):
+            conn.execute(
+                "INSERT INTO events (user, kind, words, minutes, created_at) VALUES (?, ?, ?, ?, ?)",
+                (user, kind, words, minutes, timestamp)
+            )
+            for owner in (user, ALL_USERS):
+                conn.execute(_UPSERT_DAILY, (owner, day.isoformat(), kind, 1, words, minutes))
+                conn.execute(_UPSERT_WEEKLY, (owner, _week(day), kind, 1, words, minutes))
+
+        return self.store.transaction(write)
+
+    def iter_events(self, user, batch_size=500):
+        """Scorre gli eventi dell'utente dal più vecchio, a blocchi (per l'esportazione)"""
+        last_id = 0
+        while True:
+            rows = self.store._conn().execute(
+                "SELECT id, kind, words, minutes, created_at FROM events"
+                " WHERE user = ? AND id > ? ORDER BY id LIMIT ?",
+                (user, last_id, batch_size)
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
+            last_id = rows[-1]["id"]
+
+    def daily(self, user, days=30, today=None):
+        """Totali per giorno e tipo di evento negli ultimi `days` giorni"""
+        today = today or date.today()
+        start = (today - timedelta(days=days - 1)).isoformat()
+        rows = self.store._conn().execute(
+            "SELECT day, kind, events, words, minutes FROM daily_rollup"
+            " WHERE user = ? AND day >= ? ORDER BY day",
+            (user, start)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def weekly(self, user, weeks=12):
+        """Totali per settimana e tipo di evento delle ultime `weeks` settimane attive"""
+        rows = self.store._conn().execute(
+            "SELECT week, kind, events, words, minutes FROM weekly_rollup"
+            " WHERE user = ? AND week IN (SELECT DISTINCT week FROM weekly_rollup"
+            " WHERE user = ? ORDER BY week DESC LIMIT ?) ORDER BY week",
+            (user, user, weeks)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def summary(self, user, today=None):
+        """Obiettivo giornaliero, testi letti e giorni consecutivi di attività"""
+        today = today or date.today()
+        conn = self.store._conn()
+
+        def minutes_on(day):
+            return conn.execute(
+                "SELECT COALESCE(SUM(minutes), 0) FROM daily_rollup WHERE user = ? AND day = ?",
+                (user, day.isoformat())
+            ).fetchone()[0]
+
+        def reads_in(week):
+            return conn.execute(
+                "SELECT COALESCE(SUM(events), 0) FROM weekly_rollup WHERE user = ? AND week = ? AND kind = ?",
+                (user, week, READ)
+            ).fetchone()[0]
+
+        total_reads = conn.execute(
+            "SELECT COALESCE(SUM(events), 0) FROM weekly_rollup WHERE user = ? AND kind = ?",
+            (user, READ)
+        ).fetchone()[0]
+
+        # Giorni consecutivi con attività, fino a oggi (o ieri se oggi non si è ancora studiato)
+        active_days = {
+            row[0] for row in conn.execute(
+                "SELECT DISTINCT day FROM daily_rollup WHERE user = ? AND day >= ?",
+                (user, (today - timedelta(days=366)).isoformat())
+            )
+        }
+        streak = 0
+        day = today if today.isoformat() in active_days else today - timedelta(days=1)
+        while day.isoformat() in active_days:
+            streak += 1
+            day -= timedelta(days=1)
+
+        return {
+            "minutes_today": minutes_on(today),
+            "minutes_yesterday": minutes_on(today - timedelta(days=1)),
+            "goal_minutes": DAILY_GOAL_MINUTES,
+            "total_reads": total_reads,
+            "reads_this_week": reads_in(_week(today)),
+            "streak": streak,
+            "active_today": today.isoformat() in active_days,
+        }
+
+
+def progress_dataframe(rows, days=30, today=None):
+    """Tabella giornaliera dei progressi a partire dagli aggregati"""
+    import pandas as pd
+
+    today = today or date.today()
+    index = pd.date_range(end=pd.Timestamp(today), periods=days, freq="D")
+    df = pd.DataFrame(rows, columns=["day", "kind", "events", "words", "minutes"])
+    df["day"] = pd.to_datetime(df["day"])
+
+    def per_day(frame, column):
+        return frame.groupby("day")[column].sum().reindex(index, fill_value=0)
+
+    return pd.DataFrame({
+        "Data": index.strftime("%d/%m"),
+        "Testi Letti": per_day(df[df["kind"] == READ], "events").to_numpy(),
+        "Minuti di Studio": per_day(df, "minutes").round(1).to_numpy(),
+        "Parole Semplificate": per_day(df[df["kind"] == SIMPLIFY], "words").to_numpy(),
+    })
+
+
+def progress_charts(df):
+    """Grafico dei progressi e grafico del tempo di studio"""
+    import plotly.express as px
+
+    # Grafico linee
+    progress_fig = px.line(
+        df,
+        x="Data",
+        y=["Testi Letti", "Parole Semplificate"],
+        title="📈 Progressi degli ultimi 30 giorni",
+        markers=True
+    )
+
+    # Grafico a barre
+    time_fig = px.bar(
+        df,
+        x="Data",
+        y="Minuti di Studio",
+        title="⏰ Tempo di Studio",
+        color="Minuti di Studio",
+        color_continuous_scale="Blues"
+    )
+    return progress_fig, time_fig
+
+
+_event_log = None
+_event_log_lock = threading.Lock()
+
+
+def get_event_log():
+    """Registro eventi condiviso dal processo"""
+    global _event_log
+    with _event_log_lock:
+        if _event_log is None:
+            _event_log = EventLog()
+        return _event_log
@@ -0,0 +1,224 @@
+"""Risultati grandi di ogni sessione (audio, testi estratti, testi semplificati) con memoria limitata
+
+Ogni sessione Streamlit ha un `ArtifactStore`: in `st.session_state` resta
+solo l'archivio con nomi e dimensioni, mentre i contenuti stanno in una
+LRU in memoria con un tetto per sessione e uno per l'intero processo. Le
+voci meno usate oltre il tetto vengono scritte in una cartella temporanea
+della sessione e rilette quando servono; anche lo spazio su disco ha un
+tetto per sessione e uno globale, oltre i quali le voci più vecchie si
+eliminano.
+
+La cartella della sessione si cancella quando la sessione finisce (quando
+Streamlit libera il suo stato); quelle rimaste da processi terminati male
+vengono eliminate dopo `STALE_SECONDS`.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from cache import CACHE_DIR
+
+ARTIFACT_DIR = os.path.join(CACHE_DIR, "sessioni")
+# Byte in memoria per sessione e per tutte le sessioni del processo
+SESSION_MEMORY_BYTES = int(os.environ.get("DSA_SESSION_MEMORY_BYTES", str(8 * 1024 * 1024)))
+TOTAL_MEMORY_BYTES = int(os.environ.get("DSA_ARTIFACT_MEMORY_BYTES", str(256 * 1024 * 1024)))
+# Byte su disco per sessione e per tutte le sessioni del processo
+SESSION_DISK_BYTES = int(os.environ.get("DSA_SESSION_DISK_BYTES", str(256 * 1024 * 1024)))
+TOTAL_DISK_BYTES = int(os.environ.get("DSA_ARTIFACT_DISK_BYTES", str(4 * 1024 * 1024 * 1024)))
+# Cartelle di sessione non più toccate da questo tempo vengono eliminate
+STALE_SECONDS = 24 * 3600
+
+_lock = threading.RLock()
+_stores = weakref.WeakSet()
+_swept = False
+
+
+class _Artifact:
+    __slots__ = ("size", "is_text", "value", "path", "used")
+
+    def __init__(self, size, is_text, value):
+        self.size = size
+        self.is_text = is_text
+        self.value = value
+        self.path = None
+        self.used = time.monotonic()
+
+
+def _remove_directory(path):
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def sweep_stale(max_age=STALE_SECONDS):
+    """Elimina le cartelle di sessione abbandonate (es. dopo un riavvio brusco)"""
+    limit = time.time() - max_age
+    try:
+        names = os.listdir(ARTIFACT_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(ARTIFACT_DIR, name)
+        try:
+            if os.path.getmtime(path) < limit:
+                _remove_directory(path)
+        except OSError:
+            pass
+
+
+class ArtifactStore:
+    """Voci di una sessione (byte o testo) per nome, in memoria o su disco"""
+
+    def __init__(self, memory_bytes=SESSION_MEMORY_BYTES, disk_bytes=SESSION_DISK_BYTES):
+        global _swept
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._items = OrderedDict()
+        self._directory = None
+        with _lock:
+            if not _swept:
+                _swept = True
+                sweep_stale()
+            _stores.add(self)
+
+    # --- tetti di spazio ---
+
+    def _memory_used(self):
+        return sum(item.size for item in self._items.values() if item.value is not None)
+
+    def _disk_used(self):
+        return sum(item.size for item in self._items.values() if item.path is not None)
+
+    def _spill(self, name, item):
+        """Scrive la voce su disco (se non c'è già) e la toglie dalla memoria"""
+        if item.path is None:
+            if self._directory is None:
+                os.makedirs(ARTIFACT_DIR, exist_ok=True)
+                self._directory = tempfile.mkdtemp(dir=ARTIFACT_DIR)
+                weakref.finalize(self, _remove_directory, self._directory)
+            fd, item.path = tempfile.mkstemp(dir=self._directory)
+            with os.fdopen(fd, "wb") as f:
+                f.write(item.value.encode("utf-8") if item.is_text else item.value)
+        item.value = None
+
+    def _drop(self, name):
+        item = self._items.pop(name)
+        if item.path is not None:
+            try:
+                os.remove(item.path)
+            except OSError:
+                pass
+
+    def _enforce(self):
+        """Porta memoria e disco entro i tetti della sessione e del processo, partendo dalle voci meno usate"""
+        memory = self._memory_used()
+        for name, item in list(self._items.items()):
+            if memory <= self.memory_bytes:
+                break
+            if item.value is not None:
+                self._spill(name, item)
+                memory -= item.size
+        disk = self._disk_used()
+        for name, item in list(self._items.items()):
+            if disk <= self.disk_bytes:
+                break
+            if item.path is not None and item.value is None:
+                self._drop(name)
+                disk -= item.size
+        _enforce_total()
+
+    # --- interfaccia ---
+
+    def put(self, name, value):
+        """Salva byte o testo con questo nome, sostituendo la voce precedente"""
+        is_text = isinstance(value, str)
+        size = len(value.encode("utf-8")) if is_text else len(value)
+        with _lock:
+            if name in self._items:
+                self._drop(name)
+            self._items[name] = _Artifact(size, is_text, value)
+            self._enforce()
+
+    def get(self, name, default=None):
+        """Contenuto della voce, riletto dal disco se era stato spostato; `default` se non c'è più"""
+        with _lock:
+            item = self._items.get(name)
+            if item is None:
+                return default
+            self._items.move_to_end(name)
+            item.used = time.monotonic()
+            if item.value is not None:
+                return item.value
+            try:
+                with open(item.path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                self._items.pop(name)
+                return default
+            value = data.decode("utf-8") if item.is_text else data
+            if item.size <= self.memory_bytes:
+                # Torna in memoria (il file resta: se esce di nuovo non va riscritto)
+                item.value = value
+                self._enforce()
+            return value
+
+    def __contains__(self, name):
+        with _lock:
+            return name in self._items
+
+    def discard(self, name):
+        with _lock:
+            if name in self._items:
+                self._drop(name)
+
+    def clear(self):
+        with _lock:
+            for name in list(self._items):
+                self._drop(name)
+
+    def footprint(self):
+        """Byte occupati dalla sessione in memoria e su disco, e numero di voci"""
+        with _lock:
+            return {"memory": self._memory_used(), "disk": self._disk_used(), "items": len(self._items)}
+
+
+def _enforce_total():
+    """Tetti dell'intero processo: si sposta o si elimina la voce meno usata tra tutte le sessioni"""
+    stores = list(_stores)
+    memory = sum(store._memory_used() for store in stores)
+    if memory > TOTAL_MEMORY_BYTES:
+        candidates = sorted(
+            (item.used, id(store), name, store, item)
+            for store in stores for name, item in store._items.items() if item.value is not None
+        )
+        for _, _, name, store, item in candidates:
+            if memory <= TOTAL_MEMORY_BYTES:
+                break
+            store._spill(name, item)
+            memory -= item.size
+    disk = sum(store._disk_used() for store in stores)
+    if disk > TOTAL_DISK_BYTES:
+        candidates = sorted(
+            (item.used, id(store), name, store, item)
+            for store in stores for name, item in store._items.items()
+            if item.path is not None and item.value is None
+        )
+        for _, _, name, store, item in candidates:
+            if disk <= TOTAL_DISK_BYTES:
+                break
+            store._drop(name)
+            disk -= item.size
+
+
+def usage():
+    """Totali del processo: sessioni con voci, byte in memoria e su disco, sessione più pesante"""
+    with _lock:
+        footprints = [store.footprint() for store in list(_stores)]
+    return {
+        "sessions": sum(1 for f in footprints if f["items"]),
+        "memory": sum(f["memory"] for f in footprints),
+        "disk": sum(f["disk"] for f in footprints),
+        "max_session": max((f["memory"] + f["disk"] for f in footprints), default=0),
+    }
@@ -0,0 +1,283 @@
+"""Elaborazione in blocco di una cartella di PDF, immagini e registrazioni, senza interfaccia.
+
+Per ogni file scrive nella cartella di uscita, in una sottocartella con il nome completo
+del file (es. `lezione.pdf/`, così `lezione.pdf` e `lezione.jpg` non si sovrappongono), il
+testo estratto (o trascritto), il testo semplificato, la mappa concettuale e l'audio MP3
+del testo semplificato.
+I file vengono elaborati in un pool di processi; le richieste al modello
+sono limitate da un semaforo condiviso tra tutti i processi. Un manifest
+(`manifest.json`) registra i file completati: rieseguendo il comando i
+file non modificati vengono saltati.
+
+    python batch.py materiali/ uscita/
+    python batch.py materiali/ uscita/ --workers 4 --llm-concurrency 6 --no-audio
+
+La chiave OpenAI si legge da OPENAI_API_KEY; con DSA_LLM_BACKEND=fake e
+DSA_TTS_BACKEND=fake il comando funziona senza rete. Le registrazioni sono
+trascritte offline con Vosk se è installato e DSA_VOSK_MODEL indica il
+modello, altrimenti con il servizio di Google; con DSA_STT_BACKEND=fake dal
+motore finto.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from llm import ChatBackend, estimate_tokens
+
+PDF_EXTENSIONS = {".pdf"}
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp"}
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".m4a", ".ogg", ".flac", ".webm"}
+MANIFEST = "manifest.json"
+# Versione del formato delle uscite: cambiandola tutti i file vengono rielaborati
+OUTPUT_VERSION = 1
+
+
+class BoundedBackend(ChatBackend):
+    """Modello con un numero massimo di richieste contemporanee tra tutti i processi,
+    che conta anche i token scambiati"""
+
+    def __init__(self, backend, semaphore):
+        self.backend = backend
+        self.name = backend.name
+        self.semaphore = semaphore
+        self.tokens = 0
+        self._lock = threading.Lock()
+
+    def stream(self, messages, model, params, api_key=None):
+        with self.semaphore:
+            produced = []
+            try:
+                for piece in self.backend.stream(messages, model, params, api_key):
+                    produced.append(piece)
+                    yield piece
+            finally:
+                sent = sum(estimate_tokens(m["content"]) for m in messages)
+                with self._lock:
+                    self.tokens += sent + estimate_tokens("".join(produced))
+
+    def take(self):
+        """Token accumulati dall'ultima chiamata, poi azzerati"""
+        with self._lock:
+            tokens, self.tokens = self.tokens, 0
+        return tokens
+
+
+_backend = None
+
+
+def _init_worker(semaphore):
+    global _backend
+    from llm import get_chat_backend, use_backend
+
+    _backend = BoundedBackend(get_chat_backend(), semaphore)
+    use_backend(_backend)
+
+
+def _worker_backend():
+    """Modello del processo corrente, impostato da `_init_worker` all'avvio del processo del pool"""
+    if _backend is None:
+        raise RuntimeError("process_file va eseguito in un processo del pool avviato da run() "
+                           "(initializer=_init_worker)")
+    return _backend
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write(path, data):
+    """Scrittura atomica: un file interrotto a metà non viene mai lasciato su disco"""
+    mode = "wb" if isinstance(data, bytes) else "w"
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, mode, **({} if mode == "wb" else {"encoding": "utf-8"})) as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def extract(path):
+    """Testo e numero di pagine di un PDF, di un'immagine o di una registrazione (0 pagine)"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in AUDIO_EXTENSIONS:
+        from transcribe import transcribe_text
+
+        # Un solo thread per file: il parallelismo è già tra i file
+        return transcribe_text(path, max_workers=1), 0
+
+    if extension in PDF_EXTENSIONS:
+        from ingest import iter_pdf_pages
+
+        # Un solo processo per file: il parallelismo è già tra i file
+        pages = list(iter_pdf_pages(path, max_workers=1))
+        return "".join(text for _, text, _ in pages), len(pages)
+
+    from ingest import ocr_image
+
+    return ocr_image(path), 1
+
+
+def process_file(path, out_dir, audio=True, mind_map=True, language="it"):
+    """Elabora un file (in un processo del pool) e restituisce le statistiche"""
+    try:
+        return _process_file(path, out_dir, audio, mind_map, language)
+    except Exception as e:
+        # Alcune eccezioni (es. di pytesseract) non si ricostruiscono nel processo
+        # principale e romperebbero il pool: passano come semplice messaggio
+        raise RuntimeError(str(e)) from None
+
+
+def _process_file(path, out_dir, audio, mind_map, language):
+    from llm import create_mind_map, simplify_long_text
+    from tts import text_to_speech
+
+    backend = _worker_backend()
+    started = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    backend.take()
+
+    text, pages = extract(path)
+    if not text.strip():
+        raise RuntimeError("nessun testo riconosciuto")
+    outputs = {"testo": "testo.txt"}
+    _write(os.path.join(out_dir, "testo.txt"), text)
+
+    simplified = simplify_long_text(text)
+    tokens = backend.take()
+    outputs["semplificato"] = "semplificato.txt"
+    _write(os.path.join(out_dir, "semplificato.txt"), simplified)
+
+    if mind_map:
+        structure = create_mind_map(text)
+        tokens += backend.take()
+        outputs["mappa"] = "mappa.txt"
+        _write(os.path.join(out_dir, "mappa.txt"), structure)
+
+    if audio:
+        outputs["audio"] = "audio.mp3"
+        _write(os.path.join(out_dir, "audio.mp3"), text_to_speech(simplified, language).getvalue())
+
+    return {
+        "pages": pages,
+        "tokens": tokens,
+        "seconds": time.perf_counter() - started,
+        "outputs": outputs,
+    }
+
+
+def find_inputs(input_dir):
+    """File da elaborare, in ordine, con il percorso relativo alla cartella"""
+    found = []
+    for root, _, files in os.walk(input_dir):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in PDF_EXTENSIONS | IMAGE_EXTENSIONS | AUDIO_EXTENSIONS:
+                path = os.path.join(root, name)
+                found.append((os.path.relpath(path, input_dir), path))
+    return sorted(found)
+
+
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _is_complete(entry, digest, out_dir, options):
+    if not entry or entry.get("status") != "completato":
+        return False
+    if entry.get("sha256") != digest or entry.get("options") != options:
+        return False
+    return all(os.path.exists(os.path.join(out_dir, name)) for name in entry["outputs"].values())
+
+
+def run(input_dir, output_dir, workers=None, llm_concurrency=4, audio=True, mind_map=True,
+        language="it", log=print):
+    """Elabora la cartella e restituisce il riepilogo con le prestazioni"""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    options = {"audio": audio, "mind_map": mind_map, "language": language, "version": OUTPUT_VERSION}
+
+    todo, skipped = [], 0
+    for relpath, path in find_inputs(input_dir):
+        digest = _file_digest(path)
+        # Con l'estensione: file con lo stesso nome e tipo diverso hanno cartelle diverse
+        out_dir = os.path.join(output_dir, relpath)
+        if _is_complete(manifest.get(relpath), digest, out_dir, options):
+            skipped += 1
+        else:
+            todo.append((relpath, path, digest, out_dir))
+    log(f"{len(todo)} file da elaborare, {skipped} già completati")
+
+    totals = {"files": 0, "failed": 0, "pages": 0, "tokens": 0}
+    started = time.perf_counter()
+    semaphore = multiprocessing.get_context().BoundedSemaphore(llm_concurrency)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(semaphore,)) as pool:
+        futures = {
+            pool.submit(process_file, path, out_dir, audio, mind_map, language): (relpath, digest)
+            for relpath, path, digest, out_dir in todo
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            relpath, digest = futures[future]
+            entry = {"sha256": digest, "options": options}
+            try:
+                entry.update(future.result(), status="completato")
+                totals["files"] += 1
+                totals["pages"] += entry["pages"]
+                totals["tokens"] += entry["tokens"]
+                log(f"[{done}/{len(todo)}] {relpath}: {entry['pages']} pagine, "
+                    f"{entry['tokens']} token, {entry['seconds']:.1f} s")
+            except Exception as e:
+                entry.update(status="errore", error=str(e))
+                totals["failed"] += 1
+                log(f"[{done}/{len(todo)}] {relpath}: errore - {e}")
+            manifest[relpath] = entry
+            # Il manifest viene aggiornato dopo ogni file, così un'interruzione non perde lavoro
+            _write(os.path.join(output_dir, MANIFEST), json.dumps(manifest, indent=2, ensure_ascii=False))
+
+    minutes = max(time.perf_counter() - started, 1e-9) / 60
+    totals.update(
+        skipped=skipped,
+        seconds=minutes * 60,
+        pages_per_minute=totals["pages"] / minutes,
+        tokens_per_minute=totals["tokens"] / minutes,
+    )
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input_dir", help="cartella con PDF e immagini")
+    parser.add_argument("output_dir", help="cartella in cui scrivere i risultati")
+    parser.add_argument("--workers", type=int, default=None, help="processi (predefinito: CPU disponibili)")
+    parser.add_argument("--llm-concurrency", type=int, default=4,
+                        help="richieste contemporanee al modello, tra tutti i processi")
+    parser.add_argument("--language", default="it", help="lingua dell'audio")
+    parser.add_argument("--no-audio", action="store_true", help="non generare l'audio")
+    parser.add_argument("--no-map", action="store_true", help="non generare la mappa concettuale")
+    args = parser.parse_args()
+
+    totals = run(args.input_dir, args.output_dir, workers=args.workers,
+                 llm_concurrency=args.llm_concurrency, audio=not args.no_audio,
+                 mind_map=not args.no_map, language=args.language)
+    print(
+        f"\n{totals['files']} file completati, {totals['failed']} con errori, "
+        f"{totals['skipped']} saltati in {totals['seconds']:.1f} s\n"
+        f"{totals['pages_per_minute']:.1f} pagine/min · {totals['tokens_per_minute']:.0f} token/min"
+    )
+    sys.exit(1 if totals["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
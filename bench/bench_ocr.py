@@ -0,0 +1,136 @@
+"""Confronto tra OCR diretto e pipeline con preprocessing su immagini sintetiche.
+
+Genera "foto" di pagine di testo italiano (12 megapixel, leggermente ruotate,
+con rumore, illuminazione non uniforme e orientamento EXIF) e misura per
+ciascun percorso la latenza e l'accuratezza sui caratteri.
+
+    python bench/bench_ocr.py --images 6 --json risultati_ocr.json
+"""
+import argparse
+import difflib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+import pytesseract
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest  # noqa: E402
+
+SENTENCES = [
+    "La fotosintesi è il processo con cui le piante producono zuccheri usando la luce.",
+    "Durante la rivoluzione industriale le città crebbero molto rapidamente.",
+    "Il fiume Po attraversa la pianura padana da ovest verso est.",
+    "Per risolvere un'equazione bisogna isolare l'incognita.",
+    "Gli antichi Romani costruirono strade, ponti e acquedotti in tutto l'impero.",
+    "Il cuore pompa il sangue attraverso arterie e vene.",
+    "La Divina Commedia è divisa in tre cantiche: Inferno, Purgatorio e Paradiso.",
+    "L'acqua bolle a cento gradi al livello del mare.",
+]
+
+
+def _font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def make_page(rng, lines=18):
+    """Pagina pulita a 300 DPI con il testo di riferimento"""
+    text_lines = [rng.choice(SENTENCES) for _ in range(lines)]
+    page = Image.new("L", (2480, 3508), 255)
+    draw = ImageDraw.Draw(page)
+    font = _font(44)
+    for i, line in enumerate(text_lines):
+        draw.text((160, 200 + i * 90), line, fill=20, font=font)
+    return page, "\n".join(text_lines)
+
+
+def photograph(page, rng):
+    """Simula la foto di un telefono: 12 MP, rotazione, luce non uniforme, rumore"""
+    photo = page.rotate(rng.uniform(-3, 3), resample=Image.BICUBIC, expand=True, fillcolor=235)
+    photo = photo.resize((3000, 4000), Image.BICUBIC)
+    pixels = np.asarray(photo, dtype=np.float32)
+    gradient = np.linspace(0.75, 1.0, pixels.shape[1], dtype=np.float32)
+    pixels = pixels * gradient[None, :] + np.random.default_rng(rng.randrange(2 ** 32)).normal(0, 12, pixels.shape)
+    photo = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).convert("RGB")
+
+    # Metà delle foto è salvata "di lato" con l'orientamento nei metadati EXIF
+    exif = Image.Exif()
+    if rng.random() < 0.5:
+        photo = photo.rotate(90, expand=True)
+        exif[0x0112] = 6
+    buffer = io.BytesIO()
+    photo.save(buffer, "JPEG", quality=85, exif=exif)
+    return buffer.getvalue()
+
+
+def accuracy(expected, actual):
+    """Accuratezza sui caratteri (spazi normalizzati)"""
+    expected = " ".join(expected.split())
+    actual = " ".join(actual.split())
+    return difflib.SequenceMatcher(None, expected, actual, autojunk=False).ratio()
+
+
+def run(images, seed):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(images):
+        page, reference = make_page(rng)
+        corpus.append((photograph(page, rng), reference))
+
+    results = {"diretto": [], "pipeline": [], "pipeline_cache": []}
+    for data, reference in corpus:
+        started = time.perf_counter()
+        text = pytesseract.image_to_string(Image.open(io.BytesIO(data)), lang='ita')
+        results["diretto"].append((time.perf_counter() - started, accuracy(reference, text)))
+
+        started = time.perf_counter()
+        prepared = ingest.preprocess_image(Image.open(io.BytesIO(data)))
+        text = ingest._ocr_tiles(prepared, 'ita', ingest.OCR_DPI)
+        results["pipeline"].append((time.perf_counter() - started, accuracy(reference, text)))
+
+        ingest.ocr_image(data)
+        started = time.perf_counter()
+        text = ingest.ocr_image(data)
+        results["pipeline_cache"].append((time.perf_counter() - started, accuracy(reference, text)))
+
+    summary = {}
+    for name, values in results.items():
+        latencies = [v[0] for v in values]
+        summary[name] = {
+            "latenza_media_s": statistics.mean(latencies),
+            "latenza_max_s": max(latencies),
+            "accuratezza_media": statistics.mean(v[1] for v in values),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=6, help="numero di immagini generate")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="salva i risultati in questo file")
+    args = parser.parse_args()
+
+    summary = run(args.images, args.seed)
+    print(f"{'percorso':<16}{'latenza media':>16}{'latenza max':>14}{'accuratezza':>14}")
+    for name, row in summary.items():
+        print(f"{name:<16}{row['latenza_media_s']:>14.2f} s{row['latenza_max_s']:>12.2f} s"
+              f"{row['accuratezza_media']:>13.1%}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Tempo di import dei moduli e di riesecuzione dello script Streamlit.
+
+Misura con `python -X importtime` il costo di import dei sottosistemi e,
+con l'AppTest di Streamlit, la prima esecuzione e le riesecuzioni dello
+script. Esce con codice 1 se un valore supera il budget in `budget.json`
+o se librerie che dovrebbero essere importate solo al bisogno vengono
+caricate dall'import dei moduli dell'app (controllato con `-X importtime`)
+o per la prima volta durante una riesecuzione senza interazioni
+(controllato su `sys.modules` dopo le riesecuzioni dell'AppTest).
+
+    python bench/bench_startup.py
+    python bench/bench_startup.py --reruns 20 --json risultati_avvio.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "tempCodeRunnerFile.py")
+BUDGET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "budget.json")
+
+MODULES = ["cache", "llm", "ingest", "tts", "analytics", "jobs", "transcribe", "mindmap", "document", "reader",
+           "related", "artifacts", "export",
+           "syllables"]
+
+
+def measure_imports():
+    """Tempo cumulativo di import (ms) per ciascun modulo dell'app, in un processo pulito"""
+    code = "import " + ", ".join(MODULES)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    timings = {}
+    loaded = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line.split("|")
+        name = parts[2].strip()
+        loaded.add(name.split(".")[0])
+        if name in MODULES:
+            timings[name] = int(parts[1]) / 1000
+    return timings, loaded
+
+
+def measure_reruns(reruns):
+    """Prima esecuzione e riesecuzioni dello script senza interazioni"""
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(SCRIPT, default_timeout=120)
+    started = time.perf_counter()
+    app.run()
+    first_run = (time.perf_counter() - started) * 1000
+    if app.exception:
+        raise RuntimeError(f"Lo script ha sollevato un'eccezione: {app.exception}")
+
+    # AppTest esegue lo script in questo processo: ciò che compare in sys.modules
+    # dopo la prima esecuzione è stato caricato dalle riesecuzioni
+    loaded_before = set(sys.modules)
+    timings = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        app.run()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    loaded = {name.split(".")[0] for name in set(sys.modules) - loaded_before}
+    return {
+        "first_run_ms": first_run,
+        "rerun_p50_ms": statistics.median(timings),
+        "rerun_p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+    }, loaded
+
+
+def check(results, budget):
+    """Confronta i risultati con il budget e restituisce gli sforamenti"""
+    failures = []
+    for key, limit in budget.get("limits", {}).items():
+        value = results.get(key)
+        if value is not None and value > limit:
+            failures.append(f"{key}: {value:.1f} > {limit}")
+    for module in budget.get("lazy_modules", []):
+        if module in results["loaded_at_import"]:
+            failures.append(f"'{module}' viene caricato all'import dei moduli dell'app")
+        if module in results["loaded_at_rerun"]:
+            failures.append(f"'{module}' viene caricato a una riesecuzione dello script")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reruns", type=int, default=10)
+    parser.add_argument("--budget", default=BUDGET)
+    parser.add_argument("--json", help="salva i risultati in questo file")
+    args = parser.parse_args()
+
+    # Archivio e cache in una cartella temporanea: lo script eseguito dall'AppTest
+    # non tocca il database e le cache di chi lancia il benchmark
+    with tempfile.TemporaryDirectory(prefix="dsa_startup_") as scratch:
+        os.environ["DSA_DATA_DIR"] = os.path.join(scratch, "dati")
+        os.environ["DSA_CACHE_DIR"] = os.path.join(scratch, "cache")
+        os.environ.pop("DSA_DB_PATH", None)
+        os.environ.pop("DSA_METRICS_FILE", None)
+        import_timings, loaded = measure_imports()
+        rerun_timings, loaded_at_rerun = measure_reruns(args.reruns)
+    results = {f"import_{name}_ms": value for name, value in import_timings.items()}
+    results["import_total_ms"] = sum(import_timings.values())
+    results.update(rerun_timings)
+
+    for key, value in results.items():
+        print(f"{key:<24}{value:>10.1f}")
+    results["loaded_at_import"] = sorted(loaded)
+    results["loaded_at_rerun"] = sorted(loaded_at_rerun)
+
+    with open(args.budget, encoding="utf-8") as f:
+        failures = check(results, json.load(f))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if failures:
+        print("\nBudget superato:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("\nBudget rispettato")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,528 @@
+"""Benchmark dei percorsi dell'app, senza rete e riproducibile.
+
+Su un corpus sintetico (vedi `corpus.py`) misura estrazione dai PDF,
+preprocessing e OCR delle immagini, leggibilità, evidenziazione, divisione
+e sintesi del testo per l'audio, scaletta delle mappe concettuali,
+trascrizione delle registrazioni, chiamate al modello e la catena completa
+PDF → audio. Modello, sintesi e
+riconoscimento vocale sono sostituiti dai motori finti con latenza
+configurabile (oppure, con `--llm-stub`, dal client HTTP vero verso
+`llm_stub.py`); le cache sono in una cartella temporanea e vengono
+svuotate prima di ogni misura "a freddo". L'OCR con Tesseract viene saltato
+se il programma non è installato.
+
+I risultati (mediana e p95 per caso, pagine/parole/token al secondo e le
+fasi registrate da `metrics`) si salvano in JSON e si confrontano con
+`baseline.json`: il comando esce con codice 1 se un caso è più lento della
+baseline oltre la tolleranza (con `--report-only` le regressioni vengono
+solo elencate).
+
+Il confronto non usa la mediana ma il tempo migliore del caso, meno
+disturbato dagli altri processi: i casi veloci si ripetono per almeno un
+secondo, così le esecuzioni non cadono tutte in un momento di carico, e i
+casi che risultano più lenti vengono rimisurati prima di segnalarli. Si tiene
+anche conto della velocità della macchina: all'inizio si misura un lavoro
+fisso di calibrazione e, se la macchina è più lenta di quando è stata
+registrata la baseline, i riferimenti si allargano in proporzione. Non si
+stringono mai: i casi che aspettano le latenze dei motori finti non
+diventano più veloci con la macchina.
+
+    python bench/bench_suite.py
+    python bench/bench_suite.py --quick --only llm --json risultati.json
+    python bench/bench_suite.py --llm-stub --startup
+    python bench/bench_suite.py --update-baseline
+"""
+import argparse
+import fnmatch
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+sys.path.insert(0, ROOT)
+
+import corpus  # noqa: E402
+
+# Tolleranza predefinita rispetto alla baseline (0.3 = 30% più lento)
+TOLERANCE = 0.3
+# Margine assoluto, per non segnalare variazioni di pochi millisecondi
+MIN_SLACK_MS = 2.0
+# Esecuzioni del lavoro di calibrazione prima di ogni caso (se ne tiene la più veloce)
+# Durata minima delle misure di un caso e della calibrazione (secondi) e tetto alle esecuzioni misurate
+MIN_CASE_SECONDS = 1.0
+MAX_REPEAT = 100
+# Dimensioni dei testi con --quick
+QUICK_SIZES = {"breve": 150, "medio": 1500}
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def has_tesseract():
+    try:
+        import pytesseract
+
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def measure(fn, reset=None, repeat=5, warmup=1, min_seconds=0.0):
+    """Esegue `fn` più volte; restituisce i tempi (s) delle esecuzioni misurate e le unità elaborate.
+
+    Le esecuzioni misurate sono almeno `repeat` e continuano finché non sono
+    passati `min_seconds` (fino a `MAX_REPEAT`): i casi veloci si ripetono
+    così su un intervallo più lungo dei disturbi della macchina.
+    """
+    def run():
+        if reset is not None:
+            reset()
+        started = time.perf_counter()
+        units = fn()
+        return time.perf_counter() - started, units
+
+    units = 0
+    for _ in range(warmup):
+        _, units = run()
+    times = []
+    deadline = time.perf_counter() + min_seconds
+    while len(times) < repeat or (time.perf_counter() < deadline and len(times) < MAX_REPEAT):
+        elapsed, units = run()
+        times.append(elapsed)
+    return sorted(times), units
+
+
+def _calibration_work():
+    """Lavoro fisso e misto (interprete, dizionari, compressione, NumPy)"""
+    import zlib
+
+    import numpy as np
+
+    words = [f"parola{i % 997}" for i in range(30000)]
+    counts = {}
+    for word in words:
+        counts[word] = counts.get(word, 0) + 1
+    zlib.compress(" ".join(words).encode("utf-8"), 6)
+    np.sort(np.random.default_rng(0).random(100000))
+    return len(counts)
+
+
+def calibrate(min_seconds=MIN_CASE_SECONDS):
+    """Tempo migliore (ms) del lavoro di calibrazione: quanto è veloce la macchina"""
+    times, _ = measure(_calibration_work, min_seconds=min_seconds)
+    return times[0] * 1000
+
+
+def counted(fn, units):
+    """Esegue `fn` e restituisce le unità elaborate, note in anticipo"""
+    def run():
+        fn()
+        return units
+    return run
+
+
+def start_stub(ttft, latency):
+    """Avvia `llm_stub` in un thread e restituisce il server"""
+    from llm_stub import make_server
+
+    server = make_server(ttft=ttft, latency_per_piece=latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def build_cases(texts, args):
+    """Casi da misurare: (nome, unità, funzione, azzeramento prima di ogni misura)"""
+    import document
+    import export
+    import highlight
+    import ingest
+    import llm
+    import mindmap
+    import readability
+    import reader
+    import related
+    import syllables
+    import transcribe
+    import tts
+    from cache import get_cache
+
+    import numpy as np
+    from PIL import Image
+
+    def clear(*names):
+        def reset():
+            for name in names:
+                get_cache(name).clear()
+        return reset
+
+    def clear_documents():
+        with document._cache_lock:
+            document._documents.clear()
+            document._paragraphs.clear()
+
+    def clear_fragments():
+        syllables.get_hyphenator().syllables.cache_clear()
+        with syllables._fragments_lock:
+            syllables._fragments.clear()
+
+    def clear_paragraphs():
+        clear_documents()
+        with readability._paragraphs_lock:
+            readability._paragraphs.clear()
+
+    medio = texts["medio"]
+    sizes = list(texts)
+    cases = []
+
+    # --- Estrazione e OCR ---
+    pdf = corpus.text_pdf(medio)
+    cases.append(("ingest.pdf_testo[medio]", "pagine",
+                  lambda: len(list(ingest.iter_pdf_pages(pdf, max_workers=1))), None))
+    image = corpus.page_image(medio)
+    cases.append(("ingest.preprocess[pagina]", "immagini",
+                  counted(lambda: ingest.preprocess_image(Image.open(io.BytesIO(image))), 1), None))
+    if has_tesseract():
+        scan = corpus.scanned_pdf(texts["breve"])
+        cases.append(("ingest.pdf_scansione[breve]", "pagine",
+                      lambda: len(list(ingest.iter_pdf_pages(scan))), None))
+        cases.append(("ingest.ocr_immagine[pagina]", "immagini",
+                      counted(lambda: ingest.ocr_image(image), 1), clear("ocr")))
+    else:
+        print("Tesseract non disponibile: i casi di OCR vengono saltati", file=sys.stderr)
+
+    # --- Tokenizzazione, leggibilità ed evidenziazione ---
+    for size in sizes:
+        text = texts[size]
+        cases.append((f"document.tokenizza[{size}]", "parole",
+                      lambda text=text: document.get_document(text).n_words, clear_documents))
+    for size in sizes:
+        text = texts[size]
+        cases.append((f"readability.analyze[{size}]", "parole",
+                      lambda text=text: readability.analyze(text).n_words, clear_paragraphs))
+    cases.append(("readability.analyze_cache[medio]", "parole",
+                  lambda: readability.analyze(medio).n_words, None))
+
+    entries = highlight.load_lexicon()
+    cases.append(("highlight.compila", "voci", lambda: highlight.Highlighter(entries).size, None))
+    highlighter = highlight.Highlighter(entries)
+    for size in sizes:
+        text = texts[size]
+        cases.append((f"highlight[{size}]", "parole",
+                      counted(lambda text=text: highlighter.highlight(text), len(text.split())), None))
+    # Il lessico fornito ha circa 500 voci: con DSA_LEXICON se ne può usare uno molto più
+    # grande, quindi compilazione ed evidenziazione si misurano anche con decine di migliaia di voci
+    large_entries = entries + corpus.lexicon()
+    cases.append(("highlight.compila[lessico_grande]", "voci",
+                  lambda: highlight.Highlighter(large_entries).size, None))
+    large_highlighter = highlight.Highlighter(large_entries)
+    cases.append(("highlight[medio,lessico_grande]", "parole",
+                  counted(lambda: large_highlighter.highlight(medio), len(medio.split())), None))
+
+    # Testo con le sillabe colorate: a freddo, e poi cambiando solo dimensione e interlinea
+    syllable_style = syllables.ReadingStyle(syllables=True)
+    for size in sizes:
+        text = texts[size]
+        cases.append((f"syllables.pagina[{size}]", "parole",
+                      counted(lambda text=text: syllables.render_page(text, syllable_style, highlight=True),
+                              len(text.split())), clear_fragments))
+    cases.append(("syllables.cambia_stile[medio]", "parole",
+                  counted(lambda: syllables.render_page(medio, syllable_style._replace(font_size=22), highlight=True),
+                          len(medio.split())), None))
+
+    # Una pagina del lettore, dal file mappato in memoria
+    book = reader.open_pages(reader.save_text(texts[sizes[-1]] * 20))
+    cases.append(("reader.pagina[libro]", "pagine",
+                  counted(lambda: [book.page(i) for i in range(book.n_pages)], book.n_pages), None))
+
+    # Materiali correlati: vettori di un testo e ricerca tra 20000 testi
+    for size in sizes:
+        text = texts[size]
+        cases.append((f"related.vettore[{size}]", "parole",
+                      counted(lambda text=text: related.embed(text), len(text.split())), None))
+    library = related.VectorIndex(os.path.join(os.environ["DSA_CACHE_DIR"], "indice_bench"))
+    if not len(library):
+        vectors = np.stack([related.embed(corpus.italian_text(60, seed)) for seed in range(500)])
+        library.add(np.arange(1, 20001), np.tile(vectors, (40, 1)))
+    query = related.embed(medio)
+    cases.append(("related.cerca[20000 testi]", "ricerche", counted(lambda: library.search(query, 20), 1), None))
+
+    for size in sizes[1:]:
+        text = texts[size]
+        cases.append((f"mindmap.scaletta[{size}]", "parole",
+                      counted(lambda text=text: mindmap.build_outline(text), len(text.split())), None))
+
+    # --- Esportazione: disegno di una mappa e archivio ZIP di 1000 testi ---
+    tree = mindmap.parse_tree("\n".join(
+        f"{'    ' * (i % 3)}- {' '.join(corpus.italian_text(4, i).split()[:4])}" for i in range(40)
+    ))
+    for fmt in ("svg", "png", "pdf"):
+        cases.append((f"export.mappa[{fmt}]", "mappe",
+                      counted(lambda fmt=fmt: export.render_mind_map(tree, fmt), 1), clear("grafici")))
+    from storage import Storage
+
+    archive = Storage(os.path.join(os.environ["DSA_CACHE_DIR"], "archivio_bench.db"))
+    if not archive.count_texts("bench"):
+        for seed in range(1000):
+            archive.save_text("bench", "testo", corpus.italian_text(300, seed))
+        archive.save_text("bench", "testo", "").result()
+    export_path = os.path.join(os.environ["DSA_CACHE_DIR"], "bench.zip")
+    cases.append(("export.archivio[1000 testi]", "testi",
+                  counted(lambda: export.write_export(export_path, "bench", archive), 1001), None))
+
+    # --- Audio ---
+    tts_backend = tts.FakeTTSBackend(latency=args.tts_latency)
+    for size in sizes:
+        text = texts[size]
+        cases.append((f"tts.split[{size}]", "frasi",
+                      lambda text=text: len(tts.split_for_tts(text)), None))
+    cases.append(("tts.sintesi[medio]", "frasi",
+                  lambda: len(list(tts.synthesize_chunks(medio, backend=tts_backend))), clear("tts")))
+
+    # --- Trascrizione: una lezione di 5 minuti ---
+    lecture = corpus.speech_wav(300, args.seed)
+    cases.append(("stt.segmenti[5 min]", "segmenti",
+                  lambda: sum(1 for _ in transcribe.detect_speech(transcribe.decode_audio(lecture)[2], 16000)),
+                  None))
+    recognizer = transcribe.FakeRecognizer(real_time_factor=args.stt_rtf)
+    cases.append(("stt.trascrivi[5 min]", "segmenti",
+                  lambda: sum(1 for _ in transcribe.transcribe(lecture, recognizer, max_workers=args.stt_workers)),
+                  clear("stt")))
+
+    # --- Modello ---
+    if args.llm_stub:
+        server = start_stub(args.llm_ttft, args.llm_latency)
+        chat_backend = llm.OpenAIBackend(base_url=f"http://127.0.0.1:{server.server_port}/v1",
+                                         requests_per_minute=10 ** 6, tokens_per_minute=10 ** 9)
+    else:
+        chat_backend = llm.FakeChatBackend(ttft=args.llm_ttft, latency_per_piece=args.llm_latency)
+    llm.use_backend(chat_backend)
+    key = "bench"
+    for size in sizes[1:]:
+        text = texts[size]
+        cases.append((f"llm.semplifica[{size}]", "token",
+                      counted(lambda text=text: llm.simplify_long_text(text, api_key=key),
+                              llm.estimate_tokens(text)), clear("llm")))
+    cases.append(("llm.semplifica_cache[medio]", "token",
+                  counted(lambda: llm.simplify_long_text(medio, api_key=key), llm.estimate_tokens(medio)), None))
+    cases.append(("llm.mappa[medio]", "token",
+                  counted(lambda: llm.create_mind_map(medio, api_key=key), llm.estimate_tokens(medio)),
+                  clear("llm")))
+
+    # --- Catena completa: PDF → testo → leggibilità → evidenziazione → semplificazione → audio ---
+    def pipeline():
+        text = "".join(page for _, page, _ in ingest.iter_pdf_pages(pdf, max_workers=1))
+        readability.analyze(text)
+        highlighter.highlight(text)
+        simplified = llm.simplify_long_text(text, api_key=key)
+        tts.text_to_speech(simplified, backend=tts_backend)
+        return len(text.split())
+
+    def reset_all():
+        clear("llm", "tts")()
+        clear_paragraphs()
+
+    cases.append(("pipeline[medio]", "parole", pipeline, reset_all))
+    return cases
+
+
+def run_cases(cases, repeat, only=None, min_seconds=MIN_CASE_SECONDS):
+    results = {}
+    for name, unit, fn, reset in cases:
+        if only and not any(fnmatch.fnmatch(name, f"*{pattern}*") for pattern in only):
+            continue
+        times, units = measure(fn, reset, repeat, min_seconds=min_seconds)
+        median = statistics.median(times)
+        results[name] = {
+            "median_ms": median * 1000,
+            "p95_ms": times[min(len(times) - 1, int(len(times) * 0.95))] * 1000,
+            "min_ms": times[0] * 1000,
+            "runs": len(times),
+            "units": units,
+            "unit": unit,
+            "per_second": units / median if median else None,
+        }
+    return results
+
+
+def run_startup(reruns):
+    """Tempi di import e di riesecuzione dello script, da `bench_startup`"""
+    import bench_startup
+
+    import_timings, _ = bench_startup.measure_imports()
+    reruns, _ = bench_startup.measure_reruns(reruns)
+    return {
+        "startup.import": {"median_ms": sum(import_timings.values()), "unit": "moduli",
+                           "units": len(import_timings)},
+        "startup.prima_esecuzione": {"median_ms": reruns["first_run_ms"]},
+        "startup.riesecuzione": {"median_ms": reruns["rerun_p50_ms"], "p95_ms": reruns["rerun_p95_ms"]},
+    }
+
+
+def compare(results, baseline, calibration=None):
+    """Confronta i tempi migliori con la baseline, scalata sulla calibrazione; restituisce
+    (regressioni, miglioramenti) come messaggi per nome del caso"""
+    tolerance = baseline.get("tolerance", TOLERANCE)
+    slack = baseline.get("min_slack_ms", MIN_SLACK_MS)
+    scale = 1.0
+    if calibration and baseline.get("calibration_ms"):
+        scale = max(1.0, calibration / baseline["calibration_ms"])
+    regressions, improvements = {}, {}
+    for name, result in results.items():
+        reference = baseline.get("cases", {}).get(name)
+        if not reference:
+            continue
+        if "min_ms" in reference and "min_ms" in result:
+            measured, expected = result["min_ms"], reference["min_ms"] * scale
+        else:
+            # Casi senza tempo migliore (es. l'avvio): si confrontano le mediane
+            measured, expected = result["median_ms"], reference["median_ms"]
+        case_tolerance = reference.get("tolerance", tolerance)
+        result["compared_ms"], result["baseline_ms"] = measured, expected
+        if measured > expected * (1 + case_tolerance) + slack:
+            regressions[name] = (f"{measured:.1f} ms contro {expected:.1f} ms attesi "
+                                 f"(tolleranza {case_tolerance:.0%})")
+        elif measured < expected * (1 - case_tolerance) - slack:
+            improvements[name] = f"{measured:.1f} ms contro {expected:.1f} ms attesi"
+    return regressions, improvements
+
+
+def print_table(results):
+    print(f"{'caso':<36}{'mediana':>12}{'p95':>12}{'velocità':>22}{'baseline':>11}")
+    for name, r in results.items():
+        speed = f"{r['per_second']:.0f} {r['unit']}/s" if r.get("per_second") else ""
+        p95 = f"{r['p95_ms']:.1f} ms" if "p95_ms" in r else ""
+        change = ""
+        if r.get("baseline_ms"):
+            change = f"{(r['compared_ms'] / r['baseline_ms'] - 1):+.0%}"
+        print(f"{name:<36}{r['median_ms']:>9.1f} ms{p95:>12}{speed:>22}{change:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="solo i testi brevi e medi, meno ripetizioni")
+    parser.add_argument("--repeat", type=int, help="esecuzioni misurate minime per caso (predefinito 7, 5 con --quick)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", nargs="+", help="solo i casi che contengono uno di questi nomi")
+    parser.add_argument("--llm-ttft", type=float, default=0.05, help="secondi prima della prima risposta del modello")
+    parser.add_argument("--llm-latency", type=float, default=0.001, help="secondi tra un pezzo e l'altro")
+    parser.add_argument("--tts-latency", type=float, default=0.02, help="secondi per frase sintetizzata")
+    parser.add_argument("--stt-rtf", type=float, default=0.005,
+                        help="secondi di riconoscimento per secondo di audio")
+    parser.add_argument("--stt-workers", type=int, default=4, help="segmenti trascritti in parallelo")
+    parser.add_argument("--llm-stub", action="store_true", help="usa il client HTTP verso llm_stub.py")
+    parser.add_argument("--startup", action="store_true", help="includi i tempi di avvio di bench_startup.py")
+    parser.add_argument("--json", help="salva i risultati in questo file")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, help="tolleranza rispetto alla baseline (es. 0.3)")
+    parser.add_argument("--update-baseline", action="store_true", help="salva i risultati come nuova baseline")
+    parser.add_argument("--report-only", action="store_true", help="elenca le regressioni senza uscire con errore")
+    args = parser.parse_args()
+
+    # Cache e archivio isolati e vuoti: i risultati non dipendono da esecuzioni precedenti
+    # e lo script eseguito con --startup non tocca il database di chi lancia il benchmark
+    cache_dir = tempfile.mkdtemp(prefix="dsa_bench_")
+    os.environ["DSA_CACHE_DIR"] = cache_dir
+    os.environ["DSA_DATA_DIR"] = os.path.join(cache_dir, "dati")
+    os.environ.pop("DSA_DB_PATH", None)
+    os.environ.pop("DSA_METRICS_FILE", None)
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+    if args.tolerance is not None:
+        baseline["tolerance"] = args.tolerance
+
+    try:
+        import metrics
+
+        texts = corpus.make_corpus(args.seed, QUICK_SIZES if args.quick else corpus.SIZES)
+        repeat = args.repeat or (5 if args.quick else 7)
+        calibration = calibrate()
+        cases = build_cases(texts, args)
+        results = run_cases(cases, repeat, args.only)
+        if args.startup:
+            results.update(run_startup(max(repeat, 5)))
+        regressions, improvements = compare(results, baseline, calibration)
+        if regressions and not args.update_baseline:
+            # Un momento di carico può rallentare un intero caso: i casi più lenti
+            # si rimisurano e resta regressione solo ciò che si ripete
+            retry = [case for case in cases if case[0] in regressions]
+            for name, result in run_cases(retry, repeat).items():
+                if result["min_ms"] < results[name]["min_ms"]:
+                    results[name] = result
+            regressions, improvements = compare(results, baseline, calibration)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    print_table(results)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment(),
+        "options": {"quick": args.quick, "repeat": repeat, "seed": args.seed, "llm_stub": args.llm_stub,
+                    "llm_ttft": args.llm_ttft, "llm_latency": args.llm_latency,
+                    "tts_latency": args.tts_latency, "stt_rtf": args.stt_rtf,
+                    "stt_workers": args.stt_workers},
+        "calibration_ms": calibration,
+        "cases": results,
+        "stages": metrics.REGISTRY.summary(),
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.update_baseline:
+        cases = {
+            name: {key: round(r[key], 2) for key in ("median_ms", "min_ms") if key in r}
+            for name, r in results.items()
+        }
+        # I casi non misurati in questa esecuzione (es. OCR senza Tesseract) restano quelli precedenti
+        baseline_cases = dict(baseline.get("cases", {}), **cases)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "environment": report["environment"],
+                "options": report["options"],
+                "tolerance": baseline.get("tolerance", TOLERANCE),
+                "min_slack_ms": baseline.get("min_slack_ms", MIN_SLACK_MS),
+                "calibration_ms": round(calibration, 2),
+                "cases": baseline_cases,
+            }, f, indent=2, ensure_ascii=False)
+        print(f"\nBaseline aggiornata: {args.baseline}")
+        return
+
+    if baseline.get("environment") and baseline["environment"] != report["environment"]:
+        print("\nAttenzione: la baseline è stata registrata su un'altra macchina", file=sys.stderr)
+    if baseline.get("options") and baseline["options"] != report["options"]:
+        print("Attenzione: la baseline è stata registrata con altre opzioni", file=sys.stderr)
+    if improvements:
+        print("\nPiù veloci della baseline:")
+        for name, message in improvements.items():
+            print(f"  - {name}: {message}")
+    if regressions:
+        print("\nRegressioni rispetto alla baseline:")
+        for name, message in regressions.items():
+            print(f"  - {name}: {message}")
+        if not args.report_only:
+            sys.exit(1)
+    elif baseline:
+        print("\nNessuna regressione rispetto alla baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Corpus sintetico e deterministico per i benchmark.
+
+Testi italiani di lunghezza diversa costruiti da frasi di materiale
+scolastico, PDF con livello di testo, PDF di sole immagini (pagine
+scansionate), immagini PNG di pagine di testo, registrazioni WAV che
+imitano una lezione (parlato e pause) e un lessico di parole difficili con
+decine di migliaia di voci. A parità di seme i file
+generati sono identici, così i risultati di due esecuzioni sono confrontabili.
+"""
+import random
+
+# Parole per ciascun testo del corpus
+SIZES = {"breve": 150, "medio": 1500, "lungo": 8000}
+# Parole per pagina nei PDF generati
+WORDS_PER_PAGE = 350
+# Risoluzione delle pagine scansionate e delle immagini
+SCAN_DPI = 150
+# Voci del lessico sintetico, molte più di quelle di data/lessico_difficile.txt
+LEXICON_ENTRIES = 20000
+
+_ONSETS = ["", "b", "c", "d", "f", "g", "l", "m", "n", "p", "r", "s", "t", "v", "z",
+           "br", "cr", "pr", "tr", "st", "sc", "gl", "gn", "ch"]
+_VOWELS = "aeiou"
+_SUFFIXES = ["zione", "mente", "ità", "ismo", "ento", "ale", "ivo", "ore", "are", "ere", "ire"]
+
+SENTENCES = [
+    "La fotosintesi è il processo con cui le piante producono zuccheri usando la luce del sole.",
+    "Durante la rivoluzione industriale le città crebbero molto rapidamente e nacquero le fabbriche.",
+    "Il fiume Po attraversa la pianura padana da ovest verso est e sfocia nel mare Adriatico.",
+    "Per risolvere un'equazione di primo grado bisogna isolare l'incognita in uno dei due membri.",
+    "Gli antichi Romani costruirono strade, ponti e acquedotti in tutto l'impero.",
+    "Il cuore pompa il sangue attraverso arterie e vene, portando ossigeno a tutti gli organi.",
+    "La Divina Commedia è divisa in tre cantiche: Inferno, Purgatorio e Paradiso.",
+    "L'acqua bolle a cento gradi al livello del mare, ma in montagna la temperatura di ebollizione è più bassa.",
+    "Nel Medioevo i monasteri conservarono e copiarono molti testi dell'antichità classica.",
+    "Il teorema di Pitagora mette in relazione i cateti e l'ipotenusa di un triangolo rettangolo.",
+    "La cellula è l'unità fondamentale degli organismi viventi e contiene il materiale genetico.",
+    "Con la scoperta dell'America, nel 1492, iniziò un lungo periodo di esplorazioni e conquiste.",
+    "Il Risorgimento portò all'unificazione dell'Italia, proclamata nel 1861.",
+    "Un ecosistema è formato dagli esseri viventi e dall'ambiente fisico in cui essi vivono.",
+    "Il verbo concorda con il soggetto nel numero e nella persona.",
+    "La Costituzione della Repubblica italiana è entrata in vigore il primo gennaio 1948.",
+    "Le placche tettoniche si muovono lentamente e i loro scontri provocano terremoti e vulcani.",
+    "La frazione indica quante parti uguali di un intero vengono considerate.",
+    "Quando un corpo si muove di moto rettilineo uniforme, la sua velocità resta costante nel tempo.",
+    "Secondo l'ipotesi più accreditata, la Terra si è formata circa quattro miliardi e mezzo di anni fa.",
+]
+
+
+def italian_text(words, seed=0):
+    """Testo di circa `words` parole, diviso in paragrafi di 3-6 frasi"""
+    rng = random.Random(seed)
+    paragraphs, count = [], 0
+    while count < words:
+        paragraph = [rng.choice(SENTENCES) for _ in range(rng.randint(3, 6))]
+        count += sum(len(sentence.split()) for sentence in paragraph)
+        paragraphs.append(" ".join(paragraph))
+    return "\n\n".join(paragraphs)
+
+
+def lexicon(entries=LEXICON_ENTRIES, seed=0):
+    """Lessico di `entries` voci inventate con sillabe italiane: 1 su 10 è un prefisso
+    (`*` finale) e 1 su 30 è di due parole, come nel lessico vero"""
+    rng = random.Random(seed)
+
+    def word():
+        syllables = [rng.choice(_ONSETS) + rng.choice(_VOWELS) for _ in range(rng.randint(2, 4))]
+        return "".join(syllables) + rng.choice(_SUFFIXES)
+
+    found = set()
+    while len(found) < entries:
+        roll = rng.random()
+        if roll < 0.1:
+            found.add(word()[:-2] + "*")
+        elif roll < 0.13:
+            found.add(word() + " " + word())
+        else:
+            found.add(word())
+    return sorted(found)
+
+
+def make_corpus(seed=42, sizes=SIZES):
+    """Testi del corpus per nome della dimensione"""
+    return {name: italian_text(words, seed + i) for i, (name, words) in enumerate(sizes.items())}
+
+
+def _pages(text, words_per_page=WORDS_PER_PAGE):
+    words = text.split(" ")
+    return [" ".join(words[i:i + words_per_page]) for i in range(0, len(words), words_per_page)]
+
+
+def text_pdf(text):
+    """PDF A4 con livello di testo"""
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    for page_text in _pages(text):
+        page = doc.new_page(width=595, height=842)
+        page.insert_textbox(fitz.Rect(56, 56, 539, 786), page_text, fontsize=10, fontname="helv")
+    return doc.tobytes(garbage=3, deflate=True)
+
+
+def scanned_pdf(text, dpi=SCAN_DPI):
+    """PDF di sole immagini, come una scansione: nessun livello di testo"""
+    import fitz  # PyMuPDF
+
+    source = fitz.open(stream=text_pdf(text), filetype="pdf")
+    doc = fitz.open()
+    for page in source:
+        scan = doc.new_page(width=page.rect.width, height=page.rect.height)
+        scan.insert_image(scan.rect, pixmap=page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY))
+    return doc.tobytes(garbage=3, deflate=True)
+
+
+def page_image(text, dpi=SCAN_DPI):
+    """PNG della prima pagina del testo"""
+    import fitz  # PyMuPDF
+
+    page = fitz.open(stream=text_pdf(text), filetype="pdf")[0]
+    return page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY).tobytes("png")
+
+
+def speech_wav(seconds, seed=0, rate=16000):
+    """WAV mono che imita una lezione: frasi di 1-6 s (toni modulati) separate da pause su un fruscio"""
+    import io
+    import wave
+
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    samples = rng.normal(0, 60, int(seconds * rate))
+    position = int(rng.uniform(0.2, 1.0) * rate)
+    while position < len(samples):
+        length = int(rng.uniform(1, 6) * rate)
+        t = np.arange(min(length, len(samples) - position)) / rate
+        pitch = rng.uniform(110, 220)
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * rng.uniform(3, 6) * t) ** 2
+        samples[position:position + len(t)] += 6000 * envelope * np.sin(2 * np.pi * pitch * t)
+        position += length + int(rng.uniform(0.6, 2.0) * rate)
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(np.clip(samples, -32768, 32767).astype("<i2").tobytes())
+    return buffer.getvalue()
@@ -0,0 +1,91 @@
+"""Server locale compatibile con l'API Chat Completions, per test di carico senza rete.
+
+Risponde in streaming ripetendo il messaggio dell'utente, con latenze
+configurabili, e può rifiutare una parte delle richieste con 429 o 503 per
+verificare i tentativi del client. Conta le richieste ricevute.
+
+    python bench/llm_stub.py --port 8765 --ttft 0.3 --fail-rate 0.1
+    DSA_LLM_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=test streamlit run tempCodeRunnerFile.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        with server.lock:
+            server.requests += 1
+
+        if random.random() < server.fail_rate:
+            body = b'{"error": {"message": "rate limited"}}'
+            self.send_response(random.choice([429, 503]))
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(server.ttft)
+        words = payload["messages"][-1]["content"].split()
+        for start in range(0, len(words), server.words_per_piece):
+            piece = (" " if start else "") + " ".join(words[start:start + server.words_per_piece])
+            self._chunk({"choices": [{"delta": {"content": piece}}]})
+            time.sleep(server.latency_per_piece)
+        self._chunk("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _chunk(self, data):
+        line = "data: " + (data if isinstance(data, str) else json.dumps(data)) + "\n\n"
+        encoded = line.encode("utf-8")
+        self.wfile.write(f"{len(encoded):x}\r\n".encode() + encoded + b"\r\n")
+        self.wfile.flush()
+
+
+def make_server(port=0, ttft=0.0, latency_per_piece=0.0, words_per_piece=3, fail_rate=0.0):
+    """Crea il server (porta 0 = libera); va avviato con `serve_forever`"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.ttft = ttft
+    server.latency_per_piece = latency_per_piece
+    server.words_per_piece = words_per_piece
+    server.fail_rate = fail_rate
+    server.requests = 0
+    server.lock = threading.Lock()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft", type=float, default=0.3, help="secondi prima del primo pezzo")
+    parser.add_argument("--latency", type=float, default=0.02, help="secondi tra un pezzo e l'altro")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="quota di richieste rifiutate")
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.ttft, args.latency, fail_rate=args.fail_rate)
+    print(f"In ascolto su http://127.0.0.1:{server.server_port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n{server.requests} richieste ricevute")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""Cache dei risultati su due livelli: LRU in memoria e file su disco.
+
+Il livello su disco è condiviso tra sessioni Streamlit e processi diversi:
+ogni voce è un file con nome uguale all'hash della chiave, scritto in modo
+atomico, e viene eliminata per scadenza (TTL) o quando la cartella supera
+la dimensione massima.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+CACHE_DIR = os.environ.get(
+    "DSA_CACHE_DIR", os.path.join(tempfile.gettempdir(), "dsa_assistant_cache")
+)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def normalize_text(text):
+    """Normalizza il testo per la chiave: forma Unicode NFC e spazi compattati"""
+    text = unicodedata.normalize("NFC", text)
+    return " ".join(text.split())
+
+
+def make_key(*parts):
+    """Calcola una chiave SHA-256 a partire da più componenti"""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, bytes) else repr(part).encode("utf-8")
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def _sizeof(value):
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class ResultCache:
+    """Cache con LRU in memoria e livello su disco con scadenza e limite di spazio"""
+
+    def __init__(self, name, max_items=256, max_memory_bytes=64 * 1024 * 1024,
+                 max_disk_bytes=512 * 1024 * 1024, ttl=7 * 24 * 3600,
+                 directory=None):
+        self.name = name
+        self.max_items = max_items
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.directory = os.path.join(directory or CACHE_DIR, name)
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._writes_since_sweep = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # --- livello in memoria ---
+
+    def _memory_get(self, key):
+        with self._lock:
+            if key not in self._memory:
+                return None
+            self._memory.move_to_end(key)
+            return self._memory[key]
+
+    def _memory_set(self, key, value):
+        size = _sizeof(value)
+        if size > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= self._memory.pop(key)[1]
+            self._memory[key] = (value, size)
+            self._memory_bytes += size
+            while self._memory and (len(self._memory) > self.max_items
+                                    or self._memory_bytes > self.max_memory_bytes):
+                _, (_, old_size) = self._memory.popitem(last=False)
+                self._memory_bytes -= old_size
+
+    # --- livello su disco ---
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".pkl")
+
+    def _disk_get(self, key):
+        path = self._path(key)
+        try:
+            if self.ttl and time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            # Aggiorna l'mtime: l'eliminazione su disco segue l'ordine LRU
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError):
+            # File corrotto o scritto a metà da un altro processo
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _disk_set(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        self._writes_since_sweep += 1
+        if self._writes_since_sweep >= 32:
+            self._writes_since_sweep = 0
+            self.sweep()
+
+    def sweep(self):
+        """Elimina le voci scadute e le meno recenti oltre il limite di spazio"""
+        now = time.time()
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                expired = self.ttl and now - st.st_mtime > self.ttl
+                stale_tmp = filename.endswith(".tmp") and now - st.st_mtime > 3600
+                if expired or stale_tmp:
+                    self._remove(path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            self.evictions += 1
+        except OSError:
+            pass
+
+    # --- interfaccia pubblica ---
+
+    def get(self, key, default=None):
+        """Restituisce il valore in cache o `default`"""
+        entry = self._memory_get(key)
+        if entry is not None:
+            self.memory_hits += 1
+            return entry[0]
+
+        value = self._disk_get(key)
+        if value is not None:
+            self.disk_hits += 1
+            self._memory_set(key, value)
+            return value
+
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        """Salva il valore in entrambi i livelli"""
+        self._memory_set(key, value)
+        self._disk_set(key, value)
+
+    def get_or_compute(self, key, compute):
+        """Restituisce il valore in cache oppure lo calcola e lo salva"""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def clear(self):
+        """Svuota la cache in memoria e su disco"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                self._remove(os.path.join(root, filename))
+
+    def stats(self):
+        """Contatori di hit/miss del processo corrente"""
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "name": self.name,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "memory_items": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "evictions": self.evictions,
+        }
+
+
+def get_cache(name, **kwargs):
+    """Restituisce la cache condivisa con questo nome (una per processo)"""
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = ResultCache(name, **kwargs)
+        return _registry[name]
+
+
+def all_stats():
+    """Statistiche di tutte le cache create nel processo"""
+    with _registry_lock:
+        return [cache.stats() for cache in _registry.values()]
@@ -0,0 +1,252 @@
+"""Documento tokenizzato una sola volta: frasi, parole e paragrafi come offset
+
+Un `Document` tiene le posizioni (inizio, fine) di frasi e parole in array
+NumPy compatti invece di liste di stringhe, ed è condiviso per hash del
+contenuto: leggibilità, evidenziazione, divisione per il modello e per la
+sintesi vocale lo riusano invece di ritokenizzare il testo a ogni
+riesecuzione. La tokenizzazione di ogni paragrafo resta in cache, così
+modificando un testo si rielaborano solo i paragrafi cambiati.
+
+Il tokenizzatore delle frasi (punkt di NLTK) viene caricato una volta per
+processo; se i dati di punkt non sono installati e non si possono
+scaricare si usa una divisione di riserva basata sulla punteggiatura.
+"""
+import hashlib
+import os
+import re
+import threading
+import warnings
+from collections import OrderedDict
+
+from metrics import span
+
+# Documenti tenuti in memoria
+MAX_CACHED_DOCUMENTS = 64
+# Paragrafi tokenizzati tenuti in memoria
+MAX_CACHED_PARAGRAPHS = 4096
+# Scaricare i dati di punkt se mancano (0 per non provarci, es. server senza rete)
+DOWNLOAD_PUNKT = os.environ.get("DSA_NLTK_DOWNLOAD", "1") != "0"
+
+LANGUAGES = {"it": "italian", "en": "english", "es": "spanish", "fr": "french"}
+
+WORD_RE = re.compile(r"[^\W\d_]+(?:['’][^\W\d_]+)*")
+# Con il gruppo, split() alterna separatori e parole: le posizioni si ricavano dalle lunghezze
+_WORD_SPLIT_RE = re.compile(f"({WORD_RE.pattern})")
+_PARAGRAPH_BREAK_RE = re.compile(r"\n\s*\n")
+
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+_documents = OrderedDict()
+_paragraphs = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class RegexSentenceTokenizer:
+    """Divisione in frasi di riserva, usata se i dati di punkt non sono disponibili"""
+
+    ABBREVIATIONS = frozenset(
+        "ecc es pag pagg cap vol sig sigg sig.ra dott prof ing avv art n nn fig tab cfr ca".split()
+    )
+    _END_RE = re.compile(r"[.!?…]+[\"'»”)\]]*(?=\s)")
+
+    def span_tokenize(self, text):
+        start = len(text) - len(text.lstrip())
+        for match in self._END_RE.finditer(text):
+            end = match.end()
+            before = text[start:match.start()].split()
+            after = text[end:].lstrip()[:1]
+            if not before or not after:
+                continue
+            if before[-1].lower() in self.ABBREVIATIONS or after.islower():
+                continue
+            yield start, end
+            start = end + len(text[end:]) - len(text[end:].lstrip())
+        stop = len(text.rstrip())
+        if start < stop:
+            yield start, stop
+
+
+def get_tokenizer(language="italian"):
+    """Tokenizzatore delle frasi condiviso dal processo, caricato al primo utilizzo"""
+    with _tokenizers_lock:
+        tokenizer = _tokenizers.get(language)
+        if tokenizer is None:
+            tokenizer = _tokenizers[language] = _load_tokenizer(language)
+        return tokenizer
+
+
+def _load_tokenizer(language):
+    from nltk.tokenize.punkt import PunktTokenizer
+
+    try:
+        return PunktTokenizer(language)
+    except LookupError:
+        pass
+    if DOWNLOAD_PUNKT:
+        import io
+
+        import nltk
+
+        try:
+            if nltk.download("punkt_tab", quiet=True, raise_on_error=True, print_error_to=io.StringIO()):
+                return PunktTokenizer(language)
+        except Exception:
+            pass
+    warnings.warn("Dati di punkt non disponibili: le frasi vengono divise solo in base alla punteggiatura")
+    return RegexSentenceTokenizer()
+
+
+class Document:
+    """Testo con gli offset di frasi, parole e paragrafi.
+
+    `sentence_spans` e `word_spans` sono array int32 (n, 2) di posizioni nel
+    testo; `word_sentence` è la frase di ogni parola e `paragraph_starts` la
+    prima frase di ogni paragrafo. Le stringhe si ricavano su richiesta.
+    """
+
+    __slots__ = ("text", "key", "language", "sentence_spans", "word_spans", "word_sentence",
+                 "paragraph_starts")
+
+    def __init__(self, text, key, language, sentence_spans, word_spans, word_sentence, paragraph_starts):
+        self.text = text
+        self.key = key
+        self.language = language
+        self.sentence_spans = sentence_spans
+        self.word_spans = word_spans
+        self.word_sentence = word_sentence
+        self.paragraph_starts = paragraph_starts
+
+    @property
+    def n_sentences(self):
+        return len(self.sentence_spans)
+
+    @property
+    def n_words(self):
+        return len(self.word_spans)
+
+    def sentence(self, index):
+        start, end = self.sentence_spans[index]
+        return self.text[start:end]
+
+    @property
+    def sentences(self):
+        text = self.text
+        return [text[start:end] for start, end in self.sentence_spans.tolist()]
+
+    @property
+    def words(self):
+        text = self.text
+        return [text[start:end] for start, end in self.word_spans.tolist()]
+
+    def words_per_sentence(self):
+        import numpy as np
+
+        return np.bincount(self.word_sentence, minlength=self.n_sentences).astype(np.int32)
+
+    def paragraphs(self):
+        """Intervalli `(prima, dopo_l_ultima)` di frasi di ogni paragrafo"""
+        bounds = list(self.paragraph_starts) + [self.n_sentences]
+        return list(zip(bounds, bounds[1:]))
+
+    def sentence_paragraphs(self):
+        """Indice del paragrafo di ogni frase"""
+        import numpy as np
+
+        marks = np.zeros(self.n_sentences, dtype=np.int32)
+        marks[list(self.paragraph_starts[1:])] = 1
+        return np.cumsum(marks)
+
+
+def text_key(text, language="italian"):
+    """Hash del contenuto con cui i documenti sono condivisi"""
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16)
+    digest.update(language.encode())
+    return digest.hexdigest()
+
+
+def _paragraph_tokens(paragraph, language):
+    """Offset (relativi al paragrafo) di frasi e parole, ricalcolati solo per i paragrafi nuovi"""
+    import numpy as np
+
+    key = (hashlib.blake2b(paragraph.encode("utf-8"), digest_size=16).digest(), language)
+    with _cache_lock:
+        tokens = _paragraphs.get(key)
+        if tokens is not None:
+            _paragraphs.move_to_end(key)
+            return tokens
+
+    with span("nltk.sent_tokenize", len(paragraph)):
+        sentences = np.array(list(get_tokenizer(language).span_tokenize(paragraph)),
+                             dtype=np.int32).reshape(-1, 2)
+    parts = _WORD_SPLIT_RE.split(paragraph)
+    bounds = np.cumsum(np.fromiter(map(len, parts), dtype=np.int32, count=len(parts)))
+    words = np.column_stack((bounds[0:-1:2], bounds[1::2])).astype(np.int32).reshape(-1, 2)
+    tokens = (sentences, words)
+    with _cache_lock:
+        _paragraphs[key] = tokens
+        while len(_paragraphs) > MAX_CACHED_PARAGRAPHS:
+            _paragraphs.popitem(last=False)
+    return tokens
+
+
+def _paragraph_bounds(text):
+    """Inizio e fine dei paragrafi non vuoti, senza spazi ai bordi"""
+    start = 0
+    for match in _PARAGRAPH_BREAK_RE.finditer(text):
+        yield from _strip_bounds(text, start, match.start())
+        start = match.end()
+    yield from _strip_bounds(text, start, len(text))
+
+
+def _strip_bounds(text, start, end):
+    paragraph = text[start:end]
+    stripped = paragraph.lstrip()
+    if stripped:
+        start += len(paragraph) - len(stripped)
+        yield start, start + len(stripped.rstrip())
+
+
+def build_document(text, language="italian", key=None):
+    """Tokenizza il testo (riusando i paragrafi già visti) e costruisce il `Document`"""
+    import numpy as np
+
+    sentence_parts, word_parts, paragraph_starts = [], [], []
+    count = 0
+    for start, end in _paragraph_bounds(text):
+        sentences, words = _paragraph_tokens(text[start:end], language)
+        if not len(sentences):
+            continue
+        paragraph_starts.append(count)
+        count += len(sentences)
+        sentence_parts.append(sentences + start)
+        word_parts.append(words + start)
+
+    empty = np.zeros((0, 2), dtype=np.int32)
+    sentence_spans = np.concatenate(sentence_parts) if sentence_parts else empty
+    word_spans = np.concatenate(word_parts) if word_parts else empty
+    # Ogni parola appartiene all'ultima frase iniziata prima di lei
+    word_sentence = np.maximum(
+        np.searchsorted(sentence_spans[:, 0], word_spans[:, 0], side="right") - 1, 0
+    ).astype(np.int32)
+    return Document(text, key or text_key(text, language), language, sentence_spans, word_spans,
+                    word_sentence, tuple(paragraph_starts))
+
+
+def get_document(text, language="italian"):
+    """Documento condiviso per contenuto e lingua (`language` anche come codice, es. "it")"""
+    if isinstance(text, Document):
+        return text
+    language = LANGUAGES.get(language, language)
+    key = text_key(text, language)
+    with _cache_lock:
+        document = _documents.get(key)
+        if document is not None:
+            _documents.move_to_end(key)
+            return document
+
+    document = build_document(text, language, key)
+    with _cache_lock:
+        _documents[key] = document
+        while len(_documents) > MAX_CACHED_DOCUMENTS:
+            _documents.popitem(last=False)
+    return document
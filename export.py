@@ -0,0 +1,244 @@
+"""Esportazione dei dati dello studente e delle mappe concettuali
+
+L'archivio ZIP viene scritto su disco un pezzo alla volta: i testi salvati e
+gli eventi del registro diventano file NDJSON (una riga JSON per record)
+letti dal database a blocchi, gli MP3 sono copiati dal file già salvato e le
+mappe concettuali disegnate in SVG, PNG e PDF. Così anche uno storico molto
+lungo non passa mai tutto in memoria.
+
+Le mappe sono disegnate in SVG da questo modulo (albero orizzontale) e
+convertite in PNG e PDF con PyMuPDF; ogni disegno resta in cache per hash
+dell'albero e formato.
+"""
+import json
+import os
+import tempfile
+import time
+import zipfile
+from html import escape
+
+from cache import CACHE_DIR, get_cache, make_key
+from metrics import timed
+
+EXPORT_DIR = os.path.join(CACHE_DIR, "esportazioni")
+# Archivi più vecchi di così vengono eliminati alla prossima esportazione
+EXPORT_TTL = 3600
+# Versione del disegno: cambiandola le mappe in cache vengono ridisegnate
+RENDER_VERSION = 1
+# Ingrandimento dei PNG rispetto all'SVG (più nitidi sugli schermi ad alta densità)
+PNG_ZOOM = 2
+# Caratteri massimi di un'etichetta nella mappa
+MAX_LABEL = 40
+
+FORMATS = ("svg", "png", "pdf")
+MIME_TYPES = {
+    "svg": "image/svg+xml",
+    "png": "image/png",
+    "pdf": "application/pdf",
+    "zip": "application/zip",
+}
+
+# Dimensioni del disegno in pixel
+_FONT = 13
+_CHAR_WIDTH = 7.2
+_ROW = 34
+_BOX = 24
+_PAD = 10
+_GAP = 48
+_MARGIN = 20
+_COLORS = ("#4A6FA5", "#2E8B57", "#C0392B", "#8E44AD", "#D4880F", "#16A085", "#7F5539", "#2C3E50")
+
+
+# --- Disegno delle mappe ---
+
+def _label(name):
+    return name if len(name) <= MAX_LABEL else name[:MAX_LABEL - 1] + "…"
+
+
+def _layout(tree):
+    """Posizione di ogni nodo: colonna per livello, una riga per ogni foglia.
+
+    Restituisce i nodi come `(livello, riga, etichetta, ramo, genitore)`, dove
+    `ramo` è l'indice del figlio della radice da cui discendono (per il colore).
+    """
+    nodes = []
+    next_row = [0]
+
+    def visit(node, depth, branch, parent):
+        index = len(nodes)
+        nodes.append(None)
+        children = node.get("children") or []
+        rows = [visit(child, depth + 1, i if depth == 0 else branch, index) for i, child in enumerate(children)]
+        if rows:
+            row = (rows[0] + rows[-1]) / 2
+        else:
+            row = next_row[0]
+            next_row[0] += 1
+        nodes[index] = (depth, row, _label(node.get("name", "")), branch, parent)
+        return row
+
+    visit(tree, 0, -1, None)
+    return nodes
+
+
+def mind_map_svg(tree):
+    """SVG della mappa concettuale come albero orizzontale, dalla radice a sinistra"""
+    nodes = _layout(tree)
+    depths = max(node[0] for node in nodes) + 1
+    widths = [0.0] * depths
+    for depth, _, label, _, _ in nodes:
+        widths[depth] = max(widths[depth], len(label) * _CHAR_WIDTH + 2 * _PAD)
+    columns = [_MARGIN]
+    for width in widths[:-1]:
+        columns.append(columns[-1] + width + _GAP)
+    width = columns[-1] + widths[-1] + _MARGIN
+    height = 2 * _MARGIN + _ROW * max(1, max(node[1] for node in nodes) + 1)
+
+    def box(node):
+        depth, row, label, _, _ = node
+        return columns[depth], _MARGIN + row * _ROW + (_ROW - _BOX) / 2, len(label) * _CHAR_WIDTH + 2 * _PAD
+
+    links, boxes = [], []
+    for node in nodes:
+        x, y, w = box(node)
+        color = "#34495E" if node[3] < 0 else _COLORS[node[3] % len(_COLORS)]
+        if node[4] is not None:
+            px, py, pw = box(nodes[node[4]])
+            x0, y0, y1 = px + pw, py + _BOX / 2, y + _BOX / 2
+            middle = (x0 + x) / 2
+            links.append(f'<path d="M{x0:.1f},{y0:.1f} C{middle:.1f},{y0:.1f} {middle:.1f},{y1:.1f} {x:.1f},{y1:.1f}"'
+                         f' fill="none" stroke="{color}" stroke-width="1.5"/>')
+        filled = node[0] < 2
+        boxes.append(
+            f'<rect x="{x:.1f}" y="{y:.1f}" width="{w:.1f}" height="{_BOX}" rx="8"'
+            f' fill="{color if filled else "#FFFFFF"}" stroke="{color}" stroke-width="1.5"/>'
+            f'<text x="{x + _PAD:.1f}" y="{y + _BOX / 2 + _FONT * 0.35:.1f}"'
+            f' fill="{"#FFFFFF" if filled else "#222222"}">{escape(node[2])}</text>'
+        )
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" height="{height:.0f}"'
+        f' viewBox="0 0 {width:.0f} {height:.0f}" font-family="Helvetica"'
+        f' font-size="{_FONT}">'
+        f'<rect width="100%" height="100%" fill="#FFFFFF"/>'
+        + "".join(links) + "".join(boxes) + "</svg>"
+    )
+
+
+def _convert(svg, fmt):
+    import fitz  # PyMuPDF
+
+    with fitz.open(stream=svg.encode("utf-8"), filetype="svg") as doc:
+        if fmt == "pdf":
+            return doc.convert_to_pdf()
+        return doc[0].get_pixmap(matrix=fitz.Matrix(PNG_ZOOM, PNG_ZOOM)).tobytes("png")
+
+
+@timed("export.render")
+def render_mind_map(tree, fmt="png"):
+    """Byte della mappa nel formato richiesto (svg, png o pdf), dalla cache se già disegnata"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato non supportato: {fmt}")
+    key = make_key(json.dumps(tree, sort_keys=True, ensure_ascii=False), fmt, RENDER_VERSION)
+
+    def compute():
+        svg = mind_map_svg(tree)
+        return svg.encode("utf-8") if fmt == "svg" else _convert(svg, fmt)
+
+    return get_cache("grafici").get_or_compute(key, compute)
+
+
+# --- Archivio ZIP ---
+
+def sweep(max_age=EXPORT_TTL):
+    """Elimina gli archivi già scaricati (o abbandonati) più vecchi di `max_age` secondi"""
+    limit = time.time() - max_age
+    try:
+        names = os.listdir(EXPORT_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def new_export_path(user):
+    """Percorso di un nuovo archivio nella cartella delle esportazioni"""
+    sweep()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    prefix = "".join(c for c in user if c.isalnum())[:20] or "dati"
+    fd, path = tempfile.mkstemp(dir=EXPORT_DIR, prefix=prefix + "_", suffix=".zip")
+    os.close(fd)
+    return path
+
+
+def _write_ndjson(zf, name, rows, check=None):
+    """Scrive le righe come NDJSON nell'archivio, un record alla volta; restituisce quante sono"""
+    count = 0
+    with zf.open(name, "w", force_zip64=True) as f:
+        for row in rows:
+            if check and count % 100 == 0:
+                check()
+            f.write(json.dumps(row, ensure_ascii=False).encode("utf-8") + b"\n")
+            count += 1
+    return count
+
+
+@timed("export.archive")
+def write_export(path, user, store, events=None, map_keys=(), progress=None, check=None):
+    """Scrive in `path` l'archivio ZIP con i dati dell'utente.
+
+    Contiene `testi.ndjson` (testi salvati completi), `eventi.ndjson` (registro
+    delle attività), gli MP3 collegati ai testi in `audio/`, le mappe
+    concettuali dei testi salvati e di `map_keys` (hash dei documenti) in
+    `mappe/` e un `manifest.json` con i conteggi. Restituisce il manifest.
+    """
+    from mindmap import document_key, load_tree
+    from storage import audio_path
+
+    total = store.count_texts(user)
+    audio_refs = []
+    doc_keys = list(dict.fromkeys(map_keys))
+
+    def texts():
+        for done, row in enumerate(store.iter_texts(user), 1):
+            if row["audio_ref"]:
+                audio_refs.append(row["audio_ref"])
+            doc_keys.append(document_key(row["content"]))
+            if progress:
+                progress(done, total)
+            yield row
+
+    manifest = {"user": user, "created_at": time.time(), "audio": 0, "maps": 0}
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        manifest["texts"] = _write_ndjson(zf, "testi.ndjson", texts(), check)
+        if events is not None:
+            manifest["events"] = _write_ndjson(zf, "eventi.ndjson", events.iter_events(user), check)
+
+        # Gli MP3 sono già compressi: si copiano così come sono
+        for ref in dict.fromkeys(audio_refs):
+            if check:
+                check()
+            source = audio_path(ref)
+            if source and os.path.exists(source):
+                zf.write(source, f"audio/{ref}.mp3", compress_type=zipfile.ZIP_STORED)
+                manifest["audio"] += 1
+
+        for key in dict.fromkeys(doc_keys):
+            saved = load_tree(key)
+            if not saved:
+                continue
+            if check:
+                check()
+            manifest["maps"] += 1
+            name = f"mappe/{manifest['maps']:03d}"
+            zf.writestr(f"{name}.txt", saved["structure"])
+            for fmt in FORMATS:
+                zf.writestr(f"{name}.{fmt}", render_mind_map(saved["tree"], fmt),
+                            compress_type=zipfile.ZIP_STORED if fmt == "png" else zipfile.ZIP_DEFLATED)
+
+        zf.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+    return manifest
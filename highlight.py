@@ -0,0 +1,135 @@
+"""Evidenziazione delle parole difficili guidata da un lessico
+
+Il lessico viene compilato una sola volta in un'unica espressione regolare
+costruita da un trie (le voci con prefisso comune condividono lo stesso
+ramo), così il testo viene analizzato in un solo passaggio lineare qualunque
+sia il numero di voci.
+"""
+import hashlib
+import html
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from document import Document
+
+LEXICON_PATH = os.environ.get(
+    "DSA_LEXICON",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "lessico_difficile.txt")
+)
+# Testi evidenziati tenuti in memoria
+MAX_CACHED_TEXTS = 64
+
+_END = ""
+_WILDCARD = "*"
+# Caratteri che nel testo possono avere più forme (apostrofo tipografico, a capo)
+_ATOMS = {"'": "['’]", " ": r"\s+"}
+
+_highlighter = None
+_highlighter_lock = threading.Lock()
+_rendered = OrderedDict()
+_rendered_lock = threading.Lock()
+
+
+def load_lexicon(path=LEXICON_PATH):
+    """Legge il lessico: una voce per riga, `#` per i commenti"""
+    with open(path, encoding="utf-8") as f:
+        entries = []
+        for line in f:
+            entry = line.split("\t")[0].strip().lower()
+            if entry and not entry.startswith("#"):
+                entries.append(entry)
+    return entries
+
+
+def _build_trie(entries):
+    trie = {}
+    for entry in entries:
+        node = trie
+        prefix = entry.endswith(_WILDCARD)
+        for char in entry.rstrip(_WILDCARD):
+            node = node.setdefault(char, {})
+        node[_WILDCARD if prefix else _END] = True
+    return trie
+
+
+def _trie_to_regex(node):
+    """Converte un ramo del trie in un'espressione regolare senza backtracking inutile"""
+    branches = []
+    singles = []
+    optional = False
+    for char, child in sorted(node.items()):
+        if char == _END:
+            optional = True
+        elif char == _WILDCARD:
+            branches.append(r"\w*")
+        else:
+            sub = _trie_to_regex(child)
+            if sub or char in _ATOMS:
+                branches.append(_ATOMS.get(char, re.escape(char)) + sub)
+            else:
+                singles.append(re.escape(char))
+
+    if singles:
+        branches.append(singles[0] if len(singles) == 1 else "[" + "".join(singles) + "]")
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if optional:
+        pattern = "(?:" + pattern + ")?"
+    return pattern
+
+
+class Highlighter:
+    """Evidenzia le voci del lessico come parole intere, senza distinguere maiuscole"""
+
+    def __init__(self, entries, css_class="highlight-text"):
+        self.size = len(entries)
+        self.css_class = css_class
+        pattern = _trie_to_regex(_build_trie(entries))
+        self.regex = re.compile(r"(?<!\w)(?:" + pattern + r")(?!\w)", re.IGNORECASE)
+
+    def matches(self, text):
+        """Posizioni `(inizio, fine)` delle parole difficili nel testo"""
+        return [match.span() for match in self.regex.finditer(text)]
+
+    def highlight(self, text):
+        """HTML con testo escapato, parole difficili in `<span>` e `<br>` per gli a capo"""
+        parts = []
+        position = 0
+        for match in self.regex.finditer(text):
+            start, end = match.span()
+            parts.append(html.escape(text[position:start]))
+            parts.append(f'<span class="{self.css_class}">{html.escape(match.group())}</span>')
+            position = end
+        parts.append(html.escape(text[position:]))
+        return "".join(parts).replace("\n", "<br>")
+
+
+def get_highlighter():
+    """Evidenziatore condiviso, compilato al primo utilizzo"""
+    global _highlighter
+    with _highlighter_lock:
+        if _highlighter is None:
+            _highlighter = Highlighter(load_lexicon())
+        return _highlighter
+
+
+def highlight_html(text):
+    """Evidenzia l'intero testo (o `Document`), riusando il risultato per lo stesso contenuto"""
+    if isinstance(text, Document):
+        digest, text = text.key, text.text
+    else:
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+    with _rendered_lock:
+        if digest in _rendered:
+            _rendered.move_to_end(digest)
+            return _rendered[digest]
+
+    rendered = get_highlighter().highlight(text)
+    with _rendered_lock:
+        _rendered[digest] = rendered
+        while len(_rendered) > MAX_CACHED_TEXTS:
+            _rendered.popitem(last=False)
+    return rendered
@@ -0,0 +1,342 @@
+"""Estrazione del testo da PDF e immagini
+
+Le librerie pesanti (PyMuPDF, NumPy, Pillow, tesseract) vengono importate
+all'interno delle funzioni, solo quando serve estrarre del testo.
+"""
+import contextlib
+import hashlib
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import get_cache, make_key
+from metrics import replay, run_recorded, span, timed
+
+# Risoluzione usata per rasterizzare le pagine senza testo
+OCR_DPI = int(os.environ.get("DSA_OCR_DPI", "300"))
+# Processi dedicati all'OCR delle pagine scansionate
+OCR_WORKERS = int(os.environ.get("DSA_OCR_WORKERS", str(os.cpu_count() or 2)))
+# Sotto questa soglia di caratteri una pagina è considerata solo immagine
+MIN_TEXT_CHARS = 20
+
+# Lato lungo di una pagina A4 in pollici: serve a stimare la scala delle foto
+PAGE_LONG_SIDE_INCHES = 11.7
+# Oltre questa altezza (in pixel) l'immagine viene divisa in strisce
+TILE_HEIGHT = 1600
+TILE_OVERLAP = 120
+# Angoli provati per raddrizzare il testo, in gradi
+DESKEW_ANGLES = [step * 0.5 for step in range(-10, 11)]
+# Versione della pipeline: cambiarla invalida i risultati OCR in cache
+PIPELINE_VERSION = 1
+
+
+def _read_bytes(pdf_file):
+    """Legge una sola volta il contenuto di un file caricato, di bytes o di un percorso"""
+    if isinstance(pdf_file, (bytes, bytearray)):
+        return bytes(pdf_file)
+    if isinstance(pdf_file, str):
+        with open(pdf_file, "rb") as f:
+            return f.read()
+    if hasattr(pdf_file, "getvalue"):
+        return pdf_file.getvalue()
+    pdf_file.seek(0)
+    return pdf_file.read()
+
+
+# Pool di processi per l'OCR delle pagine, condiviso da tutti i PDF
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+# Ultimo documento aperto nel processo del pool: `(percorso, documento)`
+_worker_doc = None
+
+
+def get_ocr_pool(max_workers=OCR_WORKERS):
+    """Pool OCR condiviso, creato al primo PDF scansionato.
+
+    I processi partono con "spawn" e non con "fork": un fork del server, che
+    ha molti thread, copierebbe anche i lock tenuti in quel momento dagli
+    altri thread e il figlio potrebbe bloccarsi.
+    """
+    global _ocr_pool
+    from concurrent.futures import ProcessPoolExecutor
+
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            _ocr_pool = ProcessPoolExecutor(max_workers=max_workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _ocr_pool
+
+
+def _ocr_doc_page(doc, page_number, dpi):
+    """Rasterizza e riconosce una singola pagina del documento"""
+    import fitz  # PyMuPDF
+    from PIL import Image
+
+    pixmap = doc[page_number].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    image = Image.open(io.BytesIO(pixmap.tobytes("png")))
+    return _ocr_tiles(preprocess_image(image, target_dpi=None), 'ita', dpi)
+
+
+def _ocr_page(path, page_number, dpi):
+    """Riconosce una pagina del PDF in `path` (eseguita in un processo del pool).
+
+    Il documento resta aperto per le pagine successive dello stesso file;
+    al primo file diverso viene chiuso, così il file temporaneo già
+    eliminato non resta occupato.
+    """
+    global _worker_doc
+    import fitz  # PyMuPDF
+
+    try:
+        if _worker_doc is None or _worker_doc[0] != path:
+            if _worker_doc is not None:
+                _worker_doc[1].close()
+                _worker_doc = None
+            _worker_doc = (path, fitz.open(path))
+        return _ocr_doc_page(_worker_doc[1], page_number, dpi)
+    except Exception as e:
+        # Alcune eccezioni (es. di pytesseract) non si ricostruiscono nel processo
+        # principale e romperebbero il pool: passano come semplice messaggio
+        raise RuntimeError(str(e)) from None
+
+
+def _ocr_whole_file(data, dpi):
+    """Ultima risorsa per PDF che PyMuPDF non riesce ad aprire"""
+    import pdf2image
+    import pytesseract
+
+    for number, image in enumerate(pdf2image.convert_from_bytes(data, dpi=dpi), 1):
+        yield number, pytesseract.image_to_string(image, lang='ita'), "ocr"
+
+
+def iter_pdf_pages(pdf_file, dpi=OCR_DPI, max_workers=OCR_WORKERS):
+    """Estrae il testo pagina per pagina.
+
+    Genera tuple `(numero_pagina, testo, metodo)` in ordine di pagina, dove
+    `metodo` è "testo" per le pagine con livello di testo e "ocr" per quelle
+    solo immagine. Le pagine da riconoscere vengono elaborate in parallelo in
+    un pool di processi, mentre quelle con testo sono restituite subito.
+    """
+    data = _read_bytes(pdf_file)
+    with span("pdf.extract", len(data)):
+        yield from _iter_pages(data, dpi, max_workers)
+
+
+def _iter_pages(data, dpi, max_workers):
+    import fitz  # PyMuPDF
+
+    try:
+        doc = fitz.open(stream=data, filetype="pdf")
+    except Exception:
+        yield from _ocr_whole_file(data, dpi)
+        return
+
+    with span("pdf.text_layer"):
+        texts = [page.get_text() for page in doc]
+    scanned = [i for i, text in enumerate(texts) if len(text.strip()) < MIN_TEXT_CHARS]
+    if not scanned:
+        for i, text in enumerate(texts):
+            yield i + 1, text, "testo"
+        return
+
+    if max_workers <= 1:
+        # Senza pool, ad esempio quando il chiamante è già un processo di un pool
+        for i, text in enumerate(texts):
+            if i in scanned:
+                yield i + 1, _ocr_doc_page(doc, i, dpi), "ocr"
+            else:
+                yield i + 1, text, "testo"
+        return
+
+    # I processi del pool leggono il PDF da un file temporaneo invece di riceverlo a ogni pagina;
+    # il prefisso con l'hash fa sì che lo stesso percorso indichi sempre lo stesso contenuto
+    fd, path = tempfile.mkstemp(prefix=f"ocr_{hashlib.sha256(data).hexdigest()[:16]}_", suffix=".pdf")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    pool = get_ocr_pool(max_workers)
+    futures = {}
+    try:
+        futures = {i: pool.submit(run_recorded, _ocr_page, path, i, dpi) for i in scanned}
+        for i, text in enumerate(texts):
+            if i in futures:
+                text, observations = futures[i].result()
+                # Le misure fatte nel processo del pool finiscono nei registri di questo processo
+                replay(observations)
+                yield i + 1, text, "ocr"
+            else:
+                yield i + 1, text, "testo"
+    finally:
+        # Se la lettura viene interrotta, le pagine non ancora avviate non vengono riconosciute
+        for future in futures.values():
+            future.cancel()
+        with contextlib.suppress(OSError):
+            os.remove(path)
+
+
+def count_pdf_pages(pdf_file):
+    """Numero di pagine del PDF (0 se il file non è leggibile da PyMuPDF)"""
+    import fitz  # PyMuPDF
+
+    try:
+        return fitz.open(stream=_read_bytes(pdf_file), filetype="pdf").page_count
+    except Exception:
+        return 0
+
+
+@timed("pdf.extract_text")
+def extract_text_from_pdf(pdf_file, dpi=OCR_DPI):
+    """Estrae testo da PDF"""
+    try:
+        return "".join(text for _, text, _ in iter_pdf_pages(pdf_file, dpi=dpi))
+    except Exception as e:
+        return f"Errore nell'estrazione testo: {str(e)}"
+
+
+def _otsu_threshold(pixels):
+    """Soglia di binarizzazione di Otsu su un array di grigi 0-255"""
+    import numpy as np
+
+    histogram = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    weights = np.cumsum(histogram)
+    means = np.cumsum(histogram * np.arange(256))
+    total_weight, total_mean = weights[-1], means[-1]
+    background = weights
+    foreground = total_weight - weights
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (total_mean * background - means * total_weight) ** 2 / (background * foreground)
+    return int(np.argmax(np.nan_to_num(between)))
+
+
+def _skew_angle(image):
+    """Stima l'inclinazione del testo massimizzando la varianza del profilo delle righe"""
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    thumbnail = image.copy()
+    thumbnail.thumbnail((800, 800))
+    inverted = ImageOps.invert(thumbnail)
+    best_angle, best_score = 0.0, -1.0
+    for angle in DESKEW_ANGLES:
+        rotated = np.asarray(inverted.rotate(angle, resample=Image.BILINEAR), dtype=np.float32)
+        score = float(np.var(rotated.sum(axis=1)))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def preprocess_image(image, target_dpi=OCR_DPI):
+    """Prepara una foto per l'OCR.
+
+    Applica la rotazione EXIF, converte in scala di grigi, riduce la
+    risoluzione a `target_dpi` (stimata sul lato lungo di una pagina A4 se
+    l'immagine non dichiara i DPI), raddrizza il testo e binarizza.
+    Con `target_dpi=None` la scala non viene modificata.
+    """
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("L")
+
+    if target_dpi:
+        declared = image.info.get("dpi", (0, 0))[0]
+        if declared and declared >= 150:
+            scale = target_dpi / declared
+        else:
+            scale = target_dpi * PAGE_LONG_SIDE_INCHES / max(image.size)
+        if scale < 1:
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, Image.LANCZOS)
+
+    image = ImageOps.autocontrast(image)
+    angle = _skew_angle(image)
+    if angle:
+        image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+    pixels = np.asarray(image)
+    threshold = _otsu_threshold(pixels)
+    return Image.fromarray(np.where(pixels > threshold, 255, 0).astype(np.uint8))
+
+
+def _tile_bounds(image):
+    """Strisce orizzontali sovrapposte, tagliate sulla riga più chiara vicino al confine"""
+    import numpy as np
+
+    if image.height <= TILE_HEIGHT:
+        return [(0, image.height)]
+    row_means = np.asarray(image, dtype=np.float32).mean(axis=1)
+    bounds = []
+    top = 0
+    while top < image.height:
+        bottom = top + TILE_HEIGHT
+        if bottom >= image.height:
+            bounds.append((top, image.height))
+            break
+        window = row_means[bottom - TILE_OVERLAP:bottom]
+        cut = bottom - TILE_OVERLAP + int(np.argmax(window))
+        bounds.append((top, min(image.height, cut + TILE_OVERLAP // 2)))
+        top = max(top + 1, cut - TILE_OVERLAP // 2)
+    return bounds
+
+
+def _merge_tiles(texts):
+    """Unisce i testi delle strisce eliminando le righe ripetute nella sovrapposizione"""
+    merged = []
+    for text in texts:
+        lines = text.splitlines()
+        tail = [line.strip() for line in merged[-5:] if line.strip()]
+        while lines and lines[0].strip() and lines[0].strip() in tail:
+            lines.pop(0)
+        merged.extend(lines)
+    return "\n".join(merged)
+
+
+def _tile_workers(tiles):
+    """Strisce riconosciute in parallelo.
+
+    In un processo figlio (pool OCR, pool dei lavori, `batch`) il parallelismo
+    è già tra i processi: con altri thread ogni processo lancerebbe fino a
+    `OCR_WORKERS` Tesseract e la CPU sarebbe sovraccarica.
+    """
+    if multiprocessing.parent_process() is not None:
+        return 1
+    return min(OCR_WORKERS, tiles)
+
+
+def _ocr_tiles(image, lang, dpi):
+    """Riconosce l'immagine, dividendola in strisce elaborate in parallelo se è alta"""
+    import pytesseract
+
+    config = f"--dpi {dpi}" if dpi else ""
+    bounds = _tile_bounds(image)
+    with span("ocr.tesseract", image.width * image.height):
+        if len(bounds) == 1:
+            return pytesseract.image_to_string(image, lang=lang, config=config)
+
+        tiles = [image.crop((0, top, image.width, bottom)) for top, bottom in bounds]
+        workers = _tile_workers(len(tiles))
+        if workers == 1:
+            return _merge_tiles([pytesseract.image_to_string(tile, lang=lang, config=config) for tile in tiles])
+        # Tesseract gira in un sottoprocesso: i thread bastano per il parallelismo
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            texts = list(pool.map(lambda tile: pytesseract.image_to_string(tile, lang=lang, config=config), tiles))
+        return _merge_tiles(texts)
+
+
+def ocr_image(image_file, lang='ita', target_dpi=OCR_DPI):
+    """Riconosce il testo di un'immagine caricata, con risultato in cache per contenuto"""
+    from PIL import Image
+
+    data = _read_bytes(image_file)
+    key = make_key(hashlib.sha256(data).hexdigest(), lang, target_dpi, PIPELINE_VERSION)
+
+    def compute():
+        with span("ocr.preprocess", len(data)):
+            image = preprocess_image(Image.open(io.BytesIO(data)), target_dpi=target_dpi)
+        return _ocr_tiles(image, lang, target_dpi)
+
+    with span("ocr.image", len(data)):
+        return get_cache("ocr").get_or_compute(key, compute)
@@ -0,0 +1,385 @@
+"""Lavori in background per le operazioni lente: OCR, modello, sintesi vocale e trascrizione
+
+Lo script Streamlit avvia un lavoro, ne salva l'id in `session_state` e a
+ogni aggiornamento legge stato e risultati parziali senza restare bloccato.
+I lavori girano su un pool di thread condiviso dal processo: le chiamate al
+modello e alla sintesi vocale passano quasi tutto il tempo in attesa della
+rete, mentre l'OCR di un'immagine viene inviato a un pool di processi (le
+pagine dei PDF scansionati hanno già il loro pool in `ingest`).
+
+Ogni sessione (identificata da un id casuale, non dal nome digitato
+dall'utente) può avere solo pochi lavori attivi alla volta e ogni lavoro può
+essere annullato: la funzione del lavoro controlla `job.check()` tra un
+pezzo e l'altro. Con DSA_LLM_BACKEND=fake e DSA_TTS_BACKEND=fake tutto
+funziona senza rete.
+"""
+import contextlib
+import contextvars
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from metrics import replay, run_recorded, span
+
+# Thread per i lavori in background (quasi sempre in attesa di rete)
+JOB_WORKERS = int(os.environ.get("DSA_JOB_WORKERS", "8"))
+# Processi per il lavoro di CPU (OCR delle immagini)
+CPU_WORKERS = int(os.environ.get("DSA_CPU_WORKERS", str(os.cpu_count() or 2)))
+# Lavori attivi contemporaneamente per ogni sessione
+MAX_JOBS_PER_SESSION = int(os.environ.get("DSA_MAX_JOBS_PER_SESSION", "3"))
+# Secondi per cui un lavoro concluso resta consultabile
+JOB_TTL = 3600
+
+PENDING = "in attesa"
+RUNNING = "in corso"
+DONE = "completato"
+FAILED = "errore"
+CANCELLED = "annullato"
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+class TooManyJobs(Exception):
+    """La sessione ha già il numero massimo di lavori attivi"""
+
+
+class Cancelled(Exception):
+    """Il lavoro è stato annullato mentre era in corso"""
+
+
+class Job:
+    """Stato, avanzamento e risultati (anche parziali) di un lavoro"""
+
+    def __init__(self, session, kind, queue=None):
+        self.id = uuid.uuid4().hex
+        self.session = session
+        self.kind = kind
+        self.queue = queue
+        self.status = PENDING
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.meta = {}
+        self.created_at = time.time()
+        self.finished_at = None
+        self._parts = []
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+
+    @property
+    def active(self):
+        return self.status in (PENDING, RUNNING)
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def fraction(self):
+        return min(1.0, self.done / self.total) if self.total else 0.0
+
+    def cancel(self):
+        """Chiede l'interruzione; il lavoro si ferma al prossimo `check()`"""
+        self._cancel.set()
+
+    def check(self):
+        """Da chiamare nella funzione del lavoro tra un pezzo e l'altro"""
+        if self._cancel.is_set():
+            raise Cancelled()
+
+    def progress(self, done, total):
+        self.done, self.total = done, total
+
+    def add(self, part):
+        """Aggiunge un risultato parziale (pagina, pezzo di testo, frase audio)"""
+        with self._lock:
+            self._parts.append(part)
+
+    def partial(self):
+        with self._lock:
+            return list(self._parts)
+
+    def run_cpu(self, fn, *args):
+        """Esegue `fn(*args)` nel pool di processi, restando annullabile durante l'attesa"""
+        future = self.queue.cpu_pool().submit(run_recorded, fn, *args)
+        while True:
+            try:
+                result, observations = future.result(timeout=0.2)
+                # Le misure fatte nel processo del pool finiscono nei registri di questo processo
+                replay(observations)
+                return result
+            except TimeoutError:
+                if self.cancelled:
+                    future.cancel()
+                    raise Cancelled()
+
+
+class FinishedJob:
+    """Lavoro concluso uscito dalla coda: il risultato si legge da un archivio esterno"""
+
+    status = DONE
+    active = False
+
+    def __init__(self, job, store, name):
+        self.id = job.id
+        self.kind = job.kind
+        self.meta = job.meta
+        self._store = store
+        self._name = name
+
+    @property
+    def available(self):
+        return self._name in self._store
+
+    @property
+    def result(self):
+        return self._store.get(self._name)
+
+
+class JobQueue:
+    """Pool di lavori condiviso dalle sessioni, con limite di lavori attivi per sessione"""
+
+    def __init__(self, workers=JOB_WORKERS, cpu_workers=CPU_WORKERS,
+                 max_per_session=MAX_JOBS_PER_SESSION, ttl=JOB_TTL):
+        self.max_per_session = max_per_session
+        self.ttl = ttl
+        self.cpu_workers = cpu_workers
+        self._threads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._cpu = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def cpu_pool(self):
+        """Pool di processi, creato al primo lavoro che ne ha bisogno.
+
+        I processi partono con "spawn": un fork del server, che ha molti thread,
+        copierebbe anche i lock tenuti in quel momento dagli altri thread.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        with self._lock:
+            if self._cpu is None:
+                self._cpu = ProcessPoolExecutor(max_workers=self.cpu_workers,
+                                                mp_context=multiprocessing.get_context("spawn"))
+            return self._cpu
+
+    def submit(self, session, kind, fn, *args, **kwargs):
+        """Avvia `fn(job, *args, **kwargs)` in background per la sessione e restituisce il `Job`"""
+        with self._lock:
+            self._prune()
+            active = sum(1 for job in self._jobs.values() if job.session == session and job.active)
+            if active >= self.max_per_session:
+                raise TooManyJobs(
+                    f"Hai già {active} operazioni in corso: attendi che una finisca o annullala"
+                )
+            job = Job(session, kind, queue=self)
+            self._jobs[job.id] = job
+        # Il lavoro eredita il contesto di chi lo avvia (es. il registro delle misure della sessione)
+        self._threads.submit(contextvars.copy_context().run, self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        try:
+            job.check()
+            job.status = RUNNING
+            job.result = fn(job, *args, **kwargs)
+            job.status = DONE
+        except Cancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+            # I risultati parziali sono già nel risultato finale (o non servono più)
+            with job._lock:
+                job._parts = []
+
+    def _prune(self):
+        limit = time.time() - self.ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < limit]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def release(self, job_id):
+        """Toglie dalla coda un lavoro concluso il cui risultato è stato preso in carico"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and not job.active:
+                del self._jobs[job_id]
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+
+    def active_jobs(self, session=None):
+        with self._lock:
+            return [j for j in self._jobs.values() if j.active and (session is None or j.session == session)]
+
+    def shutdown(self):
+        for job in self.active_jobs():
+            job.cancel()
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._cpu is not None:
+            self._cpu.shutdown(wait=False, cancel_futures=True)
+
+
+def get_queue():
+    """Coda di lavori condivisa dal processo"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
+
+
+# --- Lavori ---
+
+def _consume(job, stream):
+    """Legge una risposta del modello pezzo per pezzo, controllando l'annullamento"""
+    job.meta["stream"] = stream
+    pieces = iter(stream)
+    try:
+        for piece in pieces:
+            job.check()
+            job.add(piece)
+    finally:
+        pieces.close()
+    job.meta["stream"] = stream.timing()
+    return stream.text
+
+
+def pdf_job(job, data):
+    """Estrae il testo di un PDF pagina per pagina e lo salva per il lettore"""
+    from ingest import count_pdf_pages, iter_pdf_pages
+    from reader import save_pages
+
+    total = count_pdf_pages(data)
+    pages = iter_pdf_pages(data)
+    try:
+        for number, text, method in pages:
+            job.check()
+            job.meta["method"] = method
+            job.add(text)
+            job.progress(number, max(total, number))
+    finally:
+        pages.close()
+    job.meta["pages"] = save_pages(job.partial())
+    return "".join(job.partial())
+
+
+def _ocr_in_process(data):
+    from ingest import ocr_image
+
+    try:
+        return ocr_image(data)
+    except Exception as e:
+        # Alcune eccezioni (es. di pytesseract) non si ricostruiscono nel processo
+        # principale e romperebbero il pool: passano come semplice messaggio
+        raise RuntimeError(str(e)) from None
+
+
+def image_ocr_job(job, data):
+    """Riconosce il testo di un'immagine nel pool di processi"""
+    job.progress(0, 1)
+    # "ocr.image" arriva già dal processo del pool: qui si misura anche l'attesa e il passaggio dei dati
+    with span("ocr.image.job", len(data)):
+        text = job.run_cpu(_ocr_in_process, data)
+    job.progress(1, 1)
+    return text
+
+
+def simplify_job(job, text, sentences=None, selected=None, paragraph_starts=(), api_key=None):
+    """Semplifica il testo intero o, se indicate, solo le frasi selezionate"""
+    from llm import simplify_long_text_stream, simplify_selected_stream
+
+    if selected is not None:
+        stream = simplify_selected_stream(sentences, selected, paragraph_starts,
+                                          progress=job.progress, api_key=api_key)
+    else:
+        stream = simplify_long_text_stream(text, progress=job.progress, api_key=api_key)
+    return _consume(job, stream)
+
+
+def mind_map_job(job, text, api_key=None):
+    """Genera la mappa concettuale e ne salva l'albero per il documento"""
+    from llm import create_mind_map_stream
+    from mindmap import save_tree
+
+    structure = _consume(job, create_mind_map_stream(text, api_key))
+    job.meta["tree"] = save_tree(text, structure)
+    return structure
+
+
+def suggestions_job(job, profile, api_key=None):
+    from llm import suggestions_stream
+
+    return _consume(job, suggestions_stream(profile, api_key))
+
+
+def tts_job(job, text, language='it', speed=1.0, backend=None):
+    """Sintetizza il testo frase per frase; la prima frase è subito ascoltabile"""
+    from tts import split_for_tts, synthesize_chunks
+
+    total = len(split_for_tts(text, language))
+    parts = synthesize_chunks(text, language, speed, backend=backend)
+    try:
+        for done, part in enumerate(parts, 1):
+            job.check()
+            job.add(part)
+            job.progress(done, total)
+    finally:
+        parts.close()
+    return b"".join(job.partial())
+
+
+def transcription_job(job, data, recognizer=None, language='it'):
+    """Trascrive una registrazione segmento per segmento, mostrando il testo man mano"""
+    from reader import save_text
+    from transcribe import transcribe
+
+    segments = transcribe(data, recognizer, language, progress=job.progress)
+    try:
+        for segment in segments:
+            job.check()
+            if segment.text:
+                job.add(segment.text + " ")
+    finally:
+        segments.close()
+    text = "".join(job.partial()).strip()
+    job.meta["pages"] = save_text(text)
+    return text
+
+
+def export_job(job, user, map_keys=()):
+    """Scrive l'archivio ZIP dei dati dell'utente e ne restituisce il percorso"""
+    from analytics import get_event_log
+    from export import new_export_path, write_export
+    from storage import get_storage
+
+    path = new_export_path(user)
+    try:
+        job.meta["manifest"] = write_export(path, user, get_storage(), get_event_log(), map_keys,
+                                            progress=job.progress, check=job.check)
+    except (Exception, Cancelled):
+        # Un errore nel togliere l'archivio a metà non deve nascondere quello originale
+        with contextlib.suppress(OSError):
+            os.remove(path)
+        raise
+    return path
+
+
+def render_job(job, tree, fmt):
+    """Disegna la mappa concettuale nel formato richiesto"""
+    from export import render_mind_map
+
+    return render_mind_map(tree, fmt)
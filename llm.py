@@ -0,0 +1,656 @@
+"""Funzioni basate su OpenAI: semplificazione e mappe concettuali
+
+Tutte le richieste passano da un unico client per processo, che usa una
+sessione HTTP con connessioni riutilizzate, limita la frequenza delle
+richieste per chiave API, ritenta con attesa crescente in caso di 429 o
+errori del server e unisce le richieste identiche già in corso. La chiave
+viene passata a ogni chiamata: nessuna impostazione globale condivisa tra
+le sessioni. Gli errori vengono sollevati come `LLMError`.
+
+`requests` e `nltk` vengono importati solo al primo utilizzo, così il modulo
+resta leggero da caricare a ogni esecuzione dello script Streamlit.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cache import get_cache, make_key, normalize_text
+from metrics import observe, span, submit
+
+MODEL = "gpt-3.5-turbo"
+
+# Indirizzo dell'API compatibile OpenAI (si può puntare a un server locale per i test di carico)
+BASE_URL = os.environ.get("DSA_LLM_BASE_URL", "https://api.openai.com/v1")
+# Richieste e token al minuto consentiti per ogni chiave API
+REQUESTS_PER_MINUTE = int(os.environ.get("DSA_LLM_RPM", "60"))
+TOKENS_PER_MINUTE = int(os.environ.get("DSA_LLM_TPM", "90000"))
+# Tentativi per una richiesta rifiutata con 429 o 5xx e attesa iniziale (raddoppia a ogni tentativo)
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.0
+# Secondi per aprire la connessione e tra un pezzo e l'altro della risposta
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 60
+# Connessioni HTTP tenute aperte verso l'API
+POOL_SIZE = int(os.environ.get("DSA_LLM_POOL", "16"))
+
+# Budget di token in ingresso per ogni parte di un documento lungo
+CHUNK_TOKENS = 1200
+_NON_SPACE_RE = re.compile(r"\S+")
+# Richieste contemporanee al modello per un singolo documento
+MAX_CONCURRENCY = int(os.environ.get("DSA_LLM_CONCURRENCY", "4"))
+
+SIMPLIFY_SYSTEM = "Sei un tutor specializzato nell'aiutare studenti con DSA."
+SIMPLIFY_PROMPT = """
+    Semplifica questo testo per uno studente con dislessia:
+    1. Usa frasi brevi
+    2. Evita parole complesse
+    3. Aggiungi esempi concreti
+    4. Suddividi in paragrafi brevi
+
+    Testo originale:
+    {text}
+
+    Testo semplificato:
+    """
+
+MIND_MAP_SYSTEM = "Crea mappe concettuali chiare e strutturate."
+MIND_MAP_PROMPT = """
+    Crea una mappa concettuale gerarchica da questo testo.
+    Formatta in questo modo:
+
+    CONCETTO PRINCIPALE
+    ├── Idea 1
+    │   ├── Sottoidea A
+    │   └── Sottoidea B
+    ├── Idea 2
+    └── Idea 3
+
+    Testo (per i documenti lunghi, le parole chiave e le frasi principali):
+    {text}
+    """
+
+
+SUGGESTIONS_SYSTEM = "Sei un tutor esperto in DSA e metodi di studio inclusivi."
+SUGGESTIONS_PROMPT = """
+                Sono uno studente con queste caratteristiche:
+                {text}
+
+                Dammi 5 suggerimenti pratici e personalizzati per:
+                1. Migliorare la concentrazione
+                2. Facilitare la lettura
+                3. Organizzare lo studio
+                4. Utilizzare strumenti compensativi
+                5. Gestire il tempo
+                """
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class LLMError(Exception):
+    """Richiesta al modello non riuscita"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def llm_cache():
+    """Cache condivisa delle risposte del modello"""
+    return get_cache("llm")
+
+
+class TokenBucket:
+    """Secchiello di gettoni: `rate` gettoni al secondo, al massimo `capacity` accumulati"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """Attende finché non ci sono `amount` gettoni e li consuma"""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Tempi di una risposta conclusa, senza il testo (da conservare a lungo costa poco)
+StreamTiming = namedtuple("StreamTiming", "cached shared ttft latency")
+
+
+class ChatStream:
+    """Risposta del modello consumata a pezzi, con tempo al primo token e latenza totale"""
+
+    def __init__(self, label, on_done=None):
+        self.label = label
+        self.pieces = iter(())
+        self.cached = False
+        self.shared = False
+        self.ttft = None
+        self.latency = None
+        self.text = None
+        self._on_done = on_done
+
+    def __iter__(self):
+        started = time.perf_counter()
+        parts = []
+        for piece in self.pieces:
+            if not piece:
+                continue
+            if self.ttft is None:
+                self.ttft = time.perf_counter() - started
+            parts.append(piece)
+            yield piece
+        self.latency = time.perf_counter() - started
+        self.text = "".join(parts)
+        if self._on_done:
+            self._on_done(self)
+
+    def timing(self):
+        return StreamTiming(self.cached, self.shared, self.ttft, self.latency)
+
+
+class ChatBackend:
+    """Interfaccia per i modelli: generano il testo della risposta a pezzi"""
+
+    name = "base"
+
+    def stream(self, messages, model, params, api_key=None):
+        raise NotImplementedError
+
+
+class OpenAIBackend(ChatBackend):
+    """API Chat Completions compatibile OpenAI, su una sessione HTTP condivisa"""
+
+    name = "openai"
+
+    def __init__(self, base_url=BASE_URL, requests_per_minute=REQUESTS_PER_MINUTE,
+                 tokens_per_minute=TOKENS_PER_MINUTE, max_retries=MAX_RETRIES,
+                 backoff=BACKOFF_SECONDS, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                 pool_size=POOL_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._session = None
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def session(self):
+        """Sessione HTTP con connessioni riutilizzate, creata al primo utilizzo"""
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+            return self._session
+
+    def _limits(self, api_key):
+        """Limiti di richieste e di token della chiave (la chiave non viene conservata)"""
+        digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+        with self._lock:
+            if digest not in self._buckets:
+                self._buckets[digest] = (
+                    TokenBucket(self.requests_per_minute / 60, max(1, self.requests_per_minute // 6)),
+                    TokenBucket(self.tokens_per_minute / 60, max(1, self.tokens_per_minute // 6)),
+                )
+            return self._buckets[digest]
+
+    def _post(self, payload, api_key):
+        """Invia la richiesta, ritentando con attesa crescente su 429, 5xx ed errori di rete"""
+        import requests
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = self.session().post(
+                    f"{self.base_url}/chat/completions",
+                    json=payload,
+                    headers={"Authorization": f"Bearer {api_key}"},
+                    stream=True,
+                    timeout=self.timeout,
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = LLMError(f"Connessione al modello non riuscita: {e}")
+            else:
+                if response.status_code == 200:
+                    return response
+                error = LLMError(
+                    f"Il modello ha risposto {response.status_code}: {response.text[:200]}",
+                    status=response.status_code,
+                )
+                response.close()
+                if response.status_code != 429 and response.status_code < 500:
+                    raise error
+                retry_after = response.headers.get("Retry-After")
+            if attempt == self.max_retries:
+                raise error
+            delay = self.backoff * 2 ** attempt * (0.5 + random.random())
+            if retry_after:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+            time.sleep(delay)
+
+    def stream(self, messages, model, params, api_key=None):
+        api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        if not api_key:
+            raise LLMError("Manca la chiave API OpenAI")
+        requests_bucket, tokens_bucket = self._limits(api_key)
+        requests_bucket.acquire()
+        tokens_bucket.acquire(
+            sum(estimate_tokens(m["content"]) for m in messages) + params.get("max_tokens", 500)
+        )
+
+        with span("llm.request"):
+            response = self._post(dict(model=model, messages=messages, stream=True, **params), api_key)
+        with response:
+            # Risposta in formato server-sent events: una riga "data: {...}" per pezzo
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    return
+                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+        # Senza "[DONE]" la connessione si è chiusa a metà: la risposta è incompleta e non va in cache
+        raise LLMError("La risposta del modello si è interrotta prima della fine")
+
+
+class FakeChatBackend(ChatBackend):
+    """Modello finto e deterministico per test e benchmark: ripete il testo ricevuto"""
+
+    name = "fake"
+
+    def __init__(self, ttft=0.0, latency_per_piece=0.0, words_per_piece=3):
+        self.ttft = ttft
+        self.latency_per_piece = latency_per_piece
+        self.words_per_piece = words_per_piece
+
+    def stream(self, messages, model, params, api_key=None):
+        if self.ttft:
+            time.sleep(self.ttft)
+        words = messages[-1]["content"].split()
+        for start in range(0, len(words), self.words_per_piece):
+            if start and self.latency_per_piece:
+                time.sleep(self.latency_per_piece)
+            yield (" " if start else "") + " ".join(words[start:start + self.words_per_piece])
+
+
+CHAT_BACKENDS = {
+    "openai": OpenAIBackend,
+    "fake": FakeChatBackend,
+}
+
+
+def get_chat_backend(name=None):
+    """Crea il modello indicato (o quello in DSA_LLM_BACKEND, predefinito OpenAI)"""
+    name = name or os.environ.get("DSA_LLM_BACKEND", "openai")
+    return CHAT_BACKENDS[name]()
+
+
+class _Flight:
+    """Richiesta in corso condivisa: chi arriva dopo legge gli stessi pezzi"""
+
+    def __init__(self):
+        self.pieces = []
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def add(self, piece):
+        with self._cond:
+            self.pieces.append(piece)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def follow(self):
+        position = 0
+        while True:
+            with self._cond:
+                while position >= len(self.pieces) and not self.done:
+                    self._cond.wait()
+                new = self.pieces[position:]
+                position = len(self.pieces)
+                done, error = self.done, self.error
+            yield from new
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+
+class ChatClient:
+    """Punto unico per le chiamate al modello: cache, richieste condivise e tempi di risposta"""
+
+    def __init__(self, cache=None, history=500, backend=None):
+        self.cache = cache or llm_cache()
+        self.backend = backend or get_chat_backend()
+        self.history = deque(maxlen=history)
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _produce(self, flight, key, flight_key, messages, model, params, api_key):
+        """Esegue la richiesta in un thread proprio, indipendente da chi la legge"""
+        try:
+            for delta in self.backend.stream(messages, model, params, api_key):
+                flight.add(delta)
+        except Exception as e:
+            flight.finish(e if isinstance(e, LLMError) else LLMError(str(e)))
+        else:
+            if flight.pieces:
+                self.cache.set(key, "".join(flight.pieces))
+            flight.finish()
+        finally:
+            with self._lock:
+                self._flights.pop(flight_key, None)
+
+    def _pieces(self, stream, key, messages, model, params, api_key):
+        if key is None:
+            try:
+                yield from self.backend.stream(messages, model, params, api_key)
+            except LLMError:
+                raise
+            except Exception as e:
+                raise LLMError(str(e)) from e
+            return
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            stream.cached = True
+            yield cached
+            return
+
+        # Le richieste identiche già in corso non vengono ripetute, ma solo tra chi usa la
+        # stessa chiave API: un errore di autenticazione o di limite resta a chi ha quella
+        # chiave, e chi non ne ha una non si aggancia alla richiesta pagata da un altro
+        flight_key = (key, hashlib.sha256((api_key or "").encode("utf-8")).digest())
+        with self._lock:
+            flight = self._flights.get(flight_key)
+            if flight is None:
+                flight = self._flights[flight_key] = _Flight()
+                threading.Thread(
+                    target=self._produce, args=(flight, key, flight_key, messages, model, params, api_key),
+                    name="llm-request", daemon=True
+                ).start()
+            else:
+                stream.shared = True
+        yield from flight.follow()
+
+    def stream(self, label, system, template, text, model=MODEL, temperature=None,
+               max_tokens=None, use_cache=True, api_key=None):
+        """Restituisce un `ChatStream`; la richiesta parte alla prima iterazione"""
+        params = {}
+        if temperature is not None:
+            params["temperature"] = temperature
+        if max_tokens is not None:
+            params["max_tokens"] = max_tokens
+        messages = [
+            {"role": "system", "content": system},
+            {"role": "user", "content": template.format(text=text)}
+        ]
+        key = None
+        if use_cache:
+            key = make_key(normalize_text(text), system, template, model, temperature, max_tokens,
+                           self.backend.name)
+
+        stream = ChatStream(label, on_done=self.record)
+        stream.pieces = self._pieces(stream, key, messages, model, params, api_key)
+        return stream
+
+    def complete(self, *args, **kwargs):
+        """Come `stream`, ma attende e restituisce il testo completo"""
+        stream = self.stream(*args, **kwargs)
+        for _ in stream:
+            pass
+        return stream.text
+
+    def record(self, stream):
+        """Registra i tempi di una chiamata conclusa"""
+        reused = stream.cached or stream.shared
+        stage = f"llm.{stream.label}" + (" (cache)" if reused else "")
+        observe(stage, stream.latency, len(stream.text or ""))
+        if not reused and stream.ttft is not None:
+            observe("llm.ttft", stream.ttft)
+        with self._lock:
+            self.history.append({
+                "label": stream.label,
+                "cached": stream.cached or stream.shared,
+                "ttft": stream.ttft,
+                "latency": stream.latency,
+                "chars": len(stream.text or ""),
+            })
+
+    def timings(self):
+        """Tempi medi per tipo di chiamata (solo richieste non in cache)"""
+        with self._lock:
+            calls = [c for c in self.history if not c["cached"]]
+        summary = {}
+        for call in calls:
+            entry = summary.setdefault(call["label"], {"calls": 0, "ttft": 0.0, "latency": 0.0})
+            entry["calls"] += 1
+            entry["ttft"] += call["ttft"] or 0.0
+            entry["latency"] += call["latency"] or 0.0
+        for entry in summary.values():
+            entry["ttft"] /= entry["calls"]
+            entry["latency"] /= entry["calls"]
+        return summary
+
+
+def get_client():
+    """Client condiviso da tutte le sessioni del processo"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ChatClient()
+        return _client
+
+
+def use_backend(backend):
+    """Sostituisce il modello del client condiviso (es. per limitare la concorrenza)"""
+    global _client
+    with _client_lock:
+        _client = ChatClient(backend=backend)
+        return _client
+
+
+def simplify_text(text, api_key=None):
+    """Semplifica il testo usando OpenAI"""
+    return get_client().complete("semplificazione", SIMPLIFY_SYSTEM, SIMPLIFY_PROMPT, text,
+                                 max_tokens=1500, temperature=0.7, api_key=api_key)
+
+
+def simplify_text_stream(text, api_key=None):
+    """Semplifica il testo restituendo la risposta man mano che arriva"""
+    return get_client().stream("semplificazione", SIMPLIFY_SYSTEM, SIMPLIFY_PROMPT, text,
+                               max_tokens=1500, temperature=0.7, api_key=api_key)
+
+
+def estimate_tokens(text):
+    """Stima approssimativa dei token (circa 4 caratteri per token)"""
+    return len(text) // 4 + 1
+
+
+def _split_long_sentence(text, start, end, max_tokens):
+    """Spezza sulle parole una frase troppo lunga; restituisce gli intervalli `(inizio, fine)` nel testo"""
+    parts = []
+    part_start = part_end = None
+    for match in _NON_SPACE_RE.finditer(text, start, end):
+        if part_start is None:
+            part_start = match.start()
+        elif estimate_tokens(text[part_start:match.end()]) > max_tokens:
+            parts.append((part_start, part_end))
+            part_start = match.start()
+        part_end = match.end()
+    if part_start is not None:
+        parts.append((part_start, part_end))
+    return parts
+
+
+def split_into_chunks(text, max_tokens=CHUNK_TOKENS):
+    """Divide il testo (o un `Document`) in parti entro il budget di token, senza spezzare le frasi.
+
+    Le parti sono porzioni del testo originale, con gli spazi e gli a capo
+    com'erano: anche i pezzi di una frase troppo lunga.
+    """
+    from document import get_document
+
+    doc = get_document(text)
+    source = doc.text
+    chunks = []
+    start = end = None
+    for sentence_start, sentence_end in doc.sentence_spans.tolist():
+        pieces = [(sentence_start, sentence_end)]
+        if estimate_tokens(source[sentence_start:sentence_end]) > max_tokens:
+            pieces = _split_long_sentence(source, sentence_start, sentence_end, max_tokens)
+        for piece_start, piece_end in pieces:
+            if start is not None and estimate_tokens(source[start:piece_end]) > max_tokens:
+                chunks.append(source[start:end])
+                start = None
+            if start is None:
+                start = piece_start
+            end = piece_end
+    if start is not None:
+        chunks.append(source[start:end])
+    return chunks
+
+
+def simplify_long_text(text, max_workers=MAX_CONCURRENCY, progress=None, api_key=None):
+    """Semplifica un documento lungo dividendolo in parti elaborate in parallelo.
+
+    `progress(completate, totali)` viene chiamata nel thread del chiamante
+    a ogni parte terminata; le parti vengono ricomposte nell'ordine originale.
+    """
+    chunks = split_into_chunks(text)
+    if len(chunks) <= 1:
+        result = simplify_text(text, api_key)
+        if progress:
+            progress(1, 1)
+        return result
+
+    results = [None] * len(chunks)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+        futures = {submit(pool, simplify_text, chunk, api_key): i for i, chunk in enumerate(chunks)}
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if progress:
+                progress(done, len(chunks))
+    return "\n\n".join(results)
+
+
+def simplify_long_text_stream(text, max_workers=MAX_CONCURRENCY, progress=None, api_key=None):
+    """Versione in streaming di `simplify_long_text`.
+
+    La prima parte arriva token per token mentre le successive vengono
+    semplificate in parallelo e mostrate in ordine appena pronte.
+    """
+    chunks = split_into_chunks(text)
+    if len(chunks) <= 1:
+        return simplify_text_stream(text, api_key)
+
+    def pieces():
+        pool = ThreadPoolExecutor(max_workers=min(max_workers, len(chunks) - 1))
+        try:
+            futures = [submit(pool, simplify_text, chunk, api_key) for chunk in chunks[1:]]
+            yield from simplify_text_stream(chunks[0], api_key)
+            if progress:
+                progress(1, len(chunks))
+            for i, future in enumerate(futures, 2):
+                yield "\n\n" + future.result()
+                if progress:
+                    progress(i, len(chunks))
+        finally:
+            # Se la lettura viene interrotta, le parti non ancora avviate non partono
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    stream = ChatStream("documento", on_done=get_client().record)
+    stream.pieces = pieces()
+    return stream
+
+
+def simplify_selected_stream(sentences, selected, paragraph_starts=(), max_workers=MAX_CONCURRENCY,
+                             progress=None, api_key=None):
+    """Semplifica solo le frasi selezionate, lasciando invariate le altre.
+
+    Le frasi selezionate consecutive nello stesso paragrafo vengono inviate
+    insieme, in parallelo; il testo viene ricomposto nell'ordine originale.
+    """
+    runs = []
+    for i, (sentence, chosen) in enumerate(zip(sentences, selected)):
+        new_paragraph = i in paragraph_starts
+        if runs and runs[-1][0] == bool(chosen) and not new_paragraph:
+            runs[-1][1].append(sentence)
+        else:
+            runs.append((bool(chosen), [sentence], new_paragraph))
+
+    def pieces():
+        to_simplify = [i for i, run in enumerate(runs) if run[0]]
+        pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(to_simplify))))
+        try:
+            futures = {i: submit(pool, simplify_text, " ".join(runs[i][1]), api_key) for i in to_simplify}
+            for i, (chosen, run, new_paragraph) in enumerate(runs):
+                separator = ("\n\n" if new_paragraph else " ") if i else ""
+                yield separator + (futures[i].result().strip() if chosen else " ".join(run))
+                if chosen and progress:
+                    progress(to_simplify.index(i) + 1, len(to_simplify))
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    stream = ChatStream("semplificazione mirata", on_done=get_client().record)
+    stream.pieces = pieces()
+    return stream
+
+
+def create_mind_map(text, api_key=None):
+    """Crea una mappa concettuale dal testo (condensato localmente se è lungo)"""
+    from mindmap import outline
+
+    return get_client().complete("mappa", MIND_MAP_SYSTEM, MIND_MAP_PROMPT, outline(text),
+                                 max_tokens=1000, api_key=api_key)
+
+
+def create_mind_map_stream(text, api_key=None):
+    """Crea la mappa concettuale restituendola man mano che arriva"""
+    from mindmap import outline
+
+    return get_client().stream("mappa", MIND_MAP_SYSTEM, MIND_MAP_PROMPT, outline(text),
+                               max_tokens=1000, api_key=api_key)
+
+
+def suggestions_stream(profile, api_key=None):
+    """Suggerimenti personalizzati in streaming"""
+    return get_client().stream("suggerimenti", SUGGESTIONS_SYSTEM, SUGGESTIONS_PROMPT, profile,
+                               temperature=0.8, use_cache=False, api_key=api_key)
@@ -0,0 +1,264 @@
+"""Misure dei tempi delle fasi lente: PDF, OCR, tokenizzazione, sintesi vocale, modello
+
+Ogni fase registra la durata (e, se utile, i byte elaborati) con `span` o
+con il decoratore `timed`. Le misure finiscono nel registro del processo e,
+se impostato, in quello della sessione Streamlit corrente; i lavori in
+background ereditano la sessione di chi li ha avviati. I registri si
+esportano in JSON o nel formato testuale di Prometheus, insieme alle
+statistiche delle cache e allo spazio occupato dai risultati delle sessioni.
+
+Il costo per misura è un paio di chiamate a `perf_counter` e un lock.
+"""
+import contextvars
+import functools
+import inspect
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Limiti superiori (secondi) dei bucket degli istogrammi
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Campioni recenti tenuti per fase per calcolare i percentili
+RECENT_SAMPLES = 1000
+# File per il textfile collector di Prometheus (node_exporter), se impostato
+METRICS_FILE = os.environ.get("DSA_METRICS_FILE")
+# Secondi minimi tra due scritture del file delle metriche
+METRICS_FILE_INTERVAL = 15
+
+_session = contextvars.ContextVar("metrics_session", default=None)
+_last_written = 0.0
+
+
+class _Stage:
+    __slots__ = ("count", "total", "bytes", "buckets", "recent")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.bytes = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Registry:
+    """Istogrammi di latenza e byte elaborati per fase"""
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, nbytes=0):
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = _Stage()
+            entry.count += 1
+            entry.total += seconds
+            entry.bytes += nbytes
+            entry.recent.append(seconds)
+            for i, limit in enumerate(BUCKETS):
+                if seconds <= limit:
+                    entry.buckets[i] += 1
+                    break
+            else:
+                entry.buckets[-1] += 1
+
+    def summary(self):
+        """Per ogni fase: numero di misure, p50, p95, media e byte elaborati"""
+        with self._lock:
+            stages = {name: (e.count, e.total, e.bytes, sorted(e.recent))
+                      for name, e in self._stages.items()}
+        return {
+            name: {
+                "count": count,
+                "p50": _percentile(recent, 0.5),
+                "p95": _percentile(recent, 0.95),
+                "mean": total / count if count else None,
+                "bytes": nbytes,
+            }
+            for name, (count, total, nbytes, recent) in sorted(stages.items())
+        }
+
+    def histograms(self):
+        with self._lock:
+            return {name: (list(e.buckets), e.count, e.total, e.bytes)
+                    for name, e in sorted(self._stages.items())}
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+
+
+REGISTRY = Registry()
+
+
+def set_session(registry):
+    """Registro della sessione corrente (anche per i thread avviati con il suo contesto)"""
+    _session.set(registry)
+
+
+def observe(stage, seconds, nbytes=0):
+    """Registra una misura già fatta nel registro del processo e in quello della sessione"""
+    REGISTRY.observe(stage, seconds, nbytes)
+    session = _session.get()
+    if session is not None:
+        session.observe(stage, seconds, nbytes)
+
+
+@contextmanager
+def span(stage, nbytes=0):
+    """Misura il blocco `with`; i byte si possono aggiungere dopo con `s["bytes"] = n`"""
+    info = {"bytes": nbytes}
+    started = time.perf_counter()
+    try:
+        yield info
+    finally:
+        observe(stage, time.perf_counter() - started, info["bytes"])
+
+
+def timed(stage):
+    """Decoratore che misura ogni chiamata; per i generatori misura fino all'ultimo elemento"""
+    def decorator(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator(*args, **kwargs):
+                with span(stage):
+                    yield from fn(*args, **kwargs)
+            return generator
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def submit(pool, fn, *args, **kwargs):
+    """Come `pool.submit`, ma il thread del pool misura anche per la sessione corrente"""
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class _Recorder:
+    """Raccoglie le misure così come arrivano, per rimandarle a un altro processo"""
+
+    def __init__(self):
+        self.observations = []
+
+    def observe(self, stage, seconds, nbytes=0):
+        self.observations.append((stage, seconds, nbytes))
+
+
+def run_recorded(fn, *args):
+    """Esegue `fn(*args)` in un processo del pool e restituisce `(risultato, misure)`.
+
+    Le misure fatte nel processo figlio non arrivano da sole al processo
+    principale: vanno riportate nei suoi registri con `replay`.
+    """
+    recorder = _Recorder()
+    token = _session.set(recorder)
+    try:
+        return fn(*args), recorder.observations
+    finally:
+        _session.reset(token)
+
+
+def replay(observations):
+    """Registra le misure restituite da `run_recorded`"""
+    for stage, seconds, nbytes in observations:
+        observe(stage, seconds, nbytes)
+
+
+def cache_stats():
+    """Statistiche delle cache del processo"""
+    from cache import all_stats
+
+    return all_stats()
+
+
+def artifact_stats():
+    """Memoria e disco occupati dai risultati delle sessioni"""
+    from artifacts import usage
+
+    return usage()
+
+
+def to_json(registry=REGISTRY):
+    """Riepilogo delle fasi, delle cache e dei risultati delle sessioni in JSON"""
+    return json.dumps({"stages": registry.summary(), "caches": cache_stats(), "sessions": artifact_stats()},
+                      indent=2)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def to_prometheus(registry=REGISTRY):
+    """Istogrammi, byte e cache nel formato testuale di Prometheus"""
+    lines = [
+        "# HELP dsa_stage_seconds Durata delle fasi di elaborazione",
+        "# TYPE dsa_stage_seconds histogram",
+    ]
+    histograms = registry.histograms()
+    for name, (buckets, count, total, _) in histograms.items():
+        cumulative = 0
+        for limit, value in zip(BUCKETS + ("+Inf",), buckets):
+            cumulative += value
+            lines.append(f'dsa_stage_seconds_bucket{{stage="{_label(name)}",le="{limit}"}} {cumulative}')
+        lines.append(f'dsa_stage_seconds_sum{{stage="{_label(name)}"}} {total}')
+        lines.append(f'dsa_stage_seconds_count{{stage="{_label(name)}"}} {count}')
+
+    lines += ["# HELP dsa_stage_bytes_total Byte elaborati per fase",
+              "# TYPE dsa_stage_bytes_total counter"]
+    for name, (_, _, _, nbytes) in histograms.items():
+        lines.append(f'dsa_stage_bytes_total{{stage="{_label(name)}"}} {nbytes}')
+
+    caches = cache_stats()
+    lines += ["# HELP dsa_cache_requests_total Richieste alle cache per esito",
+              "# TYPE dsa_cache_requests_total counter"]
+    for stats in caches:
+        for result in ("memory_hits", "disk_hits", "misses"):
+            lines.append(
+                f'dsa_cache_requests_total{{cache="{_label(stats["name"])}",result="{result}"}} {stats[result]}'
+            )
+    lines += ["# HELP dsa_cache_hit_ratio Quota di richieste servite dalla cache",
+              "# TYPE dsa_cache_hit_ratio gauge"]
+    for stats in caches:
+        lines.append(f'dsa_cache_hit_ratio{{cache="{_label(stats["name"])}"}} {stats["hit_rate"]}')
+
+    sessions = artifact_stats()
+    lines += ["# HELP dsa_session_artifact_bytes Byte dei risultati delle sessioni per livello",
+              "# TYPE dsa_session_artifact_bytes gauge",
+              f'dsa_session_artifact_bytes{{tier="memory"}} {sessions["memory"]}',
+              f'dsa_session_artifact_bytes{{tier="disk"}} {sessions["disk"]}',
+              "# HELP dsa_session_artifact_max_bytes Byte della sessione più pesante",
+              "# TYPE dsa_session_artifact_max_bytes gauge",
+              f'dsa_session_artifact_max_bytes {sessions["max_session"]}',
+              "# HELP dsa_sessions_with_artifacts Sessioni con risultati conservati",
+              "# TYPE dsa_sessions_with_artifacts gauge",
+              f'dsa_sessions_with_artifacts {sessions["sessions"]}']
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path=METRICS_FILE, interval=METRICS_FILE_INTERVAL):
+    """Aggiorna il file per Prometheus, al massimo una volta ogni `interval` secondi"""
+    global _last_written
+    now = time.monotonic()
+    if not path or now - _last_written < interval:
+        return
+    _last_written = now
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(to_prometheus())
+    os.replace(tmp_path, path)
@@ -0,0 +1,349 @@
+"""Mappe concettuali: riassunto estrattivo locale, struttura ad albero e grafici
+
+Prima della chiamata al modello il documento viene condensato in una
+scaletta entro un budget di token: parole chiave e frasi chiave scelte con
+TextRank su vettori TF-IDF (parole vuote escluse), rimesse nell'ordine del
+testo. Così la mappa tiene conto di tutto il capitolo e non solo
+dell'inizio. La risposta del modello viene poi letta come albero, tenuta in
+cache per hash del documento e disegnata come treemap o sunburst.
+
+I calcoli sono vettoriali su NumPy. La matrice TF-IDF è sparsa (solo le
+coppie frase-parola presenti) e quella delle somiglianze tra frasi non
+viene mai costruita, quindi anche documenti molto lunghi restano in poca
+memoria.
+"""
+import os
+import re
+import threading
+from collections import Counter
+
+from cache import get_cache, make_key, normalize_text
+from metrics import timed
+
+STOPWORDS_PATH = os.environ.get(
+    "DSA_STOPWORDS",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "stopwords_it.txt")
+)
+# Token massimi della scaletta inviata al modello
+OUTLINE_TOKENS = 1500
+# Parole chiave in testa alla scaletta
+KEYPHRASES = 12
+# Parole distinte considerate (le più diffuse nel documento)
+MAX_TERMS = 3000
+# Smorzamento e iterazioni di TextRank
+DAMPING = 0.85
+ITERATIONS = 30
+# Peso in più per la prima frase di ogni paragrafo
+LEAD_BONUS = 0.2
+# Versione del riassunto: cambiandola le scalette in cache vengono ricalcolate
+OUTLINE_VERSION = 1
+
+_WORD_RE = re.compile(r"[^\W\d_]+(?:['’][^\W\d_]+)*")
+_TREE_PREFIX_RE = re.compile(r"^(?:[\s│├└─|`+\-*•#>]|\d+[.)]\s)*")
+
+_stopwords = None
+_stopwords_lock = threading.Lock()
+
+
+def load_stopwords(path=STOPWORDS_PATH):
+    """Legge le parole vuote: una per riga, `#` per i commenti"""
+    with open(path, encoding="utf-8") as f:
+        return frozenset(
+            word for word in (line.strip().lower() for line in f) if word and not word.startswith("#")
+        )
+
+
+def get_stopwords():
+    global _stopwords
+    with _stopwords_lock:
+        if _stopwords is None:
+            _stopwords = load_stopwords()
+        return _stopwords
+
+
+def document_key(text):
+    """Hash del documento, usato per la scaletta e per la mappa in cache"""
+    return make_key(normalize_text(text), OUTLINE_VERSION)
+
+
+# --- Riassunto estrattivo ---
+
+def _sentences(text):
+    """Frasi del testo e indice del paragrafo di ciascuna"""
+    from document import get_document
+
+    doc = get_document(text)
+    return doc.sentences, doc.sentence_paragraphs().tolist()
+
+
+def _content_words(sentence, stopwords):
+    """Parole significative della frase, con `None` al posto di parole vuote e punteggiatura"""
+    words = []
+    position = 0
+    sentence = sentence.lower()
+    for match in _WORD_RE.finditer(sentence):
+        if sentence[position:match.start()].strip(" '’"):
+            words.append(None)
+        word = match.group()
+        words.append(word if len(word) > 2 and word not in stopwords else None)
+        position = match.end()
+    return words
+
+
+class SparseRows:
+    """Matrice sparsa frasi × parole in forma di coordinate (riga, colonna, valore).
+
+    Ha solo le operazioni che servono a TextRank e alle parole chiave: memoria
+    e tempo sono proporzionali alle coppie presenti, non a frasi × parole.
+    """
+
+    def __init__(self, rows, cols, values, shape):
+        self.rows = rows
+        self.cols = cols
+        self.values = values
+        self.shape = shape
+
+    def dot(self, vector):
+        """X·v, con v lungo quanto le parole"""
+        import numpy as np
+
+        return np.bincount(self.rows, weights=self.values * vector[self.cols],
+                           minlength=self.shape[0]).astype(np.float32)
+
+    def rdot(self, vector):
+        """Xᵀ·v, con v lungo quanto le frasi"""
+        import numpy as np
+
+        return np.bincount(self.cols, weights=self.values * vector[self.rows],
+                           minlength=self.shape[1]).astype(np.float32)
+
+    def row_norms2(self):
+        """Quadrato della norma di ogni riga"""
+        import numpy as np
+
+        return np.bincount(self.rows, weights=self.values ** 2, minlength=self.shape[0]).astype(np.float32)
+
+    def column_sums(self):
+        import numpy as np
+
+        return np.bincount(self.cols, weights=self.values, minlength=self.shape[1])
+
+
+def _tfidf(tokens, n_sentences):
+    """Matrice TF-IDF sparsa (frasi × parole) con righe di norma unitaria, e il vocabolario"""
+    import numpy as np
+
+    vocabulary = {}
+    rows, cols = [], []
+    for i, words in enumerate(tokens):
+        for word in words:
+            if word is not None:
+                rows.append(i)
+                cols.append(vocabulary.setdefault(word, len(vocabulary)))
+    terms = list(vocabulary)
+    empty = np.zeros(0, dtype=np.int64)
+    if not terms:
+        return SparseRows(empty, empty, np.zeros(0, dtype=np.float32), (n_sentences, 0)), terms
+
+    # Coppie frase-parola distinte, con le occorrenze
+    pairs, counts = np.unique(np.asarray(rows, dtype=np.int64) * len(terms) + np.asarray(cols),
+                              return_counts=True)
+    rows, cols = pairs // len(terms), pairs % len(terms)
+    # Frequenza nei documenti (frasi): ogni coppia frase-parola conta una volta
+    df = np.bincount(cols, minlength=len(terms))
+    if len(terms) > MAX_TERMS:
+        keep = np.sort(np.argsort(-df, kind="stable")[:MAX_TERMS])
+        remap = np.full(len(terms), -1)
+        remap[keep] = np.arange(len(keep))
+        mask = remap[cols] >= 0
+        rows, cols, counts = rows[mask], remap[cols[mask]], counts[mask]
+        df = df[keep]
+        terms = [terms[i] for i in keep]
+
+    idf = np.log((1 + n_sentences) / (1 + df)).astype(np.float32) + 1
+    values = np.log1p(counts).astype(np.float32) * idf[cols]
+    norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=n_sentences)).astype(np.float32)
+    values /= norms[rows]
+    return SparseRows(rows, cols, values, (n_sentences, len(terms))), terms
+
+
+def textrank(matrix, damping=DAMPING, iterations=ITERATIONS):
+    """Centralità delle frasi sul grafo delle somiglianze del coseno.
+
+    Le somiglianze (S = X·Xᵀ senza la diagonale) non vengono materializzate:
+    ogni prodotto S·v si calcola come X·(Xᵀ·v) sulla matrice sparsa, in tempo
+    proporzionale alle coppie frase-parola presenti.
+    """
+    import numpy as np
+
+    n = matrix.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    self_similarity = matrix.row_norms2()
+
+    def similar(vector):
+        return matrix.dot(matrix.rdot(vector)) - self_similarity * vector
+
+    degree = similar(np.ones(n, dtype=np.float32))
+    connected = degree > 1e-9
+    scores = np.full(n, 1.0 / n, dtype=np.float32)
+    for _ in range(iterations):
+        spread = np.divide(scores, degree, out=np.zeros_like(scores), where=connected)
+        scores = (1 - damping) / n + damping * similar(spread)
+    return scores
+
+
+def keyphrases(tokens, matrix, terms, count=KEYPHRASES):
+    """Gruppi di 1-3 parole significative consecutive, pesati con il TF-IDF delle parole
+    e con quante volte compaiono"""
+    import numpy as np
+
+    if not terms:
+        return []
+    weight = dict(zip(terms, (matrix.column_sums() / max(1, matrix.shape[0])).tolist()))
+    candidates = Counter()
+    for words in tokens:
+        run = []
+        for word in words + [None]:
+            if word is not None and word in weight:
+                run.append(word)
+                continue
+            for size in range(1, 4):
+                for start in range(len(run) - size + 1):
+                    candidates[" ".join(run[start:start + size])] += 1
+            run = []
+
+    scored = sorted(
+        candidates.items(),
+        key=lambda item: -sum(weight[w] for w in item[0].split()) / np.sqrt(item[0].count(" ") + 1)
+        * np.log1p(item[1]),
+    )
+    chosen = []
+    for phrase, _ in scored:
+        # Le parole già coperte da una frase chiave più forte non si ripetono
+        if not any(phrase in other or other in phrase for other in chosen):
+            chosen.append(phrase)
+        if len(chosen) >= count:
+            break
+    return chosen
+
+
+@timed("mindmap.outline")
+def build_outline(text, budget=OUTLINE_TOKENS):
+    """Scaletta del documento entro `budget` token: parole chiave e frasi chiave in ordine.
+
+    Un testo che sta già nel budget viene restituito così com'è.
+    """
+    from llm import estimate_tokens
+
+    if estimate_tokens(text) <= budget:
+        return text
+    sentences, paragraphs = _sentences(text)
+    stopwords = get_stopwords()
+    tokens = [_content_words(sentence, stopwords) for sentence in sentences]
+    matrix, terms = _tfidf(tokens, len(sentences))
+    scores = textrank(matrix)
+    for i in range(len(sentences)):
+        if i == 0 or paragraphs[i] != paragraphs[i - 1]:
+            scores[i] *= 1 + LEAD_BONUS
+
+    header = "Parole chiave: " + ", ".join(keyphrases(tokens, matrix, terms)) + "\n\n"
+    used = estimate_tokens(header)
+    chosen, seen = [], set()
+    for i in sorted(range(len(sentences)), key=lambda i: -scores[i]):
+        normalized = normalize_text(sentences[i]).lower()
+        cost = estimate_tokens(sentences[i]) + 1
+        if normalized in seen or used + cost > budget:
+            continue
+        seen.add(normalized)
+        chosen.append(i)
+        used += cost
+
+    parts = []
+    for i in sorted(chosen):
+        separator = "\n\n" if parts and paragraphs[i] != paragraphs[parts[-1][0]] else " "
+        parts.append((i, (separator if parts else "") + sentences[i]))
+    return header + "".join(part for _, part in parts)
+
+
+def outline(text, budget=OUTLINE_TOKENS):
+    """Scaletta del documento, in cache per hash del documento"""
+    key = make_key(document_key(text), budget)
+    return get_cache("scalette").get_or_compute(key, lambda: build_outline(text, budget))
+
+
+# --- Struttura della mappa ---
+
+def parse_tree(structure, root_name="Mappa concettuale"):
+    """Legge la mappa scritta dal modello (rami ├──/└──, elenchi puntati o rientri).
+
+    Restituisce un nodo `{"name": ..., "children": [...]}`; il livello di ogni
+    riga dipende dalla larghezza del prefisso. Se ci sono più concetti al
+    primo livello, vengono raccolti sotto un nodo radice.
+    """
+    roots = []
+    stack = []  # (larghezza del prefisso, nodo)
+    for line in structure.splitlines():
+        if not line.strip():
+            continue
+        prefix = _TREE_PREFIX_RE.match(line).group()
+        name = line[len(prefix):].strip().strip("*_:").strip()
+        if not name:
+            continue
+        width = len(prefix.expandtabs(4))
+        node = {"name": name, "children": []}
+        while stack and stack[-1][0] >= width:
+            stack.pop()
+        (stack[-1][1]["children"] if stack else roots).append(node)
+        stack.append((width, node))
+
+    if len(roots) == 1:
+        return roots[0]
+    return {"name": root_name, "children": roots}
+
+
+def save_tree(text, structure):
+    """Salva la mappa del documento (testo e albero) nella cache condivisa"""
+    tree = parse_tree(structure)
+    get_cache("mappe").set(document_key(text), {"structure": structure, "tree": tree})
+    return tree
+
+
+def load_tree(key):
+    """Mappa già generata per l'hash del documento, o `None`"""
+    return get_cache("mappe").get(key)
+
+
+def _flatten(tree):
+    """Nodi in forma di elenchi paralleli (id unici, etichette, genitori) per plotly"""
+    ids, labels, parents = [], [], []
+    seen = set()
+
+    def visit(node, parent_id):
+        node_id = f"{parent_id}/{node['name']}" if parent_id else node["name"]
+        while node_id in seen:
+            node_id += "'"
+        seen.add(node_id)
+        ids.append(node_id)
+        labels.append(node["name"])
+        parents.append(parent_id)
+        for child in node["children"]:
+            visit(child, node_id)
+
+    visit(tree, "")
+    return ids, labels, parents
+
+
+def mind_map_figure(tree, kind="treemap"):
+    """Treemap o sunburst della mappa concettuale"""
+    import plotly.graph_objects as go
+
+    ids, labels, parents = _flatten(tree)
+    if kind == "sunburst":
+        trace = go.Sunburst(ids=ids, labels=labels, parents=parents, maxdepth=3,
+                            insidetextorientation="radial", hoverinfo="label")
+    else:
+        trace = go.Treemap(ids=ids, labels=labels, parents=parents, maxdepth=4, hoverinfo="label")
+    fig = go.Figure(trace)
+    fig.update_layout(margin={"l": 10, "r": 10, "t": 10, "b": 10}, height=520)
+    return fig
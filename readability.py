@@ -0,0 +1,203 @@
+"""Leggibilità dei testi italiani: indice Gulpease, sillabe e difficoltà per frase
+
+Frasi e parole vengono dal `Document` condiviso, senza ritokenizzare il
+testo. I conteggi di ogni paragrafo sono tenuti in array NumPy e memorizzati
+per hash del paragrafo: quando il testo viene modificato si ricalcolano solo
+i paragrafi cambiati, poi gli array vengono concatenati e gli indici
+calcolati in forma vettoriale su tutte le frasi.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import repeat
+
+from document import get_document
+
+# Sotto questo valore di Gulpease una frase è considerata difficile
+# (difficile per la scuola media secondo la scala dell'indice)
+DIFFICULT_GULPEASE = 50
+# Paragrafi analizzati tenuti in memoria
+MAX_CACHED_PARAGRAPHS = 4096
+
+_VOWEL_GROUP_RE = re.compile(r"[aeiouàèéìíòóùúy]+")
+# Gli apostrofi dentro le parole ("dell'acqua") non contano come lettere
+_NO_APOSTROPHES = str.maketrans("", "", "'’")
+_STRONG = set("aeoàèéìíòóùú")
+
+_paragraphs = OrderedDict()
+_paragraphs_lock = threading.Lock()
+
+
+@lru_cache(maxsize=65536)
+def count_syllables(word):
+    """Stima le sillabe di una parola italiana.
+
+    Ogni gruppo di vocali vale una sillaba (dittonghi e trittonghi con i/u
+    non accentate), più una per ogni iato tra due vocali forti (a, e, o o
+    vocali accentate), come in "pa-e-se" o "po-e-ta".
+    """
+    syllables = 0
+    for group in _VOWEL_GROUP_RE.findall(word.lower()):
+        syllables += 1
+        for first, second in zip(group, group[1:]):
+            if first in _STRONG and second in _STRONG:
+                syllables += 1
+    return max(1, syllables)
+
+
+def gulpease_label(score):
+    """Livello di difficoltà secondo la scala Gulpease"""
+    if score >= 80:
+        return "Facile (scuola elementare)"
+    if score >= 60:
+        return "Medio (scuola media)"
+    if score >= 40:
+        return "Difficile (scuola superiore)"
+    return "Molto difficile"
+
+
+class _ParagraphStats:
+    __slots__ = ("sentences", "words", "letters", "syllables")
+
+    def __init__(self, sentences, words, letters, syllables):
+        self.sentences = sentences
+        self.words = words
+        self.letters = letters
+        self.syllables = syllables
+
+
+def _analyze_paragraph(doc, first, stop):
+    """Conteggi per frase delle frasi `first:stop` del documento"""
+    import numpy as np
+
+    begin, end = np.searchsorted(doc.word_sentence, [first, stop])
+    text = doc.text
+    words = [text[start:finish] for start, finish in doc.word_spans[begin:end].tolist()]
+    syllables = np.fromiter(map(count_syllables, words), dtype=np.float64, count=len(words))
+    lengths = np.fromiter(map(len, map(str.translate, words, repeat(_NO_APOSTROPHES))),
+                          dtype=np.float64, count=len(words))
+
+    index = doc.word_sentence[begin:end] - first
+    count = stop - first
+    return _ParagraphStats(
+        [doc.sentence(i) for i in range(first, stop)],
+        np.bincount(index, minlength=count).astype(np.int32),
+        np.bincount(index, weights=lengths, minlength=count),
+        np.bincount(index, weights=syllables, minlength=count),
+    )
+
+
+def _paragraph_stats(doc, first, stop):
+    """Statistiche del paragrafo, ricalcolate solo se il paragrafo è nuovo"""
+    start, end = doc.sentence_spans[first][0], doc.sentence_spans[stop - 1][1]
+    key = hashlib.blake2b(doc.text[start:end].encode("utf-8"), digest_size=16).digest()
+    with _paragraphs_lock:
+        stats = _paragraphs.get(key)
+        if stats is not None:
+            _paragraphs.move_to_end(key)
+            return stats
+
+    stats = _analyze_paragraph(doc, first, stop)
+    with _paragraphs_lock:
+        _paragraphs[key] = stats
+        while len(_paragraphs) > MAX_CACHED_PARAGRAPHS:
+            _paragraphs.popitem(last=False)
+    return stats
+
+
+class ReadabilityReport:
+    """Indici di leggibilità del documento e di ciascuna frase"""
+
+    def __init__(self, sentences, words, letters, syllables, paragraph_starts=()):
+        import numpy as np
+
+        self.sentences = sentences
+        self.paragraph_starts = frozenset(paragraph_starts)
+        self.words = words
+        self.letters = letters
+        self.syllables = syllables
+
+        safe_words = np.maximum(words, 1)
+        # Gulpease = 89 + (300 * frasi - 10 * lettere) / parole, per ogni frase
+        self.sentence_gulpease = np.clip(89 + (300 - 10 * letters) / safe_words, 0, 100)
+        self.sentence_gulpease[words == 0] = 100
+        self.difficulty = 1 - self.sentence_gulpease / 100
+
+        self.n_sentences = len(sentences)
+        self.n_words = int(words.sum())
+        self.n_letters = int(letters.sum())
+        self.n_syllables = int(syllables.sum())
+
+    @property
+    def gulpease(self):
+        if not self.n_words:
+            return 100.0
+        score = 89 + (300 * self.n_sentences - 10 * self.n_letters) / self.n_words
+        return float(min(100.0, max(0.0, score)))
+
+    @property
+    def avg_sentence_length(self):
+        return self.n_words / self.n_sentences if self.n_sentences else 0.0
+
+    @property
+    def avg_syllables_per_word(self):
+        return self.n_syllables / self.n_words if self.n_words else 0.0
+
+    def difficult_mask(self, threshold=DIFFICULT_GULPEASE):
+        """Array booleano delle frasi con Gulpease sotto la soglia"""
+        return self.sentence_gulpease < threshold
+
+
+def analyze(text):
+    """Analizza il testo (o un `Document`) riusando i paragrafi già calcolati"""
+    import numpy as np
+
+    doc = get_document(text)
+    stats = [_paragraph_stats(doc, first, stop) for first, stop in doc.paragraphs()]
+    if not stats:
+        empty = np.zeros(0)
+        return ReadabilityReport([], empty.astype(np.int32), empty, empty)
+    starts = np.cumsum([0] + [len(s.sentences) for s in stats[:-1]])
+    return ReadabilityReport(
+        [sentence for s in stats for sentence in s.sentences],
+        np.concatenate([s.words for s in stats]),
+        np.concatenate([s.letters for s in stats]),
+        np.concatenate([s.syllables for s in stats]),
+        paragraph_starts=starts.tolist(),
+    )
+
+
+def difficulty_heatmap(report, columns=20):
+    """Mappa di calore della difficoltà: una cella per frase, in ordine di lettura"""
+    import numpy as np
+    import plotly.graph_objects as go
+
+    rows = max(1, -(-report.n_sentences // columns))
+    values = np.full(rows * columns, np.nan)
+    values[:report.n_sentences] = report.sentence_gulpease
+    labels = np.full(rows * columns, "", dtype=object)
+    for i, sentence in enumerate(report.sentences):
+        snippet = sentence if len(sentence) <= 80 else sentence[:77] + "..."
+        labels[i] = f"Frase {i + 1} · Gulpease {report.sentence_gulpease[i]:.0f}<br>{snippet}"
+
+    fig = go.Figure(go.Heatmap(
+        z=values.reshape(rows, columns),
+        text=labels.reshape(rows, columns),
+        hoverinfo="text",
+        zmin=0,
+        zmax=100,
+        colorscale="RdYlGn",
+        colorbar={"title": "Gulpease"},
+        xgap=2,
+        ygap=2,
+    ))
+    fig.update_layout(
+        title="🌡️ Difficoltà per frase",
+        xaxis={"visible": False},
+        yaxis={"visible": False, "autorange": "reversed"},
+        height=120 + 30 * rows,
+        margin={"l": 10, "r": 10, "t": 40, "b": 10},
+    )
+    return fig
@@ -0,0 +1,184 @@
+"""Lettore a pagine per documenti lunghi, con il testo tenuto sul server
+
+Il testo estratto (pagine di un PDF, trascrizioni, testi semplificati) viene
+salvato una volta su disco in UTF-8, per hash del contenuto, con accanto
+l'indice delle pagine in byte. Il lettore apre il file con `mmap` e
+decodifica solo la pagina richiesta, così al browser arriva una pagina alla
+volta invece dell'intero libro a ogni riesecuzione.
+"""
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from cache import CACHE_DIR
+
+READER_DIR = os.path.join(CACHE_DIR, "lettore")
+# Caratteri per pagina quando il testo non ha pagine sue (testi digitati, trascrizioni)
+PAGE_CHARS = 3000
+# Documenti aperti (file mappati in memoria) tenuti pronti
+MAX_OPEN_DOCUMENTS = 16
+# Spazio massimo su disco: oltre, si eliminano i documenti letti meno di recente
+MAX_DISK_BYTES = 256 * 1024 * 1024
+
+_open = OrderedDict()
+_open_lock = threading.Lock()
+_saves_since_sweep = 0
+
+
+class PagedText:
+    """Testo diviso in pagine, letto dal file mappato in memoria pagina per pagina"""
+
+    def __init__(self, key, path, offsets):
+        self.key = key
+        self.offsets = offsets
+        self._map = b""
+        if len(offsets) and offsets[-1]:
+            with open(path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def n_pages(self):
+        return max(1, len(self.offsets) - 1)
+
+    def page(self, index):
+        """Testo della pagina `index` (da 0)"""
+        if len(self.offsets) < 2:
+            return ""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self._map[start:end].decode("utf-8")
+
+    def text(self):
+        """Testo intero"""
+        return self._map[:].decode("utf-8") if len(self._map) else ""
+
+
+def paginate(text, page_chars=PAGE_CHARS):
+    """Divide il testo in pagine di circa `page_chars` caratteri.
+
+    Le pagine finiscono a fine paragrafo quando possibile, altrimenti a fine
+    riga o tra due parole; unite di nuovo ridanno il testo originale.
+    """
+    pages = []
+    start = 0
+    while len(text) - start > page_chars:
+        limit = start + page_chars
+        end = -1
+        for separator in ("\n\n", "\n", " "):
+            end = text.rfind(separator, start + page_chars // 2, limit)
+            if end != -1:
+                end += len(separator)
+                break
+        if end == -1:
+            end = limit
+        pages.append(text[start:end])
+        start = end
+    pages.append(text[start:])
+    return pages
+
+
+def _paths(key):
+    return os.path.join(READER_DIR, key + ".txt"), os.path.join(READER_DIR, key + ".idx")
+
+
+def _write(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=READER_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def save_pages(pages):
+    """Salva le pagine sul disco (se non ci sono già) e restituisce la chiave del documento"""
+    import numpy as np
+
+    global _saves_since_sweep
+    encoded = [page.encode("utf-8") for page in pages]
+    digest = hashlib.blake2b(digest_size=16)
+    for data in encoded:
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    key = digest.hexdigest()
+
+    text_path, index_path = _paths(key)
+    if os.path.exists(index_path):
+        os.utime(index_path)
+        return key
+    os.makedirs(READER_DIR, exist_ok=True)
+    offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    # Prima il testo, poi l'indice: un indice presente garantisce un testo completo
+    _write(text_path, b"".join(encoded))
+    _write(index_path, offsets.tobytes())
+
+    _saves_since_sweep += 1
+    if _saves_since_sweep >= 16:
+        _saves_since_sweep = 0
+        sweep()
+    return key
+
+
+def save_text(text, page_chars=PAGE_CHARS):
+    """Salva un testo senza pagine proprie, diviso con `paginate`"""
+    return save_pages(paginate(text, page_chars))
+
+
+def open_pages(key):
+    """Documento salvato con `save_pages`, o `None` se non esiste più"""
+    import numpy as np
+
+    with _open_lock:
+        document = _open.get(key)
+        if document is not None:
+            _open.move_to_end(key)
+            return document
+
+    text_path, index_path = _paths(key)
+    try:
+        offsets = np.fromfile(index_path, dtype="<i8")
+        document = PagedText(key, text_path, offsets)
+    except (OSError, ValueError):
+        return None
+    with _open_lock:
+        _open[key] = document
+        while len(_open) > MAX_OPEN_DOCUMENTS:
+            # Il file si chiude quando nessuna sessione usa più il documento
+            _open.popitem(last=False)
+    return document
+
+
+def sweep(max_bytes=MAX_DISK_BYTES):
+    """Elimina i documenti letti meno di recente oltre il limite di spazio"""
+    documents = []
+    total = 0
+    try:
+        names = os.listdir(READER_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if not name.endswith(".idx"):
+            continue
+        key = name[:-4]
+        text_path, index_path = _paths(key)
+        try:
+            size = os.path.getsize(text_path) + os.path.getsize(index_path)
+            documents.append((os.path.getmtime(index_path), size, key))
+        except OSError:
+            continue
+        total += size
+
+    documents.sort()
+    for _, size, key in documents:
+        if total <= max_bytes:
+            break
+        with _open_lock:
+            if key in _open:
+                continue
+        for path in _paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
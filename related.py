@@ -0,0 +1,296 @@
+"""Ricerca semantica locale e "materiali correlati" sui testi dell'archivio
+
+Ogni testo salvato diventa un vettore di dimensione fissa: parole
+significative e trigrammi di caratteri (così "fotosintesi" e
+"fotosintetica" si avvicinano) vengono mappati con un hash su `DIM`
+componenti, con segno casuale per compensare le collisioni, e il vettore
+è normalizzato. Non serve un vocabolario, quindi l'indice cresce un testo
+alla volta senza ricalcolare gli altri.
+
+I vettori stanno in un file binario accanto al database, letto con
+`numpy.memmap`; i nuovi testi vengono aggiunti in coda, da un thread in
+background, leggendo dal database solo le righe con id maggiore
+dell'ultimo indicizzato. La
+ricerca è un prodotto matrice-vettore e una selezione parziale dei
+migliori: pochi millisecondi anche con decine di migliaia di testi.
+"""
+import contextlib
+import hashlib
+import os
+import threading
+import zlib
+from collections import Counter, OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: il blocco vale solo tra i thread del processo
+    fcntl = None
+
+from document import WORD_RE
+from metrics import timed
+from storage import get_storage
+
+# Componenti di ogni vettore
+DIM = 256
+# Caratteri considerati per testo (l'inizio basta a capire l'argomento)
+MAX_CHARS = 20000
+# Peso dei trigrammi di caratteri rispetto alle parole intere
+TRIGRAM_WEIGHT = 0.5
+# Punteggio minimo perché un testo sia considerato correlato
+MIN_SCORE = 0.2
+# Vettori delle ricerche recenti tenuti in memoria
+MAX_CACHED_QUERIES = 64
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+_queries = OrderedDict()
+_queries_lock = threading.Lock()
+
+
+def _features(text):
+    """Parole significative e trigrammi di caratteri, con il numero di occorrenze"""
+    from mindmap import get_stopwords
+
+    stopwords = get_stopwords()
+    words = Counter(
+        word for word in WORD_RE.findall(text[:MAX_CHARS].lower()) if len(word) > 2 and word not in stopwords
+    )
+    features = Counter()
+    for word, count in words.items():
+        features[word] += count
+        padded = f"<{word}>"
+        for i in range(len(padded) - 2):
+            features["#" + padded[i:i + 3]] += count * TRIGRAM_WEIGHT
+    return features
+
+
+def embed(text, dim=DIM):
+    """Vettore normalizzato del testo (float32); nullo se il testo non ha parole significative"""
+    import numpy as np
+
+    vector = np.zeros(dim, dtype=np.float32)
+    features = _features(text)
+    if not features:
+        return vector
+    hashes = np.fromiter((zlib.crc32(feature.encode("utf-8")) for feature in features),
+                         dtype=np.uint32, count=len(features))
+    weights = np.log1p(np.fromiter(features.values(), dtype=np.float32, count=len(features)))
+    signs = np.where(hashes & 0x80000000, 1.0, -1.0).astype(np.float32)
+    np.add.at(vector, hashes % dim, signs * weights)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def _query_vector(text):
+    """Vettore di un testo cercato, memorizzato per hash: le riesecuzioni non lo ricalcolano"""
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    with _queries_lock:
+        vector = _queries.get(key)
+        if vector is not None:
+            _queries.move_to_end(key)
+            return vector
+    vector = embed(text)
+    with _queries_lock:
+        _queries[key] = vector
+        while len(_queries) > MAX_CACHED_QUERIES:
+            _queries.popitem(last=False)
+    return vector
+
+
+class VectorIndex:
+    """Vettori e id dei testi in due file in sola aggiunta, letti con memmap.
+
+    La riga i ha il vettore all'offset `i * dim`, quindi i due file devono
+    restare allineati. Il file degli id è scritto dopo quello dei vettori e
+    i testi indicizzati sono quelli con id e vettore completi; prima di ogni
+    aggiunta i file vengono riportati a quel numero di righe (un'aggiunta
+    interrotta a metà viene scartata). Aggiunte e `sync` di processi diversi
+    sono serializzate da un `flock` sul file `indice.lock`.
+    """
+
+    def __init__(self, directory, dim=DIM):
+        self.directory = directory
+        self.dim = dim
+        self.vectors_path = os.path.join(directory, f"vettori_{dim}.f32")
+        self.ids_path = os.path.join(directory, f"id_{dim}.i64")
+        self.lock_path = os.path.join(directory, "indice.lock")
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        self._count = -1
+        self._vectors = None
+        self._ids = None
+        self._background = None
+        self._background_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _writing(self):
+        """Blocco per le scritture, tra i thread e (con `flock`) tra i processi; rientrante"""
+        with self._write_lock:
+            if self._write_depth or fcntl is None:
+                self._write_depth += 1
+                try:
+                    yield
+                finally:
+                    self._write_depth -= 1
+                return
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._write_depth += 1
+                try:
+                    yield
+                finally:
+                    self._write_depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _rows(self):
+        """Righe complete: quelle che hanno sia l'id sia il vettore"""
+        try:
+            ids = os.path.getsize(self.ids_path) // 8
+        except FileNotFoundError:
+            ids = 0
+        try:
+            vectors = os.path.getsize(self.vectors_path) // (self.dim * 4)
+        except FileNotFoundError:
+            vectors = 0
+        return min(ids, vectors)
+
+    def _load(self):
+        """Riapre i file solo se nel frattempo sono cresciuti (anche per mano di un altro processo)"""
+        import numpy as np
+
+        count = self._rows()
+        if count != self._count:
+            if count:
+                ids = np.memmap(self.ids_path, dtype="<i8", mode="r", shape=(count,))
+                vectors = np.memmap(self.vectors_path, dtype="<f4", mode="r", shape=(count, self.dim))
+            else:
+                ids = np.zeros(0, dtype="<i8")
+                vectors = np.zeros((0, self.dim), dtype="<f4")
+            if vectors.size != len(ids) * self.dim:
+                raise RuntimeError(f"Indice {self.directory} non allineato: {len(ids)} id e {vectors.size} valori")
+            self._count, self._ids, self._vectors = count, ids, vectors
+        return self._ids, self._vectors
+
+    def __len__(self):
+        with self._lock:
+            return len(self._load()[0])
+
+    @property
+    def last_id(self):
+        with self._lock:
+            ids = self._load()[0]
+            return int(ids[-1]) if len(ids) else 0
+
+    def add(self, ids, vectors):
+        """Aggiunge in coda i vettori (n × dim) dei testi `ids`, in ordine crescente di id.
+
+        Gli id non successivi all'ultimo indicizzato vengono ignorati (già
+        aggiunti da un altro processo).
+        """
+        import numpy as np
+
+        ids = np.asarray(ids, dtype="<i8")
+        vectors = np.ascontiguousarray(vectors, dtype="<f4").reshape(len(ids), self.dim)
+        with self._writing():
+            rows = self._rows()
+            # Scarta i resti di un'aggiunta interrotta: la riga i torna all'offset i * dim
+            for path, size in ((self.vectors_path, rows * self.dim * 4), (self.ids_path, rows * 8)):
+                with open(path, "ab") as f:
+                    f.truncate(size)
+            keep = ids > self.last_id
+            if not keep.any():
+                return
+            with self._lock:
+                with open(self.vectors_path, "ab") as f:
+                    f.write(vectors[keep].tobytes())
+                with open(self.ids_path, "ab") as f:
+                    f.write(ids[keep].tobytes())
+
+    def sync(self, store, batch_size=200):
+        """Indicizza i testi salvati dopo l'ultimo già presente; restituisce quanti sono stati aggiunti"""
+        import numpy as np
+
+        added = 0
+        # Tutto sotto lo stesso blocco: due processi non leggono lo stesso `last_id`
+        with self._writing():
+            while True:
+                rows = store.texts_after(self.last_id, batch_size)
+                if not rows:
+                    return added
+                vectors = np.stack([embed(f"{row['title']}\n{row['content']}", self.dim) for row in rows])
+                self.add([row["id"] for row in rows], vectors)
+                added += len(rows)
+
+    def sync_in_background(self, store):
+        """Avvia `sync` in un thread se ci sono testi nuovi e non ne sta già girando uno.
+
+        Restituisce subito: le ricerche usano i testi già indicizzati.
+        """
+        if not store.texts_after(self.last_id, 1):
+            return False
+        with self._background_lock:
+            if self._background is not None and self._background.is_alive():
+                return False
+            self._background = threading.Thread(target=self.sync, args=(store,),
+                                                 name="indice-correlati", daemon=True)
+            self._background.start()
+        return True
+
+    @timed("related.search")
+    def search(self, vector, k=10):
+        """I `k` testi più simili al vettore: lista di `(id, punteggio)` dal più simile"""
+        import numpy as np
+
+        with self._lock:
+            ids, vectors = self._load()
+        if not len(ids) or not k:
+            return []
+        scores = vectors @ vector
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(ids[i]), float(scores[i])) for i in best]
+
+
+def get_index(store=None):
+    """Indice condiviso per il database dell'archivio.
+
+    Non aspetta l'indicizzazione: i testi salvati dopo l'ultimo indicizzato
+    vengono aggiunti in background e compaiono nelle ricerche successive.
+    """
+    store = store or get_storage()
+    directory = os.path.splitext(store.path)[0] + "_indice"
+    with _indexes_lock:
+        index = _indexes.get(directory)
+        if index is None:
+            index = _indexes[directory] = VectorIndex(directory)
+    index.sync_in_background(store)
+    return index
+
+
+def related_texts(text, user, store=None, k=5, min_score=MIN_SCORE):
+    """Testi dell'archivio simili a `text`: materiali della libreria e testi salvati dall'utente.
+
+    Restituisce le righe dell'archivio con in più la chiave `score`.
+    """
+    store = store or get_storage()
+    vector = _query_vector(text)
+    if not vector.any():
+        return []
+    results, seen = [], set()
+    # Si chiedono più candidati: alcuni sono di altri utenti, cancellati o uguali al testo
+    for text_id, score in get_index(store).search(vector, k * 4):
+        if score < min_score or len(results) >= k:
+            break
+        if text_id in seen:
+            continue
+        seen.add(text_id)
+        row = store.get_text(text_id)
+        if row is None or row["content"] == text:
+            continue
+        if row["kind"] == "materiale" or row["user"] == user:
+            row["score"] = score
+            results.append(row)
+    return results
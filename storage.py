@@ -0,0 +1,271 @@
+"""Archivio persistente su SQLite per testi salvati, materiali e audio
+
+Il database usa il journal WAL, così le letture delle sessioni Streamlit
+non vengono bloccate dalle scritture. Le scritture passano da un unico
+thread per processo e restituiscono un `Future`: la pagina non aspetta il
+disco. Più processi possono scrivere sullo stesso file grazie al
+`busy_timeout`. La ricerca usa un indice FTS5 sincronizzato da trigger.
+"""
+import hashlib
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+DATA_DIR = os.environ.get(
+    "DSA_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+)
+DB_PATH = os.environ.get("DSA_DB_PATH", os.path.join(DATA_DIR, "dsa_assistant.db"))
+AUDIO_DIR = os.path.join(DATA_DIR, "audio")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS texts (
+    id INTEGER PRIMARY KEY,
+    user TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    title TEXT NOT NULL DEFAULT '',
+    content TEXT NOT NULL,
+    simplified TEXT,
+    audio_ref TEXT,
+    word_count INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_texts_user_created ON texts(user, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_texts_kind_created ON texts(kind, created_at DESC);
+-- Materiali predefiniti (senza utente): uno per titolo anche se più processi li inseriscono
+-- insieme. I doppioni lasciati dalle versioni precedenti vengono tolti prima di creare l'indice
+DELETE FROM texts WHERE kind = 'materiale' AND user = '' AND id NOT IN (
+    SELECT MIN(id) FROM texts WHERE kind = 'materiale' AND user = '' GROUP BY title
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_texts_default_materials ON texts(title)
+    WHERE kind = 'materiale' AND user = '';
+
+CREATE VIRTUAL TABLE IF NOT EXISTS texts_fts USING fts5(
+    title, content, simplified,
+    content='texts', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS texts_ai AFTER INSERT ON texts BEGIN
+    INSERT INTO texts_fts(rowid, title, content, simplified)
+    VALUES (new.id, new.title, new.content, new.simplified);
+END;
+CREATE TRIGGER IF NOT EXISTS texts_ad AFTER DELETE ON texts BEGIN
+    INSERT INTO texts_fts(texts_fts, rowid, title, content, simplified)
+    VALUES ('delete', old.id, old.title, old.content, old.simplified);
+END;
+CREATE TRIGGER IF NOT EXISTS texts_au AFTER UPDATE OF title, content, simplified ON texts BEGIN
+    INSERT INTO texts_fts(texts_fts, rowid, title, content, simplified)
+    VALUES ('delete', old.id, old.title, old.content, old.simplified);
+    INSERT INTO texts_fts(rowid, title, content, simplified)
+    VALUES (new.id, new.title, new.content, new.simplified);
+END;
+"""
+
+_COLUMNS = "id, user, kind, title, content, simplified, audio_ref, word_count, created_at"
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+def _fts_query(text):
+    """Trasforma il testo dell'utente in una query FTS5 sicura (prefissi in AND)"""
+    terms = ['"' + term.replace('"', '""') + '"*' for term in text.split()]
+    return " ".join(terms)
+
+
+class Storage:
+    """Accesso al database: letture dirette, scritture su un thread dedicato"""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with _connect(path) as conn:
+            conn.executescript(SCHEMA)
+        self._local = threading.local()
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="storage-writer", daemon=True)
+        self._writer.start()
+
+    # --- scritture ---
+
+    def _write_loop(self):
+        conn = _connect(self.path)
+        while True:
+            future, work = self._writes.get()
+            try:
+                with conn:
+                    result = work(conn)
+                future.set_result(result)
+            except Exception as e:
+                future.set_exception(e)
+
+    def transaction(self, work):
+        """Esegue `work(conn)` in una transazione sul thread di scrittura"""
+        future = Future()
+        self._writes.put((future, work))
+        return future
+
+    def _submit(self, statement, params):
+        return self.transaction(lambda conn: conn.execute(statement, params).lastrowid)
+
+    def save_text(self, user, kind, content, title="", simplified=None, audio_ref=None,
+                  word_count=None):
+        """Salva un testo in background; il `Future` restituisce l'id della riga"""
+        if word_count is None:
+            word_count = len(content.split())
+        return self._submit(
+            "INSERT INTO texts (user, kind, title, content, simplified, audio_ref, word_count, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (user, kind, title, content, simplified, audio_ref, word_count, time.time())
+        )
+
+    def set_audio_ref(self, text_id, audio_ref):
+        """Collega un audio generato a un testo salvato"""
+        return self._submit("UPDATE texts SET audio_ref = ? WHERE id = ?", (audio_ref, text_id))
+
+    def delete_text(self, text_id):
+        return self._submit("DELETE FROM texts WHERE id = ?", (text_id,))
+
+    # --- letture ---
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.path)
+        return conn
+
+    def _where(self, user, kinds):
+        clauses, params = [], []
+        if user is not None:
+            clauses.append("user = ?")
+            params.append(user)
+        if kinds:
+            clauses.append(f"kind IN ({', '.join('?' * len(kinds))})")
+            params.extend(kinds)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def count_texts(self, user=None, kinds=()):
+        where, params = self._where(user, kinds)
+        return self._conn().execute(f"SELECT COUNT(*) FROM texts{where}", params).fetchone()[0]
+
+    def list_texts(self, user=None, kinds=(), page=0, page_size=10):
+        """Una pagina di testi, dal più recente; restituisce (righe, totale)"""
+        where, params = self._where(user, kinds)
+        rows = self._conn().execute(
+            f"SELECT {_COLUMNS} FROM texts{where} ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+            params + [page_size, page * page_size]
+        ).fetchall()
+        return [dict(row) for row in rows], self.count_texts(user, kinds)
+
+    def iter_texts(self, user=None, kinds=(), batch_size=200):
+        """Scorre tutti i testi a blocchi, senza caricarli tutti in memoria"""
+        where, params = self._where(user, kinds)
+        last_id = None
+        while True:
+            clause, clause_params = where, list(params)
+            if last_id is not None:
+                clause += (" AND " if where else " WHERE ") + "id < ?"
+                clause_params.append(last_id)
+            rows = self._conn().execute(
+                f"SELECT {_COLUMNS} FROM texts{clause} ORDER BY id DESC LIMIT ?",
+                clause_params + [batch_size]
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
+            last_id = rows[-1]["id"]
+
+    def texts_after(self, last_id, limit=200):
+        """Testi con id maggiore di `last_id`, in ordine di inserimento (per gli indici incrementali)"""
+        rows = self._conn().execute(
+            f"SELECT {_COLUMNS} FROM texts WHERE id > ? ORDER BY id LIMIT ?", (last_id, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_text(self, text_id):
+        row = self._conn().execute(f"SELECT {_COLUMNS} FROM texts WHERE id = ?", (text_id,)).fetchone()
+        return dict(row) if row else None
+
+    def search(self, query, user=None, kinds=(), page=0, page_size=10):
+        """Ricerca full-text ordinata per pertinenza; restituisce (righe, totale)"""
+        match = _fts_query(query)
+        if not match:
+            return [], 0
+        where, params = self._where(user, kinds)
+        where = where.replace(" WHERE ", " AND ")
+        base = f"FROM texts_fts JOIN texts ON texts.id = texts_fts.rowid WHERE texts_fts MATCH ?{where}"
+        conn = self._conn()
+        rows = conn.execute(
+            f"SELECT {', '.join('texts.' + c.strip() for c in _COLUMNS.split(','))},"
+            f" snippet(texts_fts, 1, '**', '**', '…', 12) AS snippet"
+            f" {base} ORDER BY bm25(texts_fts) LIMIT ? OFFSET ?",
+            [match] + params + [page_size, page * page_size]
+        ).fetchall()
+        total = conn.execute(f"SELECT COUNT(*) {base}", [match] + params).fetchone()[0]
+        return [dict(row) for row in rows], total
+
+    def ensure_materials(self, materials):
+        """Inserisce i materiali predefiniti se la libreria è ancora vuota.
+
+        Più processi possono arrivarci insieme: l'indice unico sul titolo fa
+        ignorare i materiali già inseriti da un altro.
+        """
+        if self.count_texts(kinds=("materiale",)):
+            return
+        now = time.time()
+        rows = [("materiale", title, material["content"], len(material["content"].split()), now)
+                for title, material in materials.items()]
+        self.transaction(lambda conn: conn.executemany(
+            "INSERT OR IGNORE INTO texts (user, kind, title, content, word_count, created_at)"
+            " VALUES ('', ?, ?, ?, ?, ?)", rows
+        )).result()
+
+
+def store_audio(data):
+    """Salva un MP3 per contenuto e restituisce il riferimento da mettere nel database"""
+    ref = hashlib.sha256(data).hexdigest()
+    path = os.path.join(AUDIO_DIR, ref + ".mp3")
+    if not os.path.exists(path):
+        os.makedirs(AUDIO_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=AUDIO_DIR, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return ref
+
+
+def audio_path(ref):
+    """Percorso del file MP3 di un riferimento (il file può non esistere più)"""
+    if not ref:
+        return None
+    return os.path.join(AUDIO_DIR, ref + ".mp3")
+
+
+def load_audio(ref):
+    """Byte MP3 di un riferimento, o None se il file non esiste più"""
+    try:
+        with open(audio_path(ref), "rb") as f:
+            return f.read()
+    except (OSError, TypeError):
+        return None
+
+
+def get_storage(path=DB_PATH):
+    """Archivio condiviso dal processo per questo file di database"""
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = Storage(path)
+        return _stores[path]
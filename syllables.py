@@ -0,0 +1,177 @@
+"""Sillabazione italiana e resa HTML della pagina di lettura con le sillabe colorate
+
+Le parole sono divise in sillabe con l'algoritmo di Liang (lo stesso della
+sillabazione di TeX) e con gli schemi di `data/sillabe_it.txt`, compilati
+una sola volta in un dizionario. Le sillabe si alternano tra il colore del
+testo e il colore delle sillabe.
+
+La pagina è resa su due livelli: l'HTML di ogni paragrafo (sillabe e parole
+difficili evidenziate) è memorizzato per hash del paragrafo e opzioni che
+cambiano il markup, mentre dimensione del carattere, interlinea e colori
+stanno solo nello stile del contenitore. Spostando un cursore si rifà solo
+il contenitore, non il testo.
+"""
+import hashlib
+import html
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+PATTERNS_PATH = os.environ.get(
+    "DSA_SYLLABLE_PATTERNS",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sillabe_it.txt")
+)
+# Paragrafi resi tenuti in memoria
+MAX_CACHED_FRAGMENTS = 4096
+# Colore delle sillabe alterne, normale e ad alto contrasto
+SYLLABLE_COLOR = "#1E63B5"
+CONTRAST_SYLLABLE_COLOR = "#FFD600"
+
+_WORD_RE = re.compile(r"[^\W\d_]+")
+_DIGITS_RE = re.compile(r"\d")
+
+_hyphenator = None
+_hyphenator_lock = threading.Lock()
+_fragments = OrderedDict()
+_fragments_lock = threading.Lock()
+
+# Impostazioni di lettura scelte nella barra laterale
+ReadingStyle = namedtuple("ReadingStyle", "font_size line_spacing dyslexia contrast syllables",
+                          defaults=(18, 1.8, False, False, False))
+
+
+def load_patterns(path=PATTERNS_PATH):
+    """Legge gli schemi: più schemi per riga separati da spazi, `#` per i commenti"""
+    with open(path, encoding="utf-8") as f:
+        return [
+            pattern for line in f if not line.lstrip().startswith("#") for pattern in line.split()
+        ]
+
+
+class Hyphenator:
+    """Divide le parole in sillabe con gli schemi di Liang, senza distinguere maiuscole"""
+
+    def __init__(self, patterns):
+        self.patterns = {}
+        for pattern in patterns:
+            letters = _DIGITS_RE.sub("", pattern)
+            values = [0] * (len(letters) + 1)
+            position = 0
+            for char in pattern:
+                if char.isdigit():
+                    values[position] = int(char)
+                else:
+                    position += 1
+            self.patterns[letters] = tuple(values)
+        self.max_length = max(map(len, self.patterns), default=0)
+        self.syllables = lru_cache(maxsize=65536)(self._syllables)
+
+    def breaks(self, word):
+        """Posizioni (da 1) in cui la parola si può dividere"""
+        work = "." + word.lower() + "."
+        if len(work) != len(word) + 2:
+            return []
+        values = [0] * (len(work) + 1)
+        patterns = self.patterns
+        for start in range(len(work)):
+            for end in range(start + 1, min(len(work), start + self.max_length) + 1):
+                pattern = patterns.get(work[start:end])
+                if pattern is not None:
+                    for offset, value in enumerate(pattern):
+                        if value > values[start + offset]:
+                            values[start + offset] = value
+        # values[i] vale per il punto prima di work[i], cioè prima di word[i - 1]
+        return [i for i in range(1, len(word)) if values[i + 1] % 2]
+
+    def _syllables(self, word):
+        """Sillabe della parola, nello stesso ordine e con le stesse maiuscole"""
+        bounds = [0] + self.breaks(word) + [len(word)]
+        return tuple(word[start:end] for start, end in zip(bounds, bounds[1:]))
+
+
+def get_hyphenator():
+    """Sillabatore condiviso, compilato al primo utilizzo"""
+    global _hyphenator
+    with _hyphenator_lock:
+        if _hyphenator is None:
+            _hyphenator = Hyphenator(load_patterns())
+        return _hyphenator
+
+
+def syllabify(word):
+    """Sillabe di una parola italiana: "fotosintesi" -> ("fo", "to", "sin", "te", "si")"""
+    return get_hyphenator().syllables(word)
+
+
+# --- Resa HTML ---
+
+def _syllable_html(text):
+    """Testo escapato con una sillaba su due in `<span class="sillaba">` (da capo a ogni parola)"""
+    syllables = get_hyphenator().syllables
+    parts = []
+    position = 0
+    for match in _WORD_RE.finditer(text):
+        parts.append(html.escape(text[position:match.start()]))
+        for i, syllable in enumerate(syllables(match.group())):
+            # Le parole sono fatte solo di lettere: niente da escapare
+            parts.append(f'<span class="sillaba">{syllable}</span>' if i % 2 else syllable)
+        position = match.end()
+    parts.append(html.escape(text[position:]))
+    return "".join(parts)
+
+
+def _render_paragraph(text, syllables, highlight):
+    from highlight import get_highlighter
+
+    render = _syllable_html if syllables else html.escape
+    if not highlight:
+        return render(text)
+    highlighter = get_highlighter()
+    parts = []
+    position = 0
+    for start, end in highlighter.matches(text):
+        parts.append(render(text[position:start]))
+        parts.append(f'<span class="{highlighter.css_class}">{render(text[start:end])}</span>')
+        position = end
+    parts.append(render(text[position:]))
+    return "".join(parts)
+
+
+def paragraph_html(text, syllables=False, highlight=False):
+    """HTML di un paragrafo (senza a capo), riusato per lo stesso testo e le stesse opzioni"""
+    if not text or not (syllables or highlight):
+        return html.escape(text)
+    key = (hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest(), syllables, highlight)
+    with _fragments_lock:
+        fragment = _fragments.get(key)
+        if fragment is not None:
+            _fragments.move_to_end(key)
+            return fragment
+
+    fragment = _render_paragraph(text, syllables, highlight)
+    with _fragments_lock:
+        _fragments[key] = fragment
+        while len(_fragments) > MAX_CACHED_FRAGMENTS:
+            _fragments.popitem(last=False)
+    return fragment
+
+
+@lru_cache(maxsize=256)
+def style_layer(style):
+    """Classi e stile del contenitore della pagina: l'unica parte che dipende dai cursori"""
+    classes = "reader-page dyslexia-friendly" if style.dyslexia else "reader-page"
+    css = f"font-size:{style.font_size}px;line-height:{style.line_spacing:g};"
+    if style.contrast:
+        css += f"background:black;color:white;padding:1rem;--colore-sillaba:{CONTRAST_SYLLABLE_COLOR};"
+    else:
+        css += f"--colore-sillaba:{SYLLABLE_COLOR};"
+    return classes, css
+
+
+def render_page(text, style=ReadingStyle(), highlight=False):
+    """HTML della pagina: paragrafi dalla cache dentro un unico contenitore con lo stile di lettura"""
+    body = "<br>".join(paragraph_html(line, style.syllables, highlight) for line in text.split("\n"))
+    classes, css = style_layer(style)
+    return f'<div class="{classes}" style="{css}">{body}</div>'
@@ -1,22 +1,34 @@
 import streamlit as st
-import openai
 import os
-from PIL import Image
-import pytesseract
-import pdf2image
-import fitz  # PyMuPDF
-import speech_recognition as sr
-from gtts import gTTS
 import io
-import base64
-import tempfile
-import nltk
-from nltk.tokenize import sent_tokenize
-import plotly.graph_objects as go
-import plotly.express as px
-import pandas as pd
+import hashlib
+import time
+import uuid
 from datetime import datetime
-import json
+
+# Moduli leggeri: le librerie pesanti (PyMuPDF, tesseract, gTTS, openai,
+# nltk, pandas, plotly) vengono caricate solo quando una funzione le usa
+from llm import get_client
+from tts import get_backend
+from jobs import (get_queue, TooManyJobs, DONE, FAILED, CANCELLED, FinishedJob, pdf_job, image_ocr_job,
+                  simplify_job, mind_map_job, suggestions_job, tts_job, transcription_job, export_job,
+                  render_job)
+import artifacts
+from transcribe import AUDIO_EXTENSIONS, get_recognizer
+from syllables import ReadingStyle, get_hyphenator, render_page
+from document import get_document, get_tokenizer
+from reader import open_pages, save_text
+from related import related_texts
+from mindmap import document_key, load_tree, mind_map_figure
+from export import MIME_TYPES
+from readability import analyze, gulpease_label, difficulty_heatmap
+from storage import get_storage, store_audio, load_audio
+from analytics import READ, SIMPLIFY, LISTEN, SAVE, ALL_USERS, WORDS_PER_MINUTE, get_event_log
+import metrics
+
+rerun_started = time.perf_counter()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # Configurazione pagina
 st.set_page_config(
@@ -33,62 +45,168 @@ if 'saved_texts' not in st.session_state:
     st.session_state.saved_texts = []
 if 'reading_time' not in st.session_state:
     st.session_state.reading_time = 0
-if 'simplified_texts' not in st.session_state:
-    st.session_state.simplified_texts = {}
+if 'read_texts' not in st.session_state:
+    st.session_state.read_texts = set()
+# Lavori in background della sessione: posizione nella pagina -> id del lavoro. Il limite
+# di lavori attivi vale per sessione (id casuale), non per il nome digitato nella barra laterale
+if 'jobs' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+    st.session_state.jobs = {}
+    st.session_state.job_sources = {}
+    st.session_state.handled_jobs = set()
+# Risultati grandi della sessione (audio, testi estratti e semplificati): in memoria
+# fino a un tetto, poi su disco; i lavori conclusi escono dalla coda condivisa
+if 'artifacts' not in st.session_state:
+    st.session_state.artifacts = artifacts.ArtifactStore()
+    st.session_state.finished = {}
+# Tempi delle fasi misurati per questa sessione (anche nei lavori in background)
+if 'metrics' not in st.session_state:
+    st.session_state.metrics = metrics.Registry()
+metrics.set_session(st.session_state.metrics)
 
-# CSS personalizzato
-st.markdown("""
-<style>
-    .main-header {
-        font-size: 2.5rem;
-        color: #4A6FA5;
-        text-align: center;
-        margin-bottom: 2rem;
-        font-weight: bold;
-    }
-    .feature-card {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        padding: 1.5rem;
-        border-radius: 15px;
-        color: white;
-        margin: 1rem 0;
-        transition: transform 0.3s;
-    }
-    .feature-card:hover {
-        transform: translateY(-5px);
-    }
-    .stButton>button {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        border: none;
-        padding: 0.5rem 2rem;
-        border-radius: 25px;
-        font-weight: bold;
-    }
-    .highlight-text {
-        background-color: #FFF9C4;
-        padding: 0.2rem 0.5rem;
-        border-radius: 3px;
-        font-weight: bold;
-    }
-    .dyslexia-friendly {
-        font-family: 'OpenDyslexic', 'Comic Sans MS', sans-serif;
-        line-height: 1.8;
-        letter-spacing: 0.05em;
+# Risorse condivise tra sessioni, create una sola volta per processo
+@st.cache_resource
+def load_css():
+    """Foglio di stile dell'app, letto una sola volta"""
+    with open(os.path.join(BASE_DIR, "varie.css"), encoding="utf-8") as f:
+        return f"<style>\n{f.read()}\n</style>"
+
+@st.cache_resource
+def get_tts_backend():
+    """Motore di sintesi vocale condiviso"""
+    return get_backend()
+
+@st.cache_resource
+def get_stt_recognizer():
+    """Motore di riconoscimento vocale condiviso (il modello viene caricato una volta)"""
+    return get_recognizer()
+
+@st.cache_resource
+def load_sentence_tokenizer():
+    """Tokenizzatore delle frasi (punkt), caricato una volta all'avvio e non alla prima frase"""
+    return get_tokenizer()
+
+@st.cache_resource
+def load_hyphenator():
+    """Schemi di sillabazione, compilati una volta all'avvio"""
+    return get_hyphenator()
+
+@st.cache_data
+def default_materials():
+    """Materiali pre-caricati della libreria"""
+    return {
+        "Come Studiare con DSA": {
+            "content": """1. Usa mappe mentali
+2. Suddividi in sessioni brevi
+3. Usa supporti visivi
+4. Ripeti ad alta voce""",
+            "type": "suggerimenti"
+        },
+        "Strumenti Compensativi": {
+            "content": """• Sintesi vocale
+• Mappe concettuali
+• Calcolatrice parlante
+• Tavola pitagorica""",
+            "type": "lista"
+        }
     }
-</style>
-""", unsafe_allow_html=True)
+
+@st.cache_resource
+def get_store():
+    """Archivio SQLite condiviso, con i materiali predefiniti"""
+    store = get_storage()
+    store.ensure_materials(default_materials())
+    return store
+
+@st.cache_resource
+def get_llm_client():
+    """Client del modello condiviso dalle sessioni: connessioni, limiti e richieste in comune"""
+    return get_client()
+
+@st.cache_resource
+def get_jobs():
+    """Coda dei lavori in background condivisa dalle sessioni"""
+    return get_queue()
+
+@st.cache_resource
+def get_events():
+    """Registro delle attività, nello stesso database dell'archivio"""
+    get_store()
+    return get_event_log()
+
+@st.cache_resource(max_entries=32)
+def load_progress_charts(user, version, day):
+    """Grafici della sezione Progressi, ricostruiti solo dopo nuove attività"""
+    import analytics
+    df = analytics.progress_dataframe(get_events().daily(user))
+    return analytics.progress_charts(df)
+
+@st.cache_resource(max_entries=32)
+def load_mind_map_chart(doc_key, kind):
+    """Grafico della mappa di un documento, costruito una volta per hash e tipo"""
+    saved = load_tree(doc_key)
+    return mind_map_figure(saved["tree"], kind) if saved else None
+
+def show_performance():
+    """Percentili dei tempi per fase, per questa sessione e per l'intero processo"""
+    def ms(value):
+        return f"{value * 1000:.0f}" if value is not None else "–"
+
+    session = st.session_state.metrics.summary()
+    process = metrics.REGISTRY.summary()
+    rows = []
+    for stage in sorted(set(session) | set(process)):
+        mine, everyone = session.get(stage, {}), process.get(stage, {})
+        rows.append({
+            "Fase": stage,
+            "Sessione p50 (ms)": ms(mine.get("p50")),
+            "Sessione p95 (ms)": ms(mine.get("p95")),
+            "Processo p50 (ms)": ms(everyone.get("p50")),
+            "Processo p95 (ms)": ms(everyone.get("p95")),
+            "Misure": everyone.get("count", 0),
+        })
+    if rows:
+        st.dataframe(rows, hide_index=True)
+    else:
+        st.caption("Nessuna misura ancora")
+    caches = metrics.cache_stats()
+    if caches:
+        st.caption(" · ".join(f"Cache {c['name']}: {c['hit_rate']:.0%}" for c in caches))
+    mine, everyone = st.session_state.artifacts.footprint(), artifacts.usage()
+    st.caption(
+        f"Risultati di questa sessione: {mine['items']} · {mine['memory'] / 2**20:.1f} MB in memoria, "
+        f"{mine['disk'] / 2**20:.1f} MB su disco · tutte le sessioni ({everyone['sessions']}): "
+        f"{everyone['memory'] / 2**20:.1f} MB in memoria, {everyone['disk'] / 2**20:.1f} MB su disco"
+    )
+    col_json, col_prom = st.columns(2)
+    with col_json:
+        st.download_button("JSON", metrics.to_json(), file_name="prestazioni.json",
+                           mime="application/json")
+    with col_prom:
+        st.download_button("Prometheus", metrics.to_prometheus(), file_name="prestazioni.prom",
+                           mime="text/plain")
+
+# Elementi per pagina nelle liste dell'archivio
+PAGE_SIZE = 5
+
+# CSS personalizzato
+st.markdown(load_css(), unsafe_allow_html=True)
+load_sentence_tokenizer()
+load_hyphenator()
 
 # Barra laterale
 with st.sidebar:
     st.image("https://img.icons8.com/color/96/000000/brain.png", width=100)
     st.title("⚙️ Configurazione")
     
+    st.subheader("👤 Profilo")
+    user_name = st.text_input("Nome studente", value="studente").strip() or "studente"
+    
     st.subheader("🔑 API Keys")
     openai_api_key = st.text_input("OpenAI API Key", type="password")
     
+    # La chiave resta nella sessione e viene passata a ogni richiesta
     if openai_api_key:
-        openai.api_key = openai_api_key
         st.success("✅ API Key configurata")
     
     st.divider()
@@ -98,105 +216,198 @@ with st.sidebar:
     font_size = st.slider("Dimensione Font", 14, 24, 18)
     line_spacing = st.slider("Spaziatura Linee", 1.0, 2.5, 1.8)
     high_contrast = st.checkbox("Alto Contrasto")
+    syllable_colors = st.checkbox("Colora le Sillabe")
+    reading_style = ReadingStyle(font_size, line_spacing, dyslexia_mode, high_contrast, syllable_colors)
     
     st.divider()
     
     st.subheader("📊 Statistiche")
-    st.metric("Testi Salvati", len(st.session_state.saved_texts))
+    st.metric("Testi Salvati", get_store().count_texts(user_name, kinds=("testo", "suggerimenti")))
     st.metric("Minuti Letti", st.session_state.reading_time)
+    cache_stats = get_llm_client().cache.stats()
+    st.caption(
+        f"Cache AI: {cache_stats['memory_hits'] + cache_stats['disk_hits']} risposte riutilizzate, "
+        f"{cache_stats['misses']} nuove richieste"
+    )
     
     if st.button("🗑️ Reset Statistiche"):
         st.session_state.saved_texts = []
         st.session_state.reading_time = 0
         st.rerun()
+    
+    if st.checkbox("⏱️ Prestazioni"):
+        show_performance()
 
 # Funzioni principali
-def text_to_speech(text, language='it'):
-    """Converte testo in audio"""
-    tts = gTTS(text=text, lang=language, slow=False)
-    fp = io.BytesIO()
-    tts.write_to_fp(fp)
-    fp.seek(0)
-    return fp
-
-def simplify_text(text):
-    """Semplifica il testo usando OpenAI"""
-    prompt = f"""
-    Semplifica questo testo per uno studente con dislessia:
-    1. Usa frasi brevi
-    2. Evita parole complesse
-    3. Aggiungi esempi concreti
-    4. Suddividi in paragrafi brevi
-    
-    Testo originale:
-    {text}
-    
-    Testo semplificato:
-    """
-    
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Sei un tutor specializzato nell'aiutare studenti con DSA."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1500,
-            temperature=0.7
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Errore nella semplificazione: {str(e)}"
+def show_timing(stream):
+    """Mostra il tempo alla prima risposta e il tempo totale di una chiamata AI"""
+    if stream.cached:
+        st.caption("⚡ Risposta già pronta (dalla cache)")
+    elif stream.shared:
+        st.caption("⚡ Risposta condivisa con una richiesta identica già in corso")
+    elif stream.ttft is not None:
+        st.caption(f"⏱️ Prima risposta in {stream.ttft:.1f} s · completata in {stream.latency:.1f} s")
 
-def extract_text_from_pdf(pdf_file):
-    """Estrae testo da PDF"""
+def start_job(slot, kind, fn, *args, **kwargs):
+    """Avvia un lavoro in background e ne ricorda l'id nella sessione"""
+    previous = slot_job(slot)
+    if previous is not None and previous.active:
+        previous.cancel()
     try:
-        # Metodo 1: PyMuPDF
-        doc = fitz.open(stream=pdf_file.read(), filetype="pdf")
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        return text
-    except:
-        try:
-            # Metodo 2: pdf2image + OCR
-            images = pdf2image.convert_from_bytes(pdf_file.read())
-            text = ""
-            for image in images:
-                text += pytesseract.image_to_string(image, lang='ita')
-            return text
-        except Exception as e:
-            return f"Errore nell'estrazione testo: {str(e)}"
-
-def create_mind_map(text):
-    """Crea una mappa concettuale dal testo"""
-    prompt = f"""
-    Crea una mappa concettuale gerarchica da questo testo.
-    Formatta in questo modo:
-    
-    CONCETTO PRINCIPALE
-    ├── Idea 1
-    │   ├── Sottoidea A
-    │   └── Sottoidea B
-    ├── Idea 2
-    └── Idea 3
-    
-    Testo:
-    {text[:1000]}
+        job = get_jobs().submit(st.session_state.session_id, kind, fn, *args, **kwargs)
+    except TooManyJobs as e:
+        st.warning(str(e))
+        return None
+    st.session_state.jobs[slot] = job.id
+    return job
+
+def start_job_for(slot, source, kind, fn, *args, **kwargs):
+    """Avvia il lavoro solo se il contenuto in ingresso è cambiato"""
+    digest = hashlib.blake2b(source, digest_size=16).digest()
+    if st.session_state.job_sources.get(slot) != digest:
+        if start_job(slot, kind, fn, *args, **kwargs):
+            st.session_state.job_sources[slot] = digest
+
+def slot_job(slot):
+    """Lavoro della posizione: ancora in coda oppure concluso, con il risultato nell'archivio della sessione"""
+    job_id = st.session_state.jobs.get(slot)
+    if not job_id:
+        return None
+    job = get_jobs().get(job_id)
+    if job is not None and job.status == DONE and isinstance(job.result, (str, bytes)):
+        st.session_state.artifacts.put(slot, job.result)
+        st.session_state.finished[slot] = FinishedJob(job, st.session_state.artifacts, slot)
+        get_jobs().release(job_id)
+        job = None
+    if job is None:
+        finished = st.session_state.finished.get(slot)
+        if finished is None or finished.id != job_id:
+            return None
+        if not finished.available:
+            # Risultato eliminato per fare spazio: con lo stesso file il lavoro si rifà
+            del st.session_state.finished[slot]
+            st.session_state.job_sources.pop(slot, None)
+            return None
+        return finished
+    return job
+
+def first_time(job):
+    """Vero solo al primo aggiornamento dopo la fine del lavoro"""
+    if job.id in st.session_state.handled_jobs:
+        return False
+    st.session_state.handled_jobs.add(job.id)
+    return True
+
+@st.fragment(run_every=1)
+def job_progress(slot, preview=None):
+    """Avanzamento di un lavoro, aggiornato ogni secondo senza rieseguire la pagina"""
+    job = slot_job(slot)
+    if job is None or not job.active:
+        st.rerun()
+    label = f"{job.kind.capitalize()}: {job.done} di {job.total}" if job.total else f"{job.kind.capitalize()} in corso..."
+    st.progress(job.fraction, text=label)
+    parts = job.partial()
+    if preview == "text" and parts:
+        st.markdown("".join(parts))
+    elif preview == "page" and parts:
+        st.caption(parts[-1].strip()[:200] + "...")
+    elif preview == "audio" and parts:
+        st.audio(parts[0], format='audio/mp3', autoplay=True)
+    if st.button("⏹️ Annulla", key=f"cancel_{slot}"):
+        job.cancel()
+
+def show_job(slot, preview=None):
+    """Mostra lo stato del lavoro e lo restituisce quando è concluso con successo"""
+    job = slot_job(slot)
+    if job is None:
+        return None
+    if job.active:
+        job_progress(slot, preview)
+    elif job.status == FAILED:
+        st.error(f"Errore: {job.error}")
+    elif job.status == CANCELLED:
+        st.info("Operazione annullata")
+    else:
+        return job
+    return None
+
+def start_transcription(slot, data):
+    """Avvia la trascrizione; se il motore configurato non è pronto lo segnala e usa quello di riserva"""
+    recognizer = get_stt_recognizer()
+    if recognizer.notice:
+        st.warning(recognizer.notice)
+    start_job_for(slot, data, "trascrizione", transcription_job, data, recognizer)
+
+def start_audio(slot, text, language='it', speed=1.0):
+    """Avvia la sintesi vocale in background"""
+    return start_job(slot, "sintesi vocale", tts_job, text, language, speed, get_tts_backend())
+
+def read_file(path):
+    """Contenuto di un file generato, letto solo quando l'utente lo scarica"""
+    with open(path, "rb") as f:
+        return f.read()
+
+def current_page(key):
+    """Indice (da 0) della pagina scelta in una lista paginata"""
+    return st.session_state.get(key, 1) - 1
+
+def page_selector(key, total, page_size=PAGE_SIZE):
+    """Selettore di pagina da mostrare sotto una lista paginata"""
+    pages = max(1, -(-total // page_size))
+    if st.session_state.get(key, 1) > pages:
+        st.session_state[key] = pages
+    if pages > 1:
+        st.number_input(f"Pagina (di {pages})", min_value=1, max_value=pages, key=key)
+
+def turn_page(key, step, pages):
+    """Pagina precedente o successiva del lettore"""
+    st.session_state[key] = min(pages, max(1, st.session_state.get(key, 1) + step))
+
+@st.fragment
+def show_reader(doc_key, name, highlight=False, style=ReadingStyle()):
+    """Lettore a pagine: al browser arriva solo la pagina visibile, lo stile si applica solo a lei.
+
+    `name` distingue i lettori della pagina ("pdf", "trascrizione", "anteprima"), che
+    possono mostrare lo stesso testo e quindi lo stesso `doc_key`.
     """
-    
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Crea mappe concettuali chiare e strutturate."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1000
-        )
-        return response.choices[0].message.content
-    except:
-        return "Non posso creare la mappa concettuale senza API Key."
+    doc = open_pages(doc_key)
+    if doc is None:
+        st.warning("Il testo non è più disponibile: caricalo di nuovo")
+        return
+    key = f"reader_{name}_{doc_key}"
+    pages = doc.n_pages
+    if pages > 1:
+        col_prev, col_page, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            st.button("◀️", key=f"{key}_prev", on_click=turn_page, args=(key, -1, pages),
+                      disabled=st.session_state.get(key, 1) <= 1, use_container_width=True)
+        with col_next:
+            st.button("▶️", key=f"{key}_next", on_click=turn_page, args=(key, 1, pages),
+                      disabled=st.session_state.get(key, 1) >= pages, use_container_width=True)
+        with col_page:
+            st.number_input(f"Pagina (di {pages})", min_value=1, max_value=pages, key=key,
+                            label_visibility="collapsed")
+        st.caption(f"Pagina {st.session_state[key]} di {pages}")
+    text = doc.page(st.session_state.get(key, 1) - 1)
+    st.markdown(render_page(text, style, highlight), unsafe_allow_html=True)
+
+def record_event(kind, text, minutes=0.0):
+    """Registra un'attività dello studente (lettura, ascolto, semplificazione, salvataggio)"""
+    get_events().record(user_name, kind, words=len(text.split()), minutes=minutes)
+
+def show_related(text):
+    """Materiali della libreria e testi salvati più simili al testo corrente"""
+    rows = related_texts(text, user_name, get_store())
+    if not rows:
+        st.caption("Nessun materiale simile in archivio")
+    for row in rows:
+        title = row["title"] or row["content"][:60]
+        st.markdown(f"**{title}** · {row['kind']} · somiglianza {row['score']:.0%}")
+        st.caption(row["content"][:200] + ("..." if len(row["content"]) > 200 else ""))
+
+def save_audio_ref(text_id, audio):
+    """Salva l'audio generato e lo collega al testo in archivio"""
+    get_store().set_audio_ref(text_id, store_audio(audio))
 
 # Interfaccia principale
 st.markdown('<h1 class="main-header">🧠 AI-DSA Assistant</h1>', unsafe_allow_html=True)
@@ -236,90 +447,127 @@ with tab1:
         elif input_method == "📄 Carica PDF":
             pdf_file = st.file_uploader("Carica un PDF", type=['pdf'])
             if pdf_file:
-                with st.spinner("Estrazione testo dal PDF..."):
-                    text_input = extract_text_from_pdf(pdf_file)
-                st.text_area("Testo estratto:", text_input, height=200)
+                # L'estrazione (con OCR delle pagine scansionate) avviene in background
+                data = pdf_file.getvalue()
+                start_job_for("pdf", data, "estrazione pagine", pdf_job, data)
+                job = show_job("pdf", preview="page")
+                if job:
+                    # Il testo resta sul server: nel browser solo la pagina che si sta leggendo
+                    text_input = job.result
+                    st.markdown("**Testo estratto:**")
+                    show_reader(job.meta["pages"], "pdf", style=reading_style)
         
         elif input_method == "📸 Carica Immagine":
             image_file = st.file_uploader("Carica un'immagine", type=['png', 'jpg', 'jpeg'])
             if image_file:
+                from PIL import Image
                 image = Image.open(image_file)
                 st.image(image, width=300)
-                with st.spinner("Riconoscimento testo..."):
-                    text_input = pytesseract.image_to_string(image, lang='ita')
-                st.text_area("Testo riconosciuto:", text_input, height=200)
+                data = image_file.getvalue()
+                start_job_for("ocr", data, "riconoscimento testo", image_ocr_job, data)
+                job = show_job("ocr")
+                if job:
+                    text_input = job.result
+                    st.text_area("Testo riconosciuto:", text_input, height=200)
         
         elif input_method == "🎤 Registra Audio":
-            st.info("Premi il pulsante e parla per 10 secondi")
-            if st.button("🎙️ Inizia Registrazione"):
-                recognizer = sr.Recognizer()
-                with sr.Microphone() as source:
-                    audio = recognizer.listen(source, timeout=10)
-                    try:
-                        text_input = recognizer.recognize_google(audio, language="it-IT")
-                        st.text_area("Testo trascritto:", text_input, height=200)
-                    except sr.UnknownValueError:
-                        st.error("Non ho capito l'audio")
-                    except sr.RequestError:
-                        st.error("Errore nel servizio di riconoscimento")
+            # La registrazione avviene nel browser: il microfono del server non serve
+            recording = st.audio_input("Registra dal microfono")
+            audio_file = st.file_uploader("Oppure carica una registrazione (anche una lezione intera)",
+                                          type=AUDIO_EXTENSIONS)
+            source = recording or audio_file
+            if source:
+                data = source.getvalue()
+                start_transcription("stt", data)
+                job = show_job("stt", preview="text")
+                if job:
+                    text_input = job.result
+                    if not text_input:
+                        st.warning("Nessun parlato riconosciuto nella registrazione")
+                    st.markdown("**Testo trascritto:**")
+                    show_reader(job.meta["pages"], "trascrizione", style=reading_style)
     
     with col2:
         st.subheader("🎯 Strumenti di Supporto")
         
         if text_input:
-            # Calcola metriche
-            sentences = sent_tokenize(text_input, language='italian')
-            words = text_input.split()
+            # Calcola metriche (solo i paragrafi modificati vengono rianalizzati)
+            doc = get_document(text_input)
+            report = analyze(doc)
+            n_words = doc.n_words
+            
+            # Ogni testo conta come letto una sola volta per sessione
+            text_hash = hashlib.blake2b(text_input.encode("utf-8"), digest_size=16).digest()
+            if text_hash not in st.session_state.read_texts:
+                st.session_state.read_texts.add(text_hash)
+                record_event(READ, text_input, minutes=n_words / WORDS_PER_MINUTE)
             
-            col_metric1, col_metric2 = st.columns(2)
+            col_metric1, col_metric2, col_metric3 = st.columns(3)
             with col_metric1:
-                st.metric("Parole", len(words))
+                st.metric("Parole", n_words)
             with col_metric2:
-                st.metric("Frasi", len(sentences))
+                st.metric("Frasi", report.n_sentences)
+            with col_metric3:
+                st.metric("Gulpease", f"{report.gulpease:.0f}", help=gulpease_label(report.gulpease))
+            st.caption(
+                f"{gulpease_label(report.gulpease)} · {report.avg_sentence_length:.1f} parole per frase · "
+                f"{report.avg_syllables_per_word:.2f} sillabe per parola"
+            )
+            
+            difficult = report.difficult_mask()
+            with st.expander("🌡️ Difficoltà per frase"):
+                st.plotly_chart(difficulty_heatmap(report), use_container_width=True)
+            with st.expander("🔗 Materiali correlati"):
+                show_related(text_input)
+            only_difficult = st.checkbox(
+                f"Semplifica solo le frasi difficili ({int(difficult.sum())} di {report.n_sentences})",
+                disabled=not difficult.any()
+            )
             
             # Strumenti
             if st.button("🔧 Semplifica Testo", use_container_width=True):
-                with st.spinner("Semplificazione in corso..."):
-                    simplified = simplify_text(text_input)
-                    st.session_state.simplified_texts['ultimo'] = simplified
-                    st.text_area("Testo Semplificato:", simplified, height=300)
+                if only_difficult:
+                    start_job("simplify", "semplificazione", simplify_job, text_input,
+                              report.sentences, difficult, report.paragraph_starts, api_key=openai_api_key)
+                else:
+                    start_job("simplify", "semplificazione", simplify_job, text_input, api_key=openai_api_key)
+            job = show_job("simplify", preview="text")
+            if job:
+                if first_time(job):
+                    record_event(SIMPLIFY, job.result)
+                st.text_area("Testo Semplificato:", job.result, height=300)
+                show_timing(job.meta["stream"])
             
             if st.button("🎧 Ascolta Testo", use_container_width=True):
-                audio_file = text_to_speech(text_input)
-                st.audio(audio_file, format='audio/mp3')
-                st.session_state.reading_time += len(words) / 150  # 150 parole/minuto
+                start_audio("listen", text_input)
+            job = show_job("listen", preview="audio")
+            if job:
+                if first_time(job):
+                    st.session_state.reading_time += n_words / WORDS_PER_MINUTE
+                    record_event(LISTEN, text_input, minutes=n_words / WORDS_PER_MINUTE)
+                st.audio(job.result, format='audio/mp3')
             
             if st.button("💾 Salva per dopo", use_container_width=True):
+                # I materiali correlati lo indicizzano in background al prossimo aggiornamento
+                get_store().save_text(
+                    user_name, "testo", text_input,
+                    title=text_input[:60],
+                    simplified=st.session_state.artifacts.get("simplify"),
+                    word_count=n_words
+                )
+                record_event(SAVE, text_input)
                 st.session_state.saved_texts.append({
                     'text': text_input[:100] + "...",
                     'timestamp': datetime.now().strftime("%d/%m/%Y %H:%M"),
-                    'word_count': len(words)
+                    'word_count': n_words
                 })
                 st.success("Testo salvato!")
             
-            # Modalità lettura facilitata
+            # Modalità lettura facilitata, sulla sola pagina visibile
             st.divider()
-            if dyslexia_mode:
-                st.markdown('<div class="dyslexia-friendly">', unsafe_allow_html=True)
-            
-            if high_contrast:
-                st.markdown('<div style="background:black;color:white;padding:1rem;">', unsafe_allow_html=True)
-            
             st.subheader("📖 Anteprima")
-            preview_text = st.session_state.simplified_texts.get('ultimo', text_input)
-            
-            # Evidenzia parole complesse
-            complex_words = ['tuttavia', 'pertanto', 'inoltre', 'dunque', 'comunque']
-            for word in complex_words:
-                if word in preview_text.lower():
-                    preview_text = preview_text.replace(word, f'<span class="highlight-text">{word}</span>')
-            
-            st.markdown(preview_text[:500] + "...", unsafe_allow_html=True)
-            
-            if high_contrast:
-                st.markdown('</div>', unsafe_allow_html=True)
-            if dyslexia_mode:
-                st.markdown('</div>', unsafe_allow_html=True)
+            preview_text = st.session_state.artifacts.get("simplify", text_input)
+            show_reader(save_text(preview_text), "anteprima", highlight=True, style=reading_style)
 
 # TAB 2: Sintesi Vocale
 with tab2:
@@ -343,9 +591,16 @@ with tab2:
                 speed = st.slider("Velocità", 0.5, 1.5, 1.0)
             
             if st.button("🎵 Genera Audio", use_container_width=True):
-                with st.spinner("Generazione audio in corso..."):
-                    audio = text_to_speech(tts_text, language)
-                    
+                start_audio("tts", tts_text, language, speed)
+            job = show_job("tts", preview="audio")
+            if job:
+                audio = job.result
+                if first_time(job):
+                    record_event(LISTEN, tts_text, minutes=len(tts_text.split()) / WORDS_PER_MINUTE / speed)
+                    get_store().save_text(
+                        user_name, "audio", tts_text, title=tts_text[:60],
+                        audio_ref=store_audio(audio)
+                    )
                 st.audio(audio, format='audio/mp3')
                 
                 # Download button
@@ -360,16 +615,40 @@ with tab2:
         st.markdown("### 🎙️ Registrazione Vocale")
         st.info("Registra appunti vocali da convertire in testo")
         
-        if st.button("🎤 Inizia Nuova Registrazione", use_container_width=True):
-            st.warning("Funzionalità da implementare con connessione microfono")
+        note = st.audio_input("Registra un appunto")
+        if note:
+            data = note.getvalue()
+            start_transcription("note", data)
+            job = show_job("note", preview="text")
+            if job:
+                if first_time(job) and job.result:
+                    get_store().save_text(user_name, "testo", job.result, title="🎙️ " + job.result[:60])
+                st.text_area("Appunto trascritto:", job.result, height=150)
             
         st.divider()
         
         st.markdown("### 📋 Cronologia Audio")
-        if st.session_state.saved_texts:
-            for i, item in enumerate(st.session_state.saved_texts[-5:]):
-                st.caption(f"{item['timestamp']} - {item['word_count']} parole")
-                st.text(item['text'][:100] + "...")
+        history, total = get_store().list_texts(
+            user_name, kinds=("audio", "testo"), page=current_page("history_page"), page_size=PAGE_SIZE
+        )
+        for item in history:
+            timestamp = datetime.fromtimestamp(item['created_at']).strftime("%d/%m/%Y %H:%M")
+            st.caption(f"{timestamp} - {item['word_count']} parole")
+            st.text(item['content'][:100] + "...")
+            audio_data = load_audio(item['audio_ref'])
+            if audio_data:
+                st.audio(audio_data, format='audio/mp3')
+            else:
+                slot = f"audio_{item['id']}"
+                if st.button("🎧 Genera audio", key=f"history_audio_{item['id']}"):
+                    start_audio(slot, item['content'])
+                job = show_job(slot, preview="audio")
+                if job:
+                    if first_time(job):
+                        save_audio_ref(item['id'], job.result)
+                        record_event(LISTEN, item['content'], minutes=item['word_count'] / WORDS_PER_MINUTE)
+                    st.audio(job.result, format='audio/mp3')
+        page_selector("history_page", total)
 
 # TAB 3: Mappe Concettuali
 with tab3:
@@ -383,22 +662,44 @@ with tab3:
     
     if map_text and openai_api_key:
         if st.button("🌳 Genera Mappa Concettuale", use_container_width=True):
-            with st.spinner("Creazione mappa concettuale..."):
-                mind_map = create_mind_map(map_text)
-            
+            start_job("mind_map", "mappa concettuale", mind_map_job, map_text, api_key=openai_api_key)
+        
+        # Il testo della mappa si vede mentre arriva; a fine lavoro l'albero è in cache per documento
+        job = show_job("mind_map", preview="text")
+        if job and first_time(job):
+            load_mind_map_chart.clear()
+        doc_key = document_key(map_text)
+        saved = load_tree(doc_key)
+        if saved:
             st.markdown("### 🎯 Mappa Concettuale Generata")
+            kind = st.radio("Visualizzazione:", ["Treemap", "Sunburst"], horizontal=True)
+            st.plotly_chart(load_mind_map_chart(doc_key, kind.lower()), use_container_width=True)
+            with st.expander("Struttura della mappa"):
+                st.text(saved["structure"])
+            if job:
+                show_timing(job.meta["stream"])
             
-            # Visualizzazione come testo strutturato
-            st.text_area("Struttura della mappa:", mind_map, height=300)
-            
-            # Opzioni di esportazione
+            # Opzioni di esportazione: il disegno avviene in background ed è in cache per mappa
             col_exp1, col_exp2 = st.columns(2)
             with col_exp1:
                 if st.button("📥 Esporta come Immagine"):
-                    st.info("Funzionalità avanzata - richiede librerie aggiuntive")
+                    export = start_job("map_export", "disegno della mappa", render_job, saved["tree"], "png")
+                    if export:
+                        export.meta.update(doc_key=doc_key, format="png")
             with col_exp2:
                 if st.button("📄 Esporta come Documento"):
-                    st.info("Funzionalità avanzata - richiede librerie aggiuntive")
+                    export = start_job("map_export", "disegno della mappa", render_job, saved["tree"], "pdf")
+                    if export:
+                        export.meta.update(doc_key=doc_key, format="pdf")
+            export = show_job("map_export")
+            if export and export.meta.get("doc_key") == doc_key:
+                fmt = export.meta["format"]
+                st.download_button(
+                    label=f"💾 Scarica {fmt.upper()}",
+                    data=export.result,
+                    file_name=f"mappa_concettuale.{fmt}",
+                    mime=MIME_TYPES[fmt]
+                )
     
     elif not openai_api_key:
         st.warning("Inserisci la tua OpenAI API Key nella sidebar per usare questa funzione")
@@ -407,34 +708,41 @@ with tab3:
 with tab4:
     st.subheader("📚 Libreria Materiali")
     
-    # Esempi di materiali pre-caricati
-    materials = {
-        "Come Studiare con DSA": {
-            "content": """1. Usa mappe mentali
-2. Suddividi in sessioni brevi
-3. Usa supporti visivi
-4. Ripeti ad alta voce""",
-            "type": "suggerimenti"
-        },
-        "Strumenti Compensativi": {
-            "content": """• Sintesi vocale
-• Mappe concettuali
-• Calcolatrice parlante
-• Tavola pitagorica""",
-            "type": "lista"
-        }
-    }
-    
     col1, col2 = st.columns(2)
     
     with col1:
         st.markdown("### 📖 Materiali Disponibili")
-        for title, material in materials.items():
+        material_query = st.text_input("🔍 Cerca nei materiali:")
+        if material_query:
+            materials, total = get_store().search(
+                material_query, kinds=("materiale",), page=current_page("materials_page"), page_size=PAGE_SIZE
+            )
+            st.caption(f"{total} risultati")
+        else:
+            materials, total = get_store().list_texts(
+                kinds=("materiale",), page=current_page("materials_page"), page_size=PAGE_SIZE
+            )
+        for material in materials:
+            title = material["title"]
             with st.expander(f"📄 {title}"):
+                if material.get("snippet"):
+                    st.caption(material["snippet"])
                 st.write(material["content"])
-                if st.button(f"🎧 Ascolta {title}", key=f"audio_{title}"):
-                    audio = text_to_speech(material["content"])
-                    st.audio(audio, format='audio/mp3')
+                audio_data = load_audio(material["audio_ref"])
+                if audio_data:
+                    st.audio(audio_data, format='audio/mp3')
+                else:
+                    slot = f"audio_{material['id']}"
+                    if st.button(f"🎧 Ascolta {title}", key=f"audio_{material['id']}"):
+                        start_audio(slot, material["content"])
+                    job = show_job(slot, preview="audio")
+                    if job:
+                        if first_time(job):
+                            save_audio_ref(material["id"], job.result)
+                            record_event(LISTEN, material["content"],
+                                         minutes=material["word_count"] / WORDS_PER_MINUTE)
+                        st.audio(job.result, format='audio/mp3')
+        page_selector("materials_page", total)
     
     with col2:
         st.markdown("### ✍️ Crea Nuovo Materiale")
@@ -444,63 +752,47 @@ with tab4:
         
         if st.button("💾 Salva Materiale", use_container_width=True):
             if new_title and new_content:
-                materials[new_title] = {
-                    "content": new_content,
-                    "type": "custom",
-                    "timestamp": datetime.now().strftime("%d/%m/%Y %H:%M")
-                }
+                get_store().save_text(user_name, "materiale", new_content, title=new_title)
+                record_event(SAVE, new_content)
                 st.success(f"Materiale '{new_title}' salvato!")
 
 # TAB 5: Progressi
 with tab5:
     st.subheader("📊 Monitoraggio Progressi")
     
-    # Dati esempio
-    progress_data = {
-        "Data": ["01/01", "02/01", "03/01", "04/01", "05/01"],
-        "Testi Letti": [2, 3, 5, 4, 6],
-        "Minuti di Studio": [30, 45, 60, 40, 75],
-        "Parole Semplificate": [150, 200, 300, 250, 400]
-    }
-    
-    df = pd.DataFrame(progress_data)
+    scope = st.radio("Mostra i progressi di:", ["Io", "Tutta la scuola"], horizontal=True)
+    progress_user = user_name if scope == "Io" else ALL_USERS
+    events = get_events()
+    fig1, fig2 = load_progress_charts(progress_user, events.version, datetime.now().date())
     
     col1, col2 = st.columns(2)
     
     with col1:
-        # Grafico linee
-        fig1 = px.line(
-            df, 
-            x="Data", 
-            y=["Testi Letti", "Parole Semplificate"],
-            title="📈 Progressi Settimanali",
-            markers=True
-        )
         st.plotly_chart(fig1, use_container_width=True)
     
     with col2:
-        # Grafico a barre
-        fig2 = px.bar(
-            df,
-            x="Data",
-            y="Minuti di Studio",
-            title="⏰ Tempo di Studio",
-            color="Minuti di Studio",
-            color_continuous_scale="Blues"
-        )
         st.plotly_chart(fig2, use_container_width=True)
     
     # Statistiche personali
     st.divider()
     st.markdown("### 🏆 Le tue Statistiche")
     
+    summary = events.summary(user_name)
     col_stat1, col_stat2, col_stat3 = st.columns(3)
     with col_stat1:
-        st.metric("🎯 Obiettivo Giornaliero", "45 min", "+15%")
+        st.metric(
+            "🎯 Obiettivo Giornaliero",
+            f"{summary['minutes_today']:.0f} / {summary['goal_minutes']} min",
+            f"{summary['minutes_today'] - summary['minutes_yesterday']:+.0f} min rispetto a ieri"
+        )
+        st.progress(min(1.0, summary['minutes_today'] / summary['goal_minutes']))
     with col_stat2:
-        st.metric("📖 Testi Completati", "12", "3 questa settimana")
+        st.metric("📖 Testi Completati", summary['total_reads'],
+                  f"{summary['reads_this_week']} questa settimana")
     with col_stat3:
-        st.metric("💪 Giorni di Fila", "5", "+2")
+        st.metric("💪 Giorni di Fila", summary['streak'],
+                  "+1 oggi" if summary['active_today'] else "Studia oggi per continuare",
+                  delta_color="normal" if summary['active_today'] else "off")
 
 # TAB 6: Suggerimenti
 with tab6:
@@ -517,43 +809,25 @@ with tab6:
             )
             
             if student_profile and st.button("🎯 Ottieni Suggerimenti", use_container_width=True):
-                prompt = f"""
-                Sono uno studente con queste caratteristiche:
-                {student_profile}
-                
-                Dammi 5 suggerimenti pratici e personalizzati per:
-                1. Migliorare la concentrazione
-                2. Facilitare la lettura
-                3. Organizzare lo studio
-                4. Utilizzare strumenti compensativi
-                5. Gestire il tempo
-                """
-                
-                try:
-                    with st.spinner("Generazione suggerimenti personalizzati..."):
-                        response = openai.ChatCompletion.create(
-                            model="gpt-3.5-turbo",
-                            messages=[
-                                {"role": "system", "content": "Sei un tutor esperto in DSA e metodi di studio inclusivi."},
-                                {"role": "user", "content": prompt}
-                            ],
-                            temperature=0.8
-                        )
-                        
-                        suggestions = response.choices[0].message.content
-                        st.markdown(suggestions)
-                        
-                        # Salva i suggerimenti
-                        if st.button("💾 Salva Suggerimenti"):
-                            st.session_state.saved_texts.append({
-                                'text': suggestions[:100] + "...",
-                                'timestamp': datetime.now().strftime("%d/%m/%Y %H:%M"),
-                                'type': 'suggerimenti'
-                            })
-                            st.success("Suggerimenti salvati!")
-                            
-                except Exception as e:
-                    st.error(f"Errore: {str(e)}")
+                start_job("suggestions", "suggerimenti", suggestions_job, student_profile, api_key=openai_api_key)
+            job = show_job("suggestions", preview="text")
+            if job:
+                show_timing(job.meta["stream"])
+            suggestions = st.session_state.artifacts.get("suggestions")
+            if suggestions:
+                st.markdown(suggestions)
+            
+            # Salva i suggerimenti (fuori dal pulsante di generazione, che al
+            # clic successivo non è più premuto)
+            if suggestions and st.button("💾 Salva Suggerimenti"):
+                get_store().save_text(user_name, "suggerimenti", suggestions, title=student_profile[:60])
+                record_event(SAVE, suggestions)
+                st.session_state.saved_texts.append({
+                    'text': suggestions[:100] + "...",
+                    'timestamp': datetime.now().strftime("%d/%m/%Y %H:%M"),
+                    'type': 'suggerimenti'
+                })
+                st.success("Suggerimenti salvati!")
         else:
             st.info("🔑 Inserisci la tua OpenAI API Key nella sidebar per ottenere suggerimenti personalizzati")
     
@@ -589,20 +863,22 @@ st.markdown("""
 # Funzione per esportare dati
 with st.sidebar:
     st.divider()
+    # Archivio ZIP scritto su disco in background: testi, attività, audio e mappe
     if st.button("📤 Esporta Tutti i Dati"):
-        export_data = {
-            "saved_texts": st.session_state.saved_texts,
-            "reading_time": st.session_state.reading_time,
-            "statistics": {
-                "total_texts": len(st.session_state.saved_texts),
-                "total_minutes": st.session_state.reading_time
-            }
-        }
-        
-        json_str = json.dumps(export_data, indent=2, ensure_ascii=False)
+        map_keys = [document_key(map_text)] if map_text else []
+        start_job("export", "esportazione", export_job, user_name, map_keys)
+    job = show_job("export")
+    if job and os.path.exists(job.result):
+        manifest = job.meta["manifest"]
+        st.caption(f"{manifest['texts']} testi · {manifest.get('events', 0)} attività · "
+                   f"{manifest['audio']} audio · {manifest['maps']} mappe")
         st.download_button(
-            label="📥 Scarica JSON",
-            data=json_str,
-            file_name="dsa_assistant_data.json",
-            mime="application/json"
-        )
\ No newline at end of file
+            label="📥 Scarica archivio ZIP",
+            data=lambda path=job.result: read_file(path),
+            file_name=f"dsa_assistant_{user_name}.zip",
+            mime=MIME_TYPES["zip"]
+        )
+
+# Durata dell'intera esecuzione dello script
+metrics.observe("app.rerun", time.perf_counter() - rerun_started)
+metrics.write_metrics_file()
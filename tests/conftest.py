@@ -0,0 +1,17 @@
+"""Configurazione comune dei test: moduli dell'app importabili e nessun accesso a rete o dati reali"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Letti all'import dei moduli: vanno impostati prima di qualsiasi import dell'app
+_scratch = tempfile.mkdtemp(prefix="dsa_test_")
+os.environ.setdefault("DSA_CACHE_DIR", os.path.join(_scratch, "cache"))
+os.environ.setdefault("DSA_DATA_DIR", os.path.join(_scratch, "dati"))
+os.environ.setdefault("DSA_DB_PATH", os.path.join(_scratch, "dati", "test.db"))
+os.environ.setdefault("DSA_NLTK_DOWNLOAD", "0")
+os.environ.setdefault("DSA_LLM_BACKEND", "fake")
+os.environ.setdefault("DSA_TTS_BACKEND", "fake")
+os.environ.setdefault("DSA_STT_BACKEND", "fake")
@@ -0,0 +1,78 @@
+import threading
+from datetime import date, datetime, time, timedelta
+
+import analytics
+from analytics import ALL_USERS, LISTEN, READ, EventLog
+from storage import Storage
+
+TODAY = date(2026, 3, 11)  # mercoledì
+
+
+def at(day, hour=10):
+    return datetime.combine(day, time(hour)).timestamp()
+
+
+def make_log(tmp_path):
+    return EventLog(Storage(str(tmp_path / "archivio.db")))
+
+
+def test_record_updates_student_and_school_rollups(tmp_path):
+    log = make_log(tmp_path)
+    log.record("anna", READ, words=300, minutes=2.0, timestamp=at(TODAY)).result()
+    log.record("anna", READ, words=100, minutes=1.0, timestamp=at(TODAY, 18)).result()
+    log.record("luca", LISTEN, minutes=5.0, timestamp=at(TODAY - timedelta(days=7))).result()
+
+    assert log.daily("anna", today=TODAY) == [
+        {"day": "2026-03-11", "kind": READ, "events": 2, "words": 400, "minutes": 3.0},
+    ]
+    assert [(row["week"], row["kind"], row["events"]) for row in log.weekly(ALL_USERS)] == [
+        ("2026-W10", LISTEN, 1), ("2026-W11", READ, 2),
+    ]
+    # I totali della scuola non compaiono come studente e gli studenti restano separati
+    assert log.weekly("luca") == [{"week": "2026-W10", "kind": LISTEN, "events": 1, "words": 0, "minutes": 5.0}]
+    assert [event["words"] for event in log.iter_events("anna", batch_size=1)] == [300, 100]
+
+
+def test_summary_counts_streak_up_to_yesterday(tmp_path):
+    log = make_log(tmp_path)
+    for days_ago in (1, 2, 3, 5):
+        log.record("anna", READ, minutes=10.0, timestamp=at(TODAY - timedelta(days=days_ago))).result()
+
+    summary = log.summary("anna", today=TODAY)
+    # Oggi non ha ancora studiato: la serie parte da ieri e si ferma al giorno senza attività
+    assert summary["streak"] == 3 and not summary["active_today"]
+    assert summary["minutes_today"] == 0 and summary["minutes_yesterday"] == 10.0
+    assert summary["total_reads"] == 4 and summary["reads_this_week"] == 2
+
+    log.record("anna", LISTEN, minutes=30.0, timestamp=at(TODAY)).result()
+    summary = log.summary("anna", today=TODAY)
+    assert summary["streak"] == 4 and summary["active_today"]
+    assert summary["minutes_today"] == 30.0 and summary["total_reads"] == 4
+
+
+def test_version_grows_with_every_event(tmp_path):
+    log = make_log(tmp_path)
+    assert log.version == 0
+    log.record("anna", READ, timestamp=at(TODAY)).result()
+    first = log.version
+    # Un altro registro sullo stesso archivio (come un altro processo) vede la stessa versione
+    other = EventLog(log.store)
+    other.record("luca", READ, timestamp=at(TODAY)).result()
+    assert log.version > first
+
+
+def test_get_event_log_is_shared_between_threads(monkeypatch):
+    monkeypatch.setattr(analytics, "_event_log", None)
+    barrier = threading.Barrier(8)
+    logs = []
+
+    def get():
+        barrier.wait()
+        logs.append(analytics.get_event_log())
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(log) for log in logs}) == 1
@@ -0,0 +1,50 @@
+import io
+import os
+import time
+import wave
+
+import numpy as np
+import pytest
+
+from conftest import ROOT
+
+AppTest = pytest.importorskip("streamlit.testing.v1").AppTest
+
+SCRIPT = os.path.join(ROOT, "tempCodeRunnerFile.py")
+
+
+def lecture_wav(seconds, rate=8000):
+    """Registrazione con frasi di 2 s separate da pause di 1 s (toni su un leggero fruscio)"""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * rate)) / rate
+    samples = rng.normal(0, 60, len(t)) + 6000 * np.sin(2 * np.pi * 160 * t) * ((t % 3) < 2)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(np.clip(samples, -32768, 32767).astype("<i2").tobytes())
+    return buffer.getvalue()
+
+
+def run_until(app, text, timeout=60):
+    """Riesegue lo script finché non compare il testo indicato"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        app.run()
+        if any(text in markdown.value for markdown in app.markdown):
+            return app
+        time.sleep(0.2)
+    raise AssertionError(f"'{text}' non è comparso in tempo")
+
+
+def test_transcript_and_preview_readers_do_not_collide():
+    # La trascrizione e l'anteprima mostrano lo stesso testo, su più pagine
+    app = AppTest.from_file(SCRIPT, default_timeout=60).run()
+    app.radio[0].set_value("🎤 Registra Audio").run()
+    app.file_uploader[0].set_value(("lezione.wav", lecture_wav(600), "audio/wav"))
+    run_until(app, "Testo trascritto")
+    assert not app.exception
+    assert any(caption.value.startswith("Pagina 1 di ") for caption in app.caption)
+    readers = [button for button in app.button if button.label == "▶️"]
+    assert len(readers) == 2
@@ -0,0 +1,77 @@
+import gc
+import os
+import time
+
+import artifacts
+from artifacts import ArtifactStore
+
+
+def test_least_used_items_spill_to_disk_and_come_back():
+    store = ArtifactStore(memory_bytes=100, disk_bytes=1000)
+    store.put("audio", b"a" * 60)
+    store.put("testo", "è" * 30)  # 60 byte in UTF-8
+    # Oltre il tetto della memoria la voce meno usata passa su disco
+    assert store.footprint() == {"memory": 60, "disk": 60, "items": 2}
+    assert store._items["audio"].value is None and os.path.exists(store._items["audio"].path)
+
+    # Rileggerla la riporta in memoria e sposta l'altra
+    assert store.get("audio") == b"a" * 60
+    assert store._items["testo"].value is None
+    assert store.get("testo") == "è" * 30
+    assert store.footprint()["memory"] == 60
+
+
+def test_item_larger_than_memory_stays_on_disk():
+    store = ArtifactStore(memory_bytes=50, disk_bytes=1000)
+    store.put("grande", b"x" * 80)
+    assert store.footprint() == {"memory": 0, "disk": 80, "items": 1}
+    assert store.get("grande") == b"x" * 80
+    assert store.footprint()["memory"] == 0
+
+
+def test_disk_budget_drops_oldest_items():
+    store = ArtifactStore(memory_bytes=10, disk_bytes=100)
+    for name in ("prima", "seconda", "terza"):
+        store.put(name, b"y" * 40)
+    assert "prima" not in store and store.get("prima", "sparita") == "sparita"
+    assert store.get("terza") == b"y" * 40
+    assert store.footprint() == {"memory": 0, "disk": 80, "items": 2}
+
+    # Una voce sostituita o tolta libera anche il suo file
+    path = store._items["seconda"].path
+    store.discard("seconda")
+    assert not os.path.exists(path)
+
+
+def test_process_budget_spills_across_sessions(monkeypatch):
+    gc.collect()
+    monkeypatch.setattr(artifacts, "TOTAL_MEMORY_BYTES", artifacts.usage()["memory"] + 100)
+    first, second = ArtifactStore(memory_bytes=1000), ArtifactStore(memory_bytes=1000)
+    first.put("vecchia", b"v" * 60)
+    time.sleep(0.01)
+    second.put("nuova", b"n" * 60)
+    # La voce meno usata tra tutte le sessioni esce dalla memoria, anche se di un'altra sessione
+    assert first.footprint()["memory"] == 0 and first.footprint()["disk"] == 60
+    assert second.footprint()["memory"] == 60
+    assert artifacts.usage()["max_session"] >= 60
+
+
+def test_session_directory_is_removed_with_the_store():
+    store = ArtifactStore(memory_bytes=0)
+    store.put("audio", b"a" * 10)
+    directory = store._directory
+    assert os.path.isdir(directory)
+    del store
+    gc.collect()
+    assert not os.path.exists(directory)
+
+
+def test_sweep_removes_stale_session_directories(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifacts, "ARTIFACT_DIR", str(tmp_path))
+    stale, fresh = tmp_path / "vecchia", tmp_path / "recente"
+    stale.mkdir()
+    fresh.mkdir()
+    old = time.time() - artifacts.STALE_SECONDS - 60
+    os.utime(stale, (old, old))
+    artifacts.sweep_stale()
+    assert not stale.exists() and fresh.exists()
@@ -0,0 +1,44 @@
+import json
+import os
+
+import pytest
+
+import batch
+
+fitz = pytest.importorskip("fitz")
+
+
+def write_pdf(path, text):
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), text)
+    doc.save(str(path))
+
+
+def test_resume_skips_completed_files(tmp_path):
+    inputs, outputs = tmp_path / "materiali", tmp_path / "uscita"
+    inputs.mkdir()
+    write_pdf(inputs / "lezione.pdf", "La fotosintesi clorofilliana trasforma la luce in energia.")
+    options = {"workers": 1, "audio": False, "mind_map": False, "log": lambda message: None}
+
+    totals = batch.run(str(inputs), str(outputs), **options)
+    assert (totals["files"], totals["failed"], totals["skipped"]) == (1, 0, 0)
+    # La cartella di uscita ha il nome completo del file, estensione compresa
+    assert "fotosintesi" in (outputs / "lezione.pdf" / "testo.txt").read_text(encoding="utf-8")
+    manifest = json.loads((outputs / batch.MANIFEST).read_text(encoding="utf-8"))
+    assert manifest["lezione.pdf"]["status"] == "completato"
+
+    totals = batch.run(str(inputs), str(outputs), **options)
+    assert (totals["files"], totals["skipped"]) == (0, 1)
+
+    # File modificato o uscita mancante: viene rielaborato
+    write_pdf(inputs / "lezione.pdf", "Il Risorgimento portò all'unificazione dell'Italia nel 1861.")
+    assert batch.run(str(inputs), str(outputs), **options)["files"] == 1
+    os.remove(outputs / "lezione.pdf" / "semplificato.txt")
+    assert batch.run(str(inputs), str(outputs), **options)["files"] == 1
+
+
+def test_process_file_outside_pool_fails_clearly(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "_backend", None)
+    write_pdf(tmp_path / "lezione.pdf", "La fotosintesi clorofilliana.")
+    with pytest.raises(RuntimeError, match="_init_worker"):
+        batch.process_file(str(tmp_path / "lezione.pdf"), str(tmp_path / "uscita"))
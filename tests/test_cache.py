@@ -0,0 +1,94 @@
+import os
+import time
+
+from cache import ResultCache, make_key, normalize_text
+
+
+def make_cache(tmp_path, **kwargs):
+    return ResultCache("test", directory=str(tmp_path), **kwargs)
+
+
+def age(cache, key, seconds):
+    path = cache._path(key)
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def test_memory_lru_keeps_recently_used_items(tmp_path):
+    cache = make_cache(tmp_path, max_items=2)
+    cache.set("a", "uno")
+    cache.set("b", "due")
+    assert cache.get("a") == "uno"
+    cache.set("c", "tre")
+    # "b" è uscita dalla memoria ma resta su disco
+    assert set(cache._memory) == {"a", "c"}
+    assert cache.get("b") == "due"
+    assert (cache.memory_hits, cache.disk_hits, cache.misses) == (1, 1, 0)
+    assert cache.get("nessuna", "predefinito") == "predefinito" and cache.misses == 1
+
+
+def test_memory_budget_in_bytes(tmp_path):
+    cache = make_cache(tmp_path, max_memory_bytes=100)
+    cache.set("grande", b"x" * 150)
+    cache.set("media", b"y" * 60)
+    cache.set("altra", b"z" * 60)
+    # Troppo grande per la memoria: solo su disco; poi la meno recente esce
+    assert list(cache._memory) == ["altra"] and cache.stats()["memory_bytes"] == 60
+    assert cache.get("grande") == b"x" * 150 and cache.disk_hits == 1
+
+
+def test_disk_tier_is_shared_and_expires(tmp_path):
+    writer = make_cache(tmp_path, ttl=60)
+    writer.set("chiave", {"testo": "semplificato"})
+    # Un'altra istanza (come un altro processo) legge la voce dal disco
+    reader = make_cache(tmp_path, ttl=60)
+    assert reader.get("chiave") == {"testo": "semplificato"} and reader.disk_hits == 1
+
+    writer.set("scaduta", "vecchia")
+    age(writer, "scaduta", 120)
+    assert make_cache(tmp_path, ttl=60).get("scaduta") is None
+    assert not os.path.exists(writer._path("scaduta"))
+
+
+def test_sweep_removes_least_recent_files_over_the_disk_budget(tmp_path):
+    cache = make_cache(tmp_path, max_disk_bytes=1000)
+    for i in range(5):
+        cache.set(f"voce{i}", b"d" * 300)
+        age(cache, f"voce{i}", 100 - i)
+    # Leggere una voce dal disco la rende la più recente
+    cache._memory.clear()
+    assert cache.get("voce0") is not None
+    cache.sweep()
+    remaining = {key for key in (f"voce{i}" for i in range(5)) if os.path.exists(cache._path(key))}
+    assert remaining == {"voce0", "voce3", "voce4"}
+
+
+def test_corrupt_file_is_a_miss(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("rotta", "valore")
+    with open(cache._path("rotta"), "wb") as f:
+        f.write(b"non e' un pickle")
+    assert make_cache(tmp_path).get("rotta") is None
+    assert not os.path.exists(cache._path("rotta"))
+
+
+def test_get_or_compute_and_clear(tmp_path):
+    cache = make_cache(tmp_path)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return "calcolato"
+
+    assert cache.get_or_compute("k", compute) == "calcolato"
+    assert cache.get_or_compute("k", compute) == "calcolato" and len(calls) == 1
+    cache.clear()
+    assert cache.get("k") is None
+    assert cache.get_or_compute("k", compute) == "calcolato" and len(calls) == 2
+
+
+def test_keys_ignore_whitespace_and_unicode_form():
+    # "é" scritta come "e" più l'accento combinante è lo stesso testo
+    assert normalize_text("Perche\u0301  la\nluce") == normalize_text("Perch\u00e9 la luce")
+    assert make_key("ab", "c") != make_key("a", "bc")
+    assert make_key(b"x") != make_key("x")
@@ -0,0 +1,89 @@
+import json
+import os
+import time
+import zipfile
+
+import pytest
+
+import export
+import jobs
+from analytics import READ, EventLog
+from mindmap import document_key, save_tree
+from storage import Storage, store_audio
+
+pytest.importorskip("fitz")
+
+LESSON = "La fotosintesi clorofilliana trasforma la luce in energia chimica."
+
+
+def test_archive_contains_only_the_users_data(tmp_path):
+    store = Storage(str(tmp_path / "archivio.db"))
+    ref = store_audio(b"ID3 audio finto")
+    store.save_text("anna", "testo", LESSON, title="Fotosintesi", audio_ref=ref)
+    store.save_text("anna", "testo", "Il Risorgimento italiano.", title="Storia")
+    store.save_text("luca", "testo", "Appunti di Luca.", title="Altro").result()
+    events = EventLog(store)
+    events.record("anna", READ, words=10, minutes=1.0).result()
+    events.record("luca", READ, words=5).result()
+    save_tree(LESSON, "Fotosintesi\n├── Luce\n└── Energia chimica")
+    save_tree("Testo aperto ma non salvato.", "Testo aperto\n└── Mappa")
+
+    progress = []
+    path = str(tmp_path / "anna.zip")
+    opened = document_key("Testo aperto ma non salvato.")
+    manifest = export.write_export(path, "anna", store, events, map_keys=[opened],
+                                   progress=lambda done, total: progress.append((done, total)))
+
+    assert (manifest["texts"], manifest["events"], manifest["audio"], manifest["maps"]) == (2, 1, 1, 2)
+    assert progress[-1] == (2, 2)
+    with zipfile.ZipFile(path) as zf:
+        names = set(zf.namelist())
+        texts = [json.loads(line) for line in zf.read("testi.ndjson").splitlines()]
+        assert {row["title"] for row in texts} == {"Fotosintesi", "Storia"}
+        assert json.loads(zf.read("eventi.ndjson"))["words"] == 10
+        assert zf.read(f"audio/{ref}.mp3") == b"ID3 audio finto"
+        assert json.loads(zf.read("manifest.json")) == manifest
+    maps = {f"mappe/{i:03d}.{fmt}" for i in (1, 2) for fmt in ("txt",) + export.FORMATS}
+    assert maps <= names
+
+
+class ExportJob:
+    """Lavoro che viene annullato dopo il primo testo scritto"""
+
+    def __init__(self):
+        self.meta = {}
+        self.checks = 0
+
+    def progress(self, done, total):
+        pass
+
+    def check(self):
+        self.checks += 1
+        if self.checks > 1:
+            raise jobs.Cancelled()
+
+
+def test_cancelled_export_removes_the_partial_archive(tmp_path, monkeypatch):
+    store = Storage(str(tmp_path / "archivio.db"))
+    for i in range(150):
+        store.save_text("anna", "testo", f"Testo numero {i}.")
+    store.save_text("anna", "testo", "Ultimo.").result()
+    path = str(tmp_path / "parziale.zip")
+    monkeypatch.setattr(export, "new_export_path", lambda user: path)
+    monkeypatch.setattr("storage.get_storage", lambda: store)
+
+    with pytest.raises(jobs.Cancelled):
+        jobs.export_job(ExportJob(), "anna")
+    assert not os.path.exists(path)
+
+
+def test_sweep_removes_old_archives(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "EXPORT_DIR", str(tmp_path))
+    old, recent = tmp_path / "vecchio.zip", tmp_path / "recente.zip"
+    old.write_bytes(b"")
+    recent.write_bytes(b"")
+    stale = time.time() - export.EXPORT_TTL - 60
+    os.utime(old, (stale, stale))
+    export.sweep()
+    assert not old.exists() and recent.exists()
+    assert export.new_export_path("anna!").startswith(str(tmp_path / "anna_"))
@@ -0,0 +1,34 @@
+from highlight import Highlighter, load_lexicon
+
+
+def spans(highlighter, text):
+    return [text[start:end] for start, end in highlighter.matches(text)]
+
+
+def test_whole_words_ignoring_case():
+    highlighter = Highlighter(["tuttavia", "dunque"])
+    assert spans(highlighter, "Tuttavia piove, DUNQUE resto. tuttaviaX") == ["Tuttavia", "DUNQUE"]
+
+
+def test_prefix_entries():
+    highlighter = Highlighter(["ottemper*"])
+    assert spans(highlighter, "ottemperare, ottemperanza, ottemper, ottimo") == \
+        ["ottemperare", "ottemperanza", "ottemper"]
+
+
+def test_multiword_entries_and_apostrophes():
+    highlighter = Highlighter(["ciò nonostante", "dell'impero"])
+    text = "Ciò   nonostante, dell’impero e dell'impero"
+    assert spans(highlighter, text) == ["Ciò   nonostante", "dell’impero", "dell'impero"]
+
+
+def test_highlight_escapes_text():
+    highlighter = Highlighter(["tuttavia"], css_class="difficile")
+    assert highlighter.highlight("a < tuttavia\nb") == \
+        'a &lt; <span class="difficile">tuttavia</span><br>b'
+
+
+def test_shipped_lexicon_compiles():
+    entries = load_lexicon()
+    assert len(entries) > 400
+    assert Highlighter(entries).matches("Tuttavia il testo continua.") == [(0, 8)]
@@ -0,0 +1,37 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import ingest
+
+fitz = pytest.importorskip("fitz")
+
+
+def write_pdf(path):
+    doc = fitz.open()
+    doc.new_page()
+    doc.save(str(path))
+    return str(path)
+
+
+def test_tiles_are_sequential_inside_pool_processes():
+    assert ingest._tile_workers(64) == min(ingest.OCR_WORKERS, 64)
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        assert pool.submit(ingest._tile_workers, 64).result() == 1
+
+
+def test_worker_closes_previous_document(monkeypatch, tmp_path):
+    monkeypatch.setattr(ingest, "_ocr_doc_page", lambda doc, page_number, dpi: f"pagina {page_number}")
+    monkeypatch.setattr(ingest, "_worker_doc", None)
+    first, second = write_pdf(tmp_path / "a.pdf"), write_pdf(tmp_path / "b.pdf")
+
+    assert ingest._ocr_page(first, 0, 72) == "pagina 0"
+    doc = ingest._worker_doc[1]
+    ingest._ocr_page(first, 0, 72)
+    assert ingest._worker_doc[1] is doc
+
+    ingest._ocr_page(second, 0, 72)
+    assert doc.is_closed
+    assert ingest._worker_doc[0] == second
+    ingest._worker_doc[1].close()
@@ -0,0 +1,136 @@
+import io
+import threading
+import time
+
+import pytest
+
+import jobs
+import metrics
+
+
+class InlineJob:
+    """Lavoro che esegue `run_cpu` nel processo corrente, con le misure riportate come dal pool"""
+
+    def progress(self, done, total):
+        pass
+
+    def run_cpu(self, fn, *args):
+        result, observations = metrics.run_recorded(fn, *args)
+        metrics.replay(observations)
+        return result
+
+
+def test_image_ocr_is_measured_once(monkeypatch):
+    Image = pytest.importorskip("PIL.Image")
+    import ingest
+
+    monkeypatch.setattr(ingest, "_ocr_tiles", lambda image, lang, dpi: "testo riconosciuto")
+    buffer = io.BytesIO()
+    Image.new("L", (200, 100), 255).save(buffer, format="PNG")
+    data = buffer.getvalue()
+
+    registry = metrics.Registry()
+    metrics.set_session(registry)
+    try:
+        assert jobs.image_ocr_job(InlineJob(), data) == "testo riconosciuto"
+    finally:
+        metrics.set_session(None)
+    stages = registry.summary()
+    assert stages["ocr.image"]["count"] == 1
+    assert stages["ocr.image"]["bytes"] == len(data)
+    assert stages["ocr.image.job"]["count"] == 1
+
+
+def wait_for(job, timeout=10):
+    deadline = time.monotonic() + timeout
+    while job.active:
+        assert time.monotonic() < deadline, f"lavoro ancora {job.status}"
+        time.sleep(0.01)
+    return job
+
+
+@pytest.fixture
+def queue():
+    queue = jobs.JobQueue(workers=4, cpu_workers=1, max_per_session=2, ttl=60)
+    yield queue
+    queue.shutdown()
+
+
+def test_active_jobs_are_limited_per_session(queue):
+    gate = threading.Event()
+    running = [queue.submit("s1", "attesa", lambda job: gate.wait(10)) for _ in range(2)]
+    with pytest.raises(jobs.TooManyJobs):
+        queue.submit("s1", "attesa", lambda job: None)
+    # Le altre sessioni non sono bloccate
+    other = wait_for(queue.submit("s2", "subito", lambda job: "fatto"))
+    assert other.status == jobs.DONE and other.result == "fatto"
+    assert len(queue.active_jobs("s1")) == 2 and not queue.active_jobs("s2")
+
+    gate.set()
+    for job in running:
+        assert wait_for(job).status == jobs.DONE
+    assert wait_for(queue.submit("s1", "subito", lambda job: 1)).result == 1
+
+
+def test_cancel_stops_at_the_next_check(queue):
+    started = threading.Event()
+
+    def pieces(job):
+        for i in range(1000):
+            job.check()
+            job.add(i)
+            started.set()
+            time.sleep(0.01)
+        return "mai"
+
+    job = queue.submit("s1", "pezzi", pieces)
+    assert started.wait(10)
+    assert job.partial()
+    queue.cancel(job.id)
+    assert wait_for(job).status == jobs.CANCELLED
+    assert job.result is None and job.partial() == [] and job.finished_at
+
+
+def test_cancelled_before_start_never_runs():
+    queue = jobs.JobQueue(workers=1, max_per_session=3)
+    gate = threading.Event()
+    calls = []
+    try:
+        first = queue.submit("s1", "attesa", lambda job: gate.wait(10))
+        waiting = queue.submit("s1", "dopo", lambda job: calls.append(job))
+        assert waiting.status == jobs.PENDING
+        waiting.cancel()
+        gate.set()
+        assert wait_for(first).status == jobs.DONE
+        assert wait_for(waiting).status == jobs.CANCELLED and not calls
+    finally:
+        queue.shutdown()
+
+
+def test_failed_job_keeps_the_error(queue):
+    def broken(job):
+        raise ValueError("file illeggibile")
+
+    job = wait_for(queue.submit("s1", "rotto", broken))
+    assert job.status == jobs.FAILED and job.error == "file illeggibile"
+
+
+def test_release_and_ttl_remove_finished_jobs(queue):
+    gate = threading.Event()
+    active = queue.submit("s1", "attesa", lambda job: gate.wait(10))
+    finished = wait_for(queue.submit("s1", "subito", lambda job: "fatto"))
+
+    # Un lavoro ancora attivo non si può togliere
+    queue.release(active.id)
+    assert queue.get(active.id) is active
+    queue.release(finished.id)
+    assert queue.get(finished.id) is None
+
+    gate.set()
+    wait_for(active)
+    old = wait_for(queue.submit("s2", "subito", lambda job: "vecchio"))
+    old.finished_at -= queue.ttl + 1
+    assert queue.get(active.id) is active and queue.get(old.id) is old
+    # I lavori conclusi da più di `ttl` secondi escono dalla coda al lavoro successivo
+    wait_for(queue.submit("s3", "subito", lambda job: None))
+    assert queue.get(old.id) is None and queue.get(active.id) is active
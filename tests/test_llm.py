@@ -0,0 +1,205 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from cache import ResultCache
+from llm import ChatBackend, ChatClient, LLMError, OpenAIBackend, TokenBucket, estimate_tokens, split_into_chunks
+
+
+@pytest.fixture
+def sse_server():
+    """Server compatibile OpenAI che risponde a pezzi; `state["done"]` decide se chiude con [DONE]
+    e `state["errors"]` sono i codici di errore da restituire prima delle risposte buone"""
+    state = {"done": True, "requests": 0, "errors": []}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            state["requests"] += 1
+            if state["errors"]:
+                body = b"limite raggiunto"
+                self.send_response(state["errors"].pop(0))
+                self.send_header("Retry-After", "0")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for piece in ("Le piante ", "usano ", "la luce."):
+                chunk = {"choices": [{"delta": {"content": piece}}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            if state["done"]:
+                self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state["url"] = f"http://127.0.0.1:{server.server_port}/v1"
+    yield state
+    server.shutdown()
+
+
+def make_client(url, tmp_path, max_retries=0):
+    backend = OpenAIBackend(base_url=url, max_retries=max_retries, backoff=0.01)
+    return ChatClient(cache=ResultCache("test_llm", directory=str(tmp_path)), backend=backend)
+
+
+def test_complete_stream_is_cached(sse_server, tmp_path):
+    client = make_client(sse_server["url"], tmp_path)
+    assert client.complete("prova", "sistema", "{text}", "testo", api_key="k") == "Le piante usano la luce."
+    assert client.complete("prova", "sistema", "{text}", "testo", api_key="k") == "Le piante usano la luce."
+    assert sse_server["requests"] == 1
+
+
+def test_truncated_stream_is_an_error_and_not_cached(sse_server, tmp_path):
+    sse_server["done"] = False
+    client = make_client(sse_server["url"], tmp_path)
+    with pytest.raises(LLMError, match="interrotta"):
+        client.complete("prova", "sistema", "{text}", "testo", api_key="k")
+
+    # La richiesta successiva non trova la risposta troncata in cache
+    sse_server["done"] = True
+    assert client.complete("prova", "sistema", "{text}", "testo", api_key="k") == "Le piante usano la luce."
+    assert sse_server["requests"] == 2
+
+
+def test_chunks_are_slices_of_the_source_text():
+    long_sentence = " ".join(f"parola{i}" for i in range(120)) + "."
+    text = f"La fotosintesi produce zuccheri.\n\n{long_sentence}\nLe piante   crescono alla luce."
+    chunks = split_into_chunks(text, max_tokens=60)
+
+    assert len(chunks) > 3
+    position = 0
+    for chunk in chunks:
+        assert estimate_tokens(chunk) <= 60
+        # Ogni parte è una porzione del testo, con gli spazi e gli a capo originali
+        position = text.index(chunk, position) + len(chunk)
+    assert chunks[0] == "La fotosintesi produce zuccheri." and chunks[1].startswith("parola0 parola1 ")
+    assert " ".join(" ".join(chunks).split()) == " ".join(text.split())
+    assert chunks[-1].endswith("parola119.\nLe piante   crescono alla luce.")
+
+
+def test_rate_limits_and_server_errors_are_retried(sse_server, tmp_path):
+    sse_server["errors"] = [429, 503]
+    client = make_client(sse_server["url"], tmp_path, max_retries=2)
+    assert client.complete("prova", "sistema", "{text}", "testo", api_key="k") == "Le piante usano la luce."
+    assert sse_server["requests"] == 3
+
+    # Oltre i tentativi l'ultimo errore arriva al chiamante, con il suo codice
+    sse_server["errors"] = [429, 429, 429]
+    with pytest.raises(LLMError) as error:
+        client.complete("prova", "sistema", "{text}", "altro testo", api_key="k")
+    assert error.value.status == 429 and sse_server["requests"] == 6
+
+
+def test_client_errors_are_not_retried(sse_server, tmp_path):
+    sse_server["errors"] = [401]
+    client = make_client(sse_server["url"], tmp_path, max_retries=3)
+    with pytest.raises(LLMError) as error:
+        client.complete("prova", "sistema", "{text}", "testo", api_key="sbagliata")
+    assert error.value.status == 401 and sse_server["requests"] == 1
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(rate=50, capacity=2)
+    started = time.monotonic()
+    bucket.acquire()
+    bucket.acquire()
+    assert time.monotonic() - started < 0.03
+    # Secchiello vuoto: due gettoni arrivano in 2/50 di secondo
+    bucket.acquire(2)
+    assert time.monotonic() - started >= 0.035
+    # Una richiesta più grande della capacità non resta bloccata per sempre
+    bucket.acquire(100)
+
+
+class GatedBackend(ChatBackend):
+    """Modello che risponde solo quando il test apre il cancello"""
+
+    name = "gated"
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.gate = threading.Event()
+        self.fail = fail
+
+    def stream(self, messages, model, params, api_key=None):
+        self.calls.append(api_key)
+        assert self.gate.wait(10)
+        yield "Le piante "
+        if self.fail:
+            raise ConnectionError("connessione chiusa")
+        yield "usano la luce."
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def start_reading(client, api_key, results):
+    stream = client.stream("prova", "sistema", "{text}", "testo", api_key=api_key)
+
+    def read():
+        try:
+            results.append("".join(stream))
+        except LLMError as e:
+            results.append(e)
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    return stream, thread
+
+
+def test_identical_requests_share_one_call_per_api_key(tmp_path):
+    backend = GatedBackend()
+    client = ChatClient(cache=ResultCache("test_flight", directory=str(tmp_path)), backend=backend)
+    results = []
+    first, first_thread = start_reading(client, "k", results)
+    wait_until(lambda: backend.calls == ["k"])
+    second, second_thread = start_reading(client, "k", results)
+    wait_until(lambda: second.shared)
+    # Con un'altra chiave la richiesta non si condivide
+    other, other_thread = start_reading(client, "altra", results)
+    wait_until(lambda: len(backend.calls) == 2)
+
+    backend.gate.set()
+    for thread in (first_thread, second_thread, other_thread):
+        thread.join(10)
+    assert results == ["Le piante usano la luce."] * 3
+    assert sorted(backend.calls) == ["altra", "k"] and not first.shared and not other.shared
+
+    cached = client.stream("prova", "sistema", "{text}", "testo", api_key="k")
+    assert "".join(cached) == "Le piante usano la luce." and cached.cached
+    assert len(backend.calls) == 2
+    assert client.timings()["prova"]["calls"] == 2
+
+
+def test_failed_shared_request_reaches_everyone_and_is_not_cached(tmp_path):
+    backend = GatedBackend(fail=True)
+    client = ChatClient(cache=ResultCache("test_flight", directory=str(tmp_path)), backend=backend)
+    results = []
+    _, first_thread = start_reading(client, "k", results)
+    wait_until(lambda: backend.calls)
+    second, second_thread = start_reading(client, "k", results)
+    wait_until(lambda: second.shared)
+
+    backend.gate.set()
+    first_thread.join(10)
+    second_thread.join(10)
+    assert len(results) == 2 and all(isinstance(r, LLMError) for r in results)
+    assert not client._flights
+
+    backend.fail = False
+    assert client.complete("prova", "sistema", "{text}", "testo", api_key="k") == "Le piante usano la luce."
+    assert len(backend.calls) == 2
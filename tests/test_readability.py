@@ -0,0 +1,29 @@
+import pytest
+
+from readability import analyze, count_syllables, gulpease_label
+
+
+@pytest.mark.parametrize("word, expected", [
+    ("casa", 2),
+    ("fotosintesi", 5),
+    ("paese", 3),
+    ("poeta", 3),
+    ("aiuola", 2),
+    ("città", 2),
+    ("sport", 1),
+])
+def test_count_syllables(word, expected):
+    assert count_syllables(word) == expected
+
+
+def test_gulpease():
+    # 1 frase, 8 parole, 65 lettere: 89 + (300 * 1 - 10 * 65) / 8
+    report = analyze("La fotosintesi clorofilliana trasforma sempre energia luminosa complessa.")
+    assert (report.n_sentences, report.n_words, report.n_letters) == (1, 8, 65)
+    assert report.gulpease == pytest.approx(45.25)
+    assert gulpease_label(report.gulpease) == "Difficile (scuola superiore)"
+
+
+def test_gulpease_is_clipped_and_handles_empty_text():
+    assert analyze("Il gatto dorme. La casa è grande.").gulpease == 100.0
+    assert analyze("").gulpease == 100.0
@@ -0,0 +1,58 @@
+import numpy as np
+
+from related import VectorIndex
+
+
+def unit_vectors(ids, dim=4):
+    vectors = np.zeros((len(ids), dim), dtype="<f4")
+    for row, id_ in enumerate(ids):
+        vectors[row, id_ % dim] = 1
+    return vectors
+
+
+def test_add_and_search(tmp_path):
+    index = VectorIndex(str(tmp_path), dim=4)
+    index.add([1, 2, 3], unit_vectors([1, 2, 3]))
+    assert len(index) == 3 and index.last_id == 3
+    assert index.search(unit_vectors([2])[0], k=1) == [(2, 1.0)]
+
+    # Gli id già indicizzati (es. da un altro processo) vengono ignorati
+    index.add([2, 3, 4], unit_vectors([2, 3, 4]))
+    assert len(index) == 4
+    assert index.search(unit_vectors([4])[0], k=1) == [(4, 1.0)]
+
+
+def test_interrupted_add_is_discarded(tmp_path):
+    index = VectorIndex(str(tmp_path), dim=4)
+    index.add([1, 2], unit_vectors([1, 2]))
+    # Aggiunta interrotta: vettore scritto, id mai arrivato, e mezzo vettore in più
+    with open(index.vectors_path, "ab") as f:
+        f.write(unit_vectors([3]).tobytes() + b"\0" * 6)
+    assert len(index) == 2
+
+    index.add([3], unit_vectors([3]))
+    assert len(index) == 3
+    assert index.search(unit_vectors([3])[0], k=1) == [(3, 1.0)]
+    # Di nuovo allineati: ogni riga ha il suo vettore
+    reopened = VectorIndex(str(tmp_path), dim=4)
+    assert reopened.search(unit_vectors([1])[0], k=1) == [(1, 1.0)]
+    assert np.fromfile(index.ids_path, dtype="<i8").tolist() == [1, 2, 3]
+
+
+def test_get_index_syncs_in_background(tmp_path):
+    import related
+    from storage import Storage
+
+    store = Storage(str(tmp_path / "archivio.db"))
+    store.save_text("anna", "materiale", "La fotosintesi clorofilliana nelle piante", title="Fotosintesi").result()
+    index = related.get_index(store)
+    # Il rendering non aspetta l'indicizzazione: avviene nel thread in background
+    index._background.join(timeout=30)
+    assert len(index) == 1
+    assert not index.sync_in_background(store)
+
+    store.save_text("anna", "testo", "Le piante producono zuccheri con la luce", title="Piante").result()
+    assert related.get_index(store) is index
+    index._background.join(timeout=30)
+    assert len(index) == 2
+    assert related.related_texts("La fotosintesi delle piante", "anna", store)[0]["title"] in ("Fotosintesi", "Piante")
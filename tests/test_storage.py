@@ -0,0 +1,85 @@
+import threading
+
+from storage import Storage
+
+MATERIALS = {
+    "La fotosintesi": {"content": "Le piante trasformano la luce del sole in energia chimica."},
+    "Il Risorgimento": {"content": "Il processo che portò all'unificazione dell'Italia nel 1861."},
+}
+
+
+def make_store(tmp_path):
+    return Storage(str(tmp_path / "archivio.db"))
+
+
+def test_search_ranks_filters_and_paginates(tmp_path):
+    store = make_store(tmp_path)
+    for i in range(7):
+        store.save_text("anna", "testo", f"Appunti numero {i} sulla fotosintesi delle piante", title=f"Nota {i}")
+    store.save_text("luca", "testo", "La fotosintesi clorofilliana", title="Di Luca")
+    store.save_text("anna", "materiale", "Le città italiane", title="Geografia").result()
+
+    rows, total = store.search("fotosintesi", user="anna", page_size=3)
+    assert total == 7 and len(rows) == 3
+    assert all(row["user"] == "anna" and "**" in row["snippet"] for row in rows)
+    last_page, _ = store.search("fotosintesi", user="anna", page=2, page_size=3)
+    assert len(last_page) == 1
+    pages = rows + store.search("fotosintesi", user="anna", page=1, page_size=3)[0] + last_page
+    assert len({row["id"] for row in pages}) == 7
+
+    # Prefissi, accenti ignorati, filtro per tipo e virgolette nella query
+    assert store.search("fotosin", user="luca")[1] == 1
+    assert store.search("citta", kinds=("materiale",))[1] == 1
+    assert store.search("fotosintesi", kinds=("materiale",))[1] == 0
+    assert store.search('"fotosintesi')[1] == 8
+    assert store.search("   ") == ([], 0)
+
+
+def test_list_and_iter_texts(tmp_path):
+    store = make_store(tmp_path)
+    ids = [store.save_text("anna", "testo", f"Testo {i}").result() for i in range(5)]
+
+    rows, total = store.list_texts(user="anna", page=1, page_size=2)
+    assert total == 5 and [row["id"] for row in rows] == ids[::-1][2:4]
+    assert [row["id"] for row in store.iter_texts(user="anna", batch_size=2)] == ids[::-1]
+    assert [row["id"] for row in store.texts_after(ids[2])] == ids[3:]
+
+    store.delete_text(ids[0]).result()
+    assert store.get_text(ids[0]) is None and store.count_texts(user="anna") == 4
+    assert store.search("Testo")[1] == 4
+
+
+def test_default_materials_are_inserted_once(tmp_path):
+    stores = [make_store(tmp_path) for _ in range(4)]
+    barrier = threading.Barrier(len(stores))
+
+    def seed(store):
+        barrier.wait()
+        store.ensure_materials(MATERIALS)
+
+    # Come più processi che aprono l'app insieme: ognuno ha la sua connessione di scrittura
+    threads = [threading.Thread(target=seed, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    rows, total = stores[0].list_texts(kinds=("materiale",))
+    assert total == 2 and {row["title"] for row in rows} == set(MATERIALS)
+    # Un materiale con lo stesso titolo creato da uno studente resta possibile
+    stores[0].save_text("anna", "materiale", "I miei appunti", title="La fotosintesi").result()
+    assert stores[0].count_texts(kinds=("materiale",)) == 3
+
+
+def test_duplicate_default_materials_are_removed_on_open(tmp_path):
+    store = make_store(tmp_path)
+    # Archivio di una versione senza indice unico, con i materiali inseriti due volte
+    store.transaction(lambda conn: conn.execute("DROP INDEX idx_texts_default_materials")).result()
+    for _ in range(2):
+        for title, material in MATERIALS.items():
+            store.save_text("", "materiale", material["content"], title=title).result()
+
+    reopened = make_store(tmp_path)
+    rows, total = reopened.list_texts(kinds=("materiale",))
+    assert total == 2 and sorted(row["id"] for row in rows) == [1, 2]
+    assert reopened.search("piante")[1] == 1
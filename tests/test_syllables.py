@@ -0,0 +1,32 @@
+import pytest
+
+from syllables import Hyphenator, paragraph_html, syllabify
+
+
+@pytest.mark.parametrize("word, expected", [
+    ("amore", ("a", "mo", "re")),
+    ("pasta", ("pa", "sta")),
+    ("fischio", ("fi", "schio")),
+    ("psicologia", ("psi", "co", "lo", "gia")),
+    ("paese", ("pa", "e", "se")),
+    ("città", ("cit", "tà")),
+    ("sport", ("sport",)),
+])
+def test_syllabify(word, expected):
+    assert syllabify(word) == expected
+
+
+def test_syllabify_keeps_case():
+    assert syllabify("Fotosintesi") == ("Fo", "to", "sin", "te", "si")
+
+
+def test_liang_patterns():
+    # Il valore più alto vince; i valori dispari permettono la divisione
+    hyphenator = Hyphenator(["1ba", "a1b", "2bb"])
+    assert hyphenator.breaks("abba") == [2]
+    assert hyphenator.syllables("abba") == ("ab", "ba")
+    assert Hyphenator([]).syllables("parola") == ("parola",)
+
+
+def test_paragraph_html_alternates_syllables():
+    assert paragraph_html("casa <b>", syllables=True) == 'ca<span class="sillaba">sa</span> &lt;b&gt;'
@@ -0,0 +1,34 @@
+import transcribe
+from transcribe import FakeRecognizer, GoogleRecognizer, VoskRecognizer, get_recognizer
+
+
+def test_google_is_the_default_without_vosk(monkeypatch):
+    monkeypatch.delenv("DSA_STT_BACKEND", raising=False)
+    monkeypatch.setattr(transcribe, "vosk_missing", lambda: "Vosk non è installato")
+    recognizer = get_recognizer()
+    assert isinstance(recognizer, GoogleRecognizer)
+    assert recognizer.notice is None
+
+
+def test_requested_vosk_falls_back_with_a_notice(monkeypatch):
+    monkeypatch.setenv("DSA_STT_BACKEND", "vosk")
+    monkeypatch.setattr(transcribe, "vosk_missing", lambda: "Modello Vosk non configurato")
+    recognizer = get_recognizer()
+    assert isinstance(recognizer, GoogleRecognizer)
+    assert recognizer.notice.startswith("Modello Vosk non configurato")
+
+
+def test_vosk_is_used_when_ready(monkeypatch):
+    monkeypatch.delenv("DSA_STT_BACKEND", raising=False)
+    monkeypatch.setattr(transcribe, "vosk_missing", lambda: None)
+    assert isinstance(get_recognizer(), VoskRecognizer)
+
+
+def test_vosk_missing_model(monkeypatch, tmp_path):
+    monkeypatch.setattr(transcribe.importlib.util, "find_spec", lambda name: object())
+    assert "DSA_VOSK_MODEL" in transcribe.vosk_missing(str(tmp_path / "assente"))
+    assert transcribe.vosk_missing(str(tmp_path)) is None
+
+
+def test_explicit_backend():
+    assert isinstance(get_recognizer("fake"), FakeRecognizer)
@@ -0,0 +1,426 @@
+"""Trascrizione di registrazioni audio, divisa in segmenti di parlato
+
+La registrazione viene decodificata a blocchi in PCM mono a 16 bit (i WAV
+direttamente, gli altri formati con ffmpeg), così anche una lezione di
+un'ora resta in memoria solo pochi secondi alla volta. Un rilevatore di voce
+basato sull'energia divide l'audio in segmenti separati dalle pause; i
+segmenti vengono trascritti in parallelo dal motore scelto e restituiti in
+ordine appena pronti. La trascrizione di ogni segmento resta in cache.
+"""
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import wave
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import get_cache, make_key
+from metrics import span, submit
+
+# Formati accettati per il caricamento (oltre al WAV serve ffmpeg)
+AUDIO_EXTENSIONS = ["wav", "mp3", "m4a", "ogg", "flac", "webm"]
+# Frequenza di campionamento per i formati decodificati con ffmpeg
+SAMPLE_RATE = 16000
+# Secondi di audio decodificati a ogni blocco
+BLOCK_SECONDS = 10
+# Durata (ms) di un frame del rilevatore di voce
+FRAME_MS = 30
+# Decibel sopra il rumore di fondo perché un frame conti come parlato
+SPEECH_MARGIN_DB = 10
+# Energia minima (dBFS) del parlato, per non trascrivere il fruscio
+MIN_SPEECH_DBFS = -50
+# Velocità con cui la stima del rumore di fondo risale (per frame)
+FLOOR_RISE = 0.001
+# Pausa (ms) che chiude un segmento
+SILENCE_MS = 500
+# Audio (ms) tenuto prima e dopo ogni segmento, per non tagliare le parole
+PAD_MS = 200
+# Segmenti con meno parlato di così (ms) vengono scartati
+MIN_SPEECH_MS = 250
+# Durata massima (s) di un segmento: oltre si spezza anche senza pausa
+MAX_SEGMENT_SECONDS = 30
+# Segmenti trascritti contemporaneamente
+STT_WORKERS = int(os.environ.get("DSA_STT_WORKERS", str(os.cpu_count() or 2)))
+
+GOOGLE_LANGUAGES = {"it": "it-IT", "en": "en-US", "es": "es-ES", "fr": "fr-FR"}
+
+
+class Recognizer:
+    """Interfaccia per i motori di riconoscimento: da PCM mono a 16 bit a testo"""
+
+    name = "base"
+    # Motivo per cui si usa questo motore al posto di quello richiesto, da mostrare all'utente
+    notice = None
+
+    def recognize(self, pcm, rate, language):
+        raise NotImplementedError
+
+
+class VoskRecognizer(Recognizer):
+    """Vosk, completamente offline; la cartella del modello si indica in DSA_VOSK_MODEL"""
+
+    name = "vosk"
+
+    def __init__(self, model_path=None):
+        self.model_path = model_path or os.environ.get("DSA_VOSK_MODEL")
+        self._model = None
+        self._lock = threading.Lock()
+
+    def model(self):
+        """Modello caricato al primo segmento e condiviso dai thread"""
+        if not self.model_path:
+            raise RuntimeError(
+                "Modello Vosk non configurato: scarica un modello italiano da "
+                "https://alphacephei.com/vosk/models e indicane la cartella in DSA_VOSK_MODEL"
+            )
+        with self._lock:
+            if self._model is None:
+                from vosk import Model, SetLogLevel
+
+                SetLogLevel(-1)
+                self._model = Model(self.model_path)
+            return self._model
+
+    def recognize(self, pcm, rate, language):
+        from vosk import KaldiRecognizer
+
+        recognizer = KaldiRecognizer(self.model(), rate)
+        recognizer.AcceptWaveform(pcm)
+        return json.loads(recognizer.FinalResult()).get("text", "")
+
+
+class GoogleRecognizer(Recognizer):
+    """Servizio web di Google tramite SpeechRecognition (richiede la rete)"""
+
+    name = "google"
+
+    def recognize(self, pcm, rate, language):
+        import speech_recognition as sr
+
+        try:
+            return sr.Recognizer().recognize_google(
+                sr.AudioData(pcm, rate, 2), language=GOOGLE_LANGUAGES.get(language, language)
+            )
+        except sr.UnknownValueError:
+            return ""
+        except sr.RequestError as e:
+            raise RuntimeError(f"Errore nel servizio di riconoscimento: {e}") from None
+
+
+class FakeRecognizer(Recognizer):
+    """Motore finto e deterministico per test e benchmark: descrive il segmento"""
+
+    name = "fake"
+
+    def __init__(self, latency=0.0, real_time_factor=0.0):
+        self.latency = latency
+        self.real_time_factor = real_time_factor
+
+    def recognize(self, pcm, rate, language):
+        seconds = len(pcm) / 2 / rate
+        if self.latency or self.real_time_factor:
+            time.sleep(self.latency + seconds * self.real_time_factor)
+        return f"Segmento di {seconds:.1f} secondi."
+
+
+RECOGNIZERS = {
+    "vosk": VoskRecognizer,
+    "google": GoogleRecognizer,
+    "fake": FakeRecognizer,
+}
+
+
+def vosk_missing(model_path=None):
+    """Cosa manca per usare Vosk (pacchetto o modello), o `None` se è pronto"""
+    model_path = model_path or os.environ.get("DSA_VOSK_MODEL")
+    if importlib.util.find_spec("vosk") is None:
+        return "Vosk non è installato: per la trascrizione offline esegui `pip install vosk`"
+    if not model_path or not os.path.isdir(model_path):
+        return ("Modello Vosk non configurato: scarica un modello italiano da "
+                "https://alphacephei.com/vosk/models e indicane la cartella in DSA_VOSK_MODEL")
+    return None
+
+
+def get_recognizer(name=None):
+    """Crea il motore indicato (o quello in DSA_STT_BACKEND).
+
+    Senza indicazioni usa Vosk se è installato e configurato, altrimenti il
+    servizio di Google. Se Vosk è richiesto ma non è pronto si usa Google e
+    il motivo resta in `notice`.
+    """
+    name = name or os.environ.get("DSA_STT_BACKEND")
+    if name in (None, "vosk"):
+        missing = vosk_missing()
+        if missing is None:
+            return VoskRecognizer()
+        recognizer = GoogleRecognizer()
+        if name == "vosk":
+            recognizer.notice = f"{missing}. Per ora si usa il riconoscimento di Google (serve la rete)."
+        return recognizer
+    return RECOGNIZERS[name]()
+
+
+class Segment:
+    """Tratto di parlato: inizio e fine in secondi, audio e testo riconosciuto"""
+
+    __slots__ = ("index", "start", "end", "pcm", "text")
+
+    def __init__(self, index, start, end, pcm):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.pcm = pcm
+        self.text = None
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+# --- Decodifica ---
+
+def _to_mono16(data, width, channels):
+    """Campioni PCM interi di qualsiasi ampiezza -> int16 mono"""
+    import numpy as np
+
+    if width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.int16) - 128) << 8
+    elif width == 2:
+        samples = np.frombuffer(data, dtype="<i2")
+    elif width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        samples = (raw[:, 2].astype(np.int8).astype(np.int16) << 8) | raw[:, 1]
+    elif width == 4:
+        samples = (np.frombuffer(data, dtype="<i4") >> 16).astype(np.int16)
+    else:
+        raise ValueError(f"Campioni da {width} byte non supportati")
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    return samples
+
+
+def _wav_blocks(reader, block_frames):
+    try:
+        while True:
+            data = reader.readframes(block_frames)
+            if not data:
+                return
+            yield _to_mono16(data, reader.getsampwidth(), reader.getnchannels())
+    finally:
+        reader.close()
+
+
+def _ffmpeg_duration(path):
+    if not shutil.which("ffprobe"):
+        return None
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+        capture_output=True, text=True
+    )
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return None
+
+
+def _ffmpeg_blocks(path, block_bytes, cleanup):
+    import numpy as np
+
+    process = subprocess.Popen(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", path,
+         "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            yield np.frombuffer(data[:len(data) // 2 * 2], dtype="<i2")
+        if process.wait() != 0:
+            raise RuntimeError("Formato audio non riconosciuto: "
+                               + process.stderr.read().decode("utf-8", "replace").strip()[-200:])
+    finally:
+        process.kill()
+        process.stdout.close()
+        process.stderr.close()
+        if cleanup:
+            os.remove(path)
+
+
+def decode_audio(source, block_seconds=BLOCK_SECONDS):
+    """Apre una registrazione (percorso, byte o file caricato).
+
+    Restituisce `(frequenza, durata_in_secondi, blocchi)`, dove `blocchi` genera
+    array int16 mono di circa `block_seconds` secondi; la durata è `None` se
+    non si può sapere senza decodificare tutto il file.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        path, stream = os.fspath(source), None
+    else:
+        path = None
+        stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+
+    try:
+        reader = wave.open(path or stream, "rb")
+    except (wave.Error, EOFError):
+        # Non è un WAV PCM: si decodifica con ffmpeg
+        reader = None
+    if reader is not None:
+        rate = reader.getframerate()
+        duration = reader.getnframes() / rate
+        return rate, duration, _wav_blocks(reader, rate * block_seconds)
+
+    if not shutil.which("ffmpeg"):
+        raise RuntimeError("Per i formati diversi dal WAV serve ffmpeg installato sul server")
+    cleanup = path is None
+    if cleanup:
+        stream.seek(0)
+        with tempfile.NamedTemporaryFile(suffix=".audio", delete=False) as f:
+            shutil.copyfileobj(stream, f)
+            path = f.name
+    return SAMPLE_RATE, _ffmpeg_duration(path), _ffmpeg_blocks(path, SAMPLE_RATE * 2 * block_seconds, cleanup)
+
+
+# --- Rilevamento del parlato ---
+
+def detect_speech(blocks, rate):
+    """Divide l'audio in segmenti di parlato separati da pause.
+
+    Un frame è parlato se la sua energia supera di `SPEECH_MARGIN_DB` la stima
+    del rumore di fondo, che segue subito i minimi e risale lentamente. Un
+    segmento si chiude dopo `SILENCE_MS` di pausa o a `MAX_SEGMENT_SECONDS`;
+    in memoria c'è al massimo il segmento in corso.
+    """
+    import numpy as np
+
+    frame = max(1, rate * FRAME_MS // 1000)
+    seconds_per_frame = frame / rate
+    pad = PAD_MS // FRAME_MS
+    max_silence = SILENCE_MS // FRAME_MS
+    max_frames = MAX_SEGMENT_SECONDS * 1000 // FRAME_MS
+    min_speech = MIN_SPEECH_MS // FRAME_MS
+
+    before = deque(maxlen=pad)
+    current, start, voiced, silent = [], 0, 0, 0
+    position, index, floor = 0, 0, None
+    leftover = np.zeros(0, dtype=np.int16)
+
+    def close():
+        nonlocal current, index
+        # Della pausa finale resta solo il margine
+        frames = current[:len(current) - max(0, silent - pad)]
+        before.extend(current[len(frames):])
+        segment = None
+        if voiced >= min_speech:
+            segment = Segment(index, start * seconds_per_frame,
+                              (start + len(frames)) * seconds_per_frame, np.concatenate(frames).tobytes())
+            index += 1
+        current = []
+        return segment
+
+    for block in blocks:
+        samples = np.concatenate([leftover, block]) if len(leftover) else block
+        count = len(samples) // frame
+        leftover = samples[count * frame:]
+        frames = samples[:count * frame].reshape(count, frame)
+        power = np.mean(frames.astype(np.float32) ** 2, axis=1) / 32768.0 ** 2
+        energies = 10 * np.log10(power + 1e-10)
+
+        for samples_frame, energy in zip(frames, energies.tolist()):
+            if floor is None or energy < floor:
+                floor = energy
+            else:
+                floor += (energy - floor) * FLOOR_RISE
+            speech = energy > floor + SPEECH_MARGIN_DB and energy > MIN_SPEECH_DBFS
+
+            if current:
+                current.append(samples_frame)
+                if speech:
+                    voiced += 1
+                    silent = 0
+                else:
+                    silent += 1
+                if silent >= max_silence or len(current) >= max_frames:
+                    segment = close()
+                    if segment is not None:
+                        yield segment
+            elif speech:
+                current = list(before) + [samples_frame]
+                start = position - len(before)
+                voiced, silent = 1, 0
+                before.clear()
+            else:
+                before.append(samples_frame)
+            position += 1
+
+    if current:
+        segment = close()
+        if segment is not None:
+            yield segment
+
+
+# --- Trascrizione ---
+
+def transcribe_segment(segment, rate, language='it', recognizer=None):
+    """Testo di un segmento, riusando quello già riconosciuto per lo stesso audio"""
+    recognizer = recognizer or get_recognizer()
+    key = make_key(hashlib.sha256(segment.pcm).hexdigest(), rate, language, recognizer.name)
+
+    def compute():
+        with span(f"stt.{recognizer.name}", len(segment.pcm)):
+            return recognizer.recognize(segment.pcm, rate, language).strip()
+
+    return get_cache("stt").get_or_compute(key, compute)
+
+
+def transcribe(source, recognizer=None, language='it', max_workers=STT_WORKERS, progress=None):
+    """Genera i segmenti trascritti, in ordine, appena pronti.
+
+    I segmenti vengono riconosciuti in parallelo su `max_workers` thread;
+    al massimo due per thread attendono in coda, così la memoria resta
+    limitata anche per registrazioni molto lunghe. `progress(fatti, totali)`
+    riceve i secondi di audio già trascritti, se la durata è nota.
+    """
+    recognizer = recognizer or get_recognizer()
+    with span("stt.decode"):
+        rate, duration, blocks = decode_audio(source)
+    segments = detect_speech(blocks, rate)
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+
+    def ready(segment, future):
+        segment.text = future.result()
+        # L'audio non serve più: resta solo il testo
+        segment.pcm = None
+        if progress and duration:
+            progress(int(min(segment.end, duration)), int(duration))
+        return segment
+
+    try:
+        for segment in segments:
+            pending.append((segment, submit(pool, transcribe_segment, segment, rate, language, recognizer)))
+            while pending and (len(pending) >= 2 * max_workers or pending[0][1].done()):
+                yield ready(*pending.popleft())
+        while pending:
+            yield ready(*pending.popleft())
+        if progress and duration:
+            progress(int(duration), int(duration))
+    finally:
+        segments.close()
+        blocks.close()
+        # Se la lettura viene interrotta, i segmenti non ancora avviati non vengono trascritti
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def transcribe_text(source, recognizer=None, language='it', max_workers=STT_WORKERS):
+    """Trascrizione completa come unico testo"""
+    segments = transcribe(source, recognizer, language, max_workers)
+    return " ".join(segment.text for segment in segments if segment.text)
@@ -0,0 +1,144 @@
+"""Sintesi vocale divisa per frasi, con cache su disco di ogni frase"""
+import io
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import get_cache, make_key, normalize_text
+from metrics import span, submit, timed
+
+# Lunghezza massima (in caratteri) di un pezzo da sintetizzare
+MAX_CHUNK_CHARS = 200
+# Richieste di sintesi contemporanee per un singolo testo
+TTS_WORKERS = int(os.environ.get("DSA_TTS_WORKERS", "4"))
+
+# Frame MP3 silenzioso (MPEG-1 Layer III, 128 kbit/s, 44.1 kHz, ~26 ms)
+_SILENT_FRAME = b"\xff\xfb\x90\x00" + bytes(413)
+
+
+class TTSBackend:
+    """Interfaccia per i motori di sintesi: restituiscono byte MP3"""
+
+    name = "base"
+
+    def synthesize(self, text, lang, speed):
+        raise NotImplementedError
+
+
+class GTTSBackend(TTSBackend):
+    """Google Text-to-Speech (richiede la rete); supporta solo voce normale o lenta"""
+
+    name = "gtts"
+
+    def synthesize(self, text, lang, speed):
+        from gtts import gTTS
+
+        tts = gTTS(text=text, lang=lang, slow=speed < 0.8)
+        fp = io.BytesIO()
+        tts.write_to_fp(fp)
+        return fp.getvalue()
+
+
+class FakeTTSBackend(TTSBackend):
+    """Motore finto e deterministico per test e benchmark: produce silenzio"""
+
+    name = "fake"
+
+    def __init__(self, latency=0.0, frames_per_char=0.1):
+        self.latency = latency
+        self.frames_per_char = frames_per_char
+
+    def synthesize(self, text, lang, speed):
+        if self.latency:
+            time.sleep(self.latency)
+        frames = max(1, int(len(text) * self.frames_per_char / speed))
+        return _SILENT_FRAME * frames
+
+
+BACKENDS = {
+    "gtts": GTTSBackend,
+    "fake": FakeTTSBackend,
+}
+
+
+def get_backend(name=None):
+    """Crea il motore indicato (o quello in DSA_TTS_BACKEND, predefinito gTTS)"""
+    name = name or os.environ.get("DSA_TTS_BACKEND", "gtts")
+    return BACKENDS[name]()
+
+
+def _split_long(sentence, max_chars):
+    """Spezza una frase troppo lunga sulle virgole e, se serve, sulle parole"""
+    parts, current = [], ""
+    for piece in re.split(r"(?<=[,;:])\s+|\s+", sentence):
+        if not piece:
+            continue
+        if current and len(current) + 1 + len(piece) > max_chars:
+            parts.append(current)
+            current = ""
+        current = f"{current} {piece}" if current else piece
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_for_tts(text, language='it', max_chars=MAX_CHUNK_CHARS):
+    """Divide il testo in frasi da sintetizzare; le frasi lunghe vengono spezzate.
+
+    Ogni frase è un pezzo a sé, così la stessa frase in testi diversi
+    riusa l'audio in cache.
+    """
+    from document import LANGUAGES, get_document
+
+    chunks = []
+    for sentence in get_document(text, LANGUAGES.get(language, "italian")).sentences:
+        if len(sentence) <= max_chars:
+            chunks.append(sentence)
+        else:
+            chunks.extend(_split_long(sentence, max_chars))
+    return chunks
+
+
+def synthesize_chunk(chunk, language='it', speed=1.0, backend=None):
+    """Sintetizza una frase, riusando l'audio già prodotto per (frase, lingua, velocità)"""
+    backend = backend or get_backend()
+    key = make_key(normalize_text(chunk), language, speed, backend.name)
+
+    def compute():
+        with span(f"tts.{backend.name}") as info:
+            audio = backend.synthesize(chunk, language, speed)
+            info["bytes"] = len(audio)
+        return audio
+
+    return get_cache("tts").get_or_compute(key, compute)
+
+
+@timed("tts.synthesize")
+def synthesize_chunks(text, language='it', speed=1.0, backend=None, max_workers=TTS_WORKERS):
+    """Genera l'audio MP3 dei pezzi in ordine, sintetizzandoli in parallelo.
+
+    Il primo pezzo è disponibile appena pronto, così la riproduzione può
+    iniziare mentre i successivi sono ancora in elaborazione.
+    """
+    backend = backend or get_backend()
+    chunks = split_for_tts(text, language)
+    if not chunks:
+        return
+    pool = ThreadPoolExecutor(max_workers=min(max_workers, len(chunks)))
+    try:
+        futures = [submit(pool, synthesize_chunk, chunk, language, speed, backend) for chunk in chunks]
+        for future in futures:
+            yield future.result()
+    finally:
+        # Se la lettura viene interrotta, le frasi non ancora avviate non vengono sintetizzate
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+@timed("tts.text_to_speech")
+def text_to_speech(text, language='it', speed=1.0, backend=None):
+    """Converte testo in audio"""
+    # I frame MP3 sono indipendenti: i pezzi si possono concatenare
+    fp = io.BytesIO(b"".join(synthesize_chunks(text, language, speed, backend)))
+    fp.seek(0)
+    return fp